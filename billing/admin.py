@@ -1,3 +1,56 @@
 from django.contrib import admin
+from .models import Invoice, InvoiceLine, Payment, PatientAccount, LedgerEntry
+from .ledger import record_payment
 
-# Register your models here.
+
+class InvoiceLineInline(admin.TabularInline):
+    model = InvoiceLine
+    extra = 0
+    raw_id_fields = ('treatment_step',)
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(admin.ModelAdmin):
+    list_display = ('number', 'patient', 'status', 'total', 'issued_at')
+    list_filter = ('status', 'issued_at')
+    list_select_related = ('patient',)
+    raw_id_fields = ('patient', 'appointment', 'supplement_of')
+    inlines = [InvoiceLineInline]
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('invoice', 'patient', 'amount', 'method', 'paid_at')
+    list_filter = ('method', 'paid_at')
+    list_select_related = ('invoice', 'patient')
+    raw_id_fields = ('invoice',)
+    readonly_fields = ('patient',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # The ledger already posted it: a recorded payment can no longer change
+        if obj is not None:
+            return [field.name for field in obj._meta.fields]
+        return self.readonly_fields
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        # New payments must move the patient balance; go through the ledger
+        if not change:
+            record_payment(obj)
+
+
+class LedgerEntryInline(admin.TabularInline):
+    model = LedgerEntry
+    extra = 0
+    can_delete = False
+    readonly_fields = ('entry_type', 'invoice', 'payment', 'amount', 'balance_after', 'created_at')
+
+
+@admin.register(PatientAccount)
+class PatientAccountAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'invoiced_total', 'paid_total', 'balance', 'updated_at')
+    list_select_related = ('patient',)
+    readonly_fields = ('patient', 'invoiced_total', 'paid_total', 'balance', 'updated_at')
+    inlines = [LedgerEntryInline]
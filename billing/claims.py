@@ -0,0 +1,138 @@
+"""
+Insurance claims batch export (AMO / Mutuelle / Mutuelle FAR).
+
+Streams the completed treatment steps of one insurer for a period straight from
+a server-side cursor into a CSV or fixed-width batch file. insurance_id is read
+as raw ciphertext and decrypted per chunk, so memory stays flat whatever the
+month's volume and the other encrypted patient fields are never decrypted.
+"""
+import csv
+import os
+from datetime import datetime, time
+from decimal import Decimal
+from itertools import islice
+from django.db import connection
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from medical.models import Patient, TreatmentStep, decrypt_tokens
+
+INSURERS = [code for code, _ in Patient.INSURANCE_CHOICES if code != 'NONE']
+FORMATS = ('csv', 'fixed')
+
+CSV_HEADER = [
+    'sequence', 'insurer', 'insurance_id', 'patient_id', 'last_name', 'first_name',
+    'act_date', 'appointment_id', 'step_id', 'step_type', 'tooth_number', 'amount',
+]
+
+# Fixed-width detail record layout: (column, width). Amounts are in centimes.
+FIXED_LAYOUT = [
+    ('record_type', 1), ('sequence', 6), ('insurance_id', 20), ('last_name', 30),
+    ('first_name', 30), ('act_date', 8), ('step_type', 12), ('tooth_number', 2), ('amount', 12),
+]
+NUMERIC_COLUMNS = {'sequence', 'tooth_number', 'amount'}
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def claim_rows(insurer, start, end, chunk_size=2000):
+    """
+    Yield one dict per billable act. Runs on the current tenant schema.
+    Ordered by patient so a chunk decrypts each patient's insurance_id once.
+    """
+    queryset = (
+        TreatmentStep.objects
+        .filter(
+            status='completed',
+            appointment__StartTime__gte=_aware(start),
+            appointment__StartTime__lt=_aware(end),
+            appointment__patient__insurance_type=insurer,
+        )
+        .annotate(insurance_token=Cast('appointment__patient__insurance_id', TextField()))
+        .order_by('appointment__patient_id', 'appointment__StartTime', 'id')
+        .values_list(
+            'id', 'appointment_id', 'appointment__StartTime', 'step_type', 'tooth_number', 'price',
+            'appointment__patient_id', 'appointment__patient__last_name',
+            'appointment__patient__first_name', 'insurance_token',
+        )
+    )
+
+    rows = queryset.iterator(chunk_size=chunk_size)
+    sequence = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        insurance_ids = decrypt_tokens([row[-1] for row in chunk])
+        for row, insurance_id in zip(chunk, insurance_ids):
+            step_id, appointment_id, started, step_type, tooth, price, patient_id, last_name, first_name, _ = row
+            sequence += 1
+            yield {
+                'sequence': sequence,
+                'insurer': insurer,
+                'insurance_id': insurance_id or '',
+                'patient_id': patient_id,
+                'last_name': last_name,
+                'first_name': first_name,
+                'act_date': timezone.localtime(started).strftime('%Y%m%d'),
+                'appointment_id': appointment_id,
+                'step_id': step_id,
+                'step_type': step_type,
+                'tooth_number': tooth,
+                'amount': price,
+            }
+
+
+def _fixed_field(value, width, numeric):
+    value = str(value)
+    if numeric:
+        return value.rjust(width, '0')[-width:]
+    return value.ljust(width)[:width]
+
+
+def _fixed_record(row):
+    row = dict(row, record_type='D', amount=int(row['amount'] * 100))
+    return ''.join(_fixed_field(row[name], width, name in NUMERIC_COLUMNS) for name, width in FIXED_LAYOUT)
+
+
+def write_claims(out, insurer, start, end, fmt='csv', chunk_size=2000):
+    """
+    Write the claim batch for `insurer` to the text stream `out`.
+    Returns (number_of_acts, total_amount).
+    """
+    if insurer not in INSURERS:
+        raise ValueError(f"Unknown insurer '{insurer}'. Expected one of {INSURERS}.")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'. Expected one of {FORMATS}.")
+
+    count, total = 0, Decimal('0')
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(CSV_HEADER)
+    else:
+        out.write('H' + _fixed_field(insurer, 12, False) + _fixed_field(connection.schema_name, 30, False)
+                  + start.strftime('%Y%m%d') + end.strftime('%Y%m%d')
+                  + timezone.localdate().strftime('%Y%m%d') + '\n')
+
+    for row in claim_rows(insurer, start, end, chunk_size=chunk_size):
+        count += 1
+        total += row['amount']
+        if fmt == 'csv':
+            writer.writerow([row[column] for column in CSV_HEADER])
+        else:
+            out.write(_fixed_record(row) + '\n')
+
+    if fmt == 'fixed':
+        out.write('T' + _fixed_field(count, 6, True) + _fixed_field(int(total * 100), 14, True) + '\n')
+    return count, total
+
+
+def export_claims_file(output_dir, insurer, start, end, fmt='csv', chunk_size=2000):
+    """Write the current tenant's batch file into output_dir. Used by map_tenants workers."""
+    extension = 'csv' if fmt == 'csv' else 'txt'
+    path = os.path.join(output_dir, f"{connection.schema_name}_{insurer}_{start:%Y%m%d}_{end:%Y%m%d}.{extension}")
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        count, total = write_claims(out, insurer, start, end, fmt=fmt, chunk_size=chunk_size)
+    return {'path': path, 'count': count, 'total': total}
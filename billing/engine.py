@@ -0,0 +1,169 @@
+"""
+Invoice generation engine.
+
+Turns completed TreatmentSteps into Invoices/InvoiceLines with a couple of
+set-based statements per run instead of one ORM round trip per step.
+Idempotency comes from the database, not from Python bookkeeping:
+  - billing_invoice.source_key is UNIQUE  -> one invoice per appointment / patient period
+  - billing_invoiceline.treatment_step_id is UNIQUE -> a step is billed at most once
+so re-running the same window (or two runs racing) never double-bills.
+A step completed after the invoice of its source_key was paid (or cancelled)
+goes on a supplement invoice: source_key '<source_key>:+<first step id>',
+supplement_of pointing at the original. Later steps join that supplement while
+it is open, or start the next one.
+"""
+from datetime import date, datetime, time
+from django.db import connection, transaction
+from django.utils import timezone
+from .ledger import post_invoice_deltas
+
+MODE_APPOINTMENT = 'appointment'
+MODE_PERIOD = 'period'
+MODES = (MODE_APPOINTMENT, MODE_PERIOD)
+
+# Everything billable in the window that is not on an invoice yet.
+# "StartTime" is quoted because the Syncfusion-style column names are case-sensitive.
+BILLABLE_SQL = """
+    SELECT ts.id AS step_id,
+           ts.tooth_number,
+           ts.step_type,
+           ts.description,
+           ts.price,
+           a.id AS appointment_id,
+           a.patient_id,
+           {source_key} AS source_key
+    FROM medical_treatmentstep ts
+    JOIN medical_appointment a ON a.id = ts.appointment_id
+    WHERE ts.status = 'completed'
+      AND a."StartTime" >= %(start)s
+      AND a."StartTime" < %(end)s
+      {doctor_filter}
+      AND NOT EXISTS (
+          SELECT 1 FROM billing_invoiceline l WHERE l.treatment_step_id = ts.id
+      )
+"""
+
+# Where each billable step goes: its source_key invoice while that one is open
+# (or does not exist yet), else the latest open supplement, else a new supplement.
+TARGETED_SQL = """
+    SELECT b.*,
+           base.id AS base_id,
+           CASE WHEN base.id IS NULL OR base.status IN ('draft', 'issued') THEN b.source_key
+                ELSE COALESCE(
+                    (SELECT s.source_key FROM billing_invoice s
+                     WHERE s.supplement_of_id = base.id AND s.status IN ('draft', 'issued')
+                     ORDER BY s.id DESC LIMIT 1),
+                    b.source_key || ':+' || MIN(b.step_id) OVER (PARTITION BY b.source_key)
+                )
+           END AS target_key
+    FROM ({billable}) b
+    LEFT JOIN billing_invoice base ON base.source_key = b.source_key
+"""
+
+SOURCE_KEYS = {
+    MODE_APPOINTMENT: "'appt:' || a.id",
+    MODE_PERIOD: "'period:' || a.patient_id || ':' || %(period_start)s || ':' || %(period_end)s",
+}
+
+CREATE_INVOICES_SQL = """
+    WITH billable AS ({billable})
+    INSERT INTO billing_invoice (patient_id, appointment_id, period_start, period_end,
+                                 supplement_of_id, source_key, status, total, issued_at)
+    SELECT DISTINCT ON (target_key)
+           patient_id, {appointment_id}, {period_start}, {period_end},
+           CASE WHEN target_key = source_key THEN NULL ELSE base_id END, target_key, 'issued', 0, now()
+    FROM billable
+    ON CONFLICT (source_key) DO NOTHING
+"""
+
+# Attach the lines, then bump the totals of exactly the invoices that received lines.
+# RETURNING gives (invoice_id, patient_id, amount_added) which the ledger needs.
+CREATE_LINES_SQL = """
+    WITH billable AS ({billable}),
+    new_lines AS (
+        INSERT INTO billing_invoiceline (invoice_id, treatment_step_id, tooth_number,
+                                         step_type, description, amount)
+        SELECT i.id, b.step_id, b.tooth_number, b.step_type, b.description, b.price
+        FROM billable b
+        JOIN billing_invoice i ON i.source_key = b.target_key
+        WHERE i.status IN ('draft', 'issued')
+        ON CONFLICT (treatment_step_id) DO NOTHING
+        RETURNING invoice_id, amount
+    ),
+    added AS (
+        SELECT invoice_id, COUNT(*) AS line_count, SUM(amount) AS amount
+        FROM new_lines
+        GROUP BY invoice_id
+    )
+    UPDATE billing_invoice i
+    SET total = i.total + added.amount,
+        number = COALESCE(i.number, 'F' || to_char(i.issued_at, 'YYYYMM') || '-' || lpad(i.id::text, 6, '0'))
+    FROM added
+    WHERE i.id = added.invoice_id
+    RETURNING i.id, i.patient_id, added.line_count, added.amount
+"""
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def generate_invoices(start, end, mode=MODE_APPOINTMENT, doctor_id=None):
+    """
+    Bill every completed treatment step whose appointment starts in [start, end).
+
+    start/end are dates. mode='appointment' creates one invoice per appointment,
+    mode='period' one invoice per patient for the whole window.
+    Runs against the current tenant schema (use tenant_context / tenant_command).
+    Returns a dict with the run counters and the per-invoice deltas.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown invoicing mode '{mode}'. Expected one of {MODES}.")
+
+    params = {
+        'start': _aware(start),
+        'end': _aware(end),
+        'period_start': start.isoformat(),
+        'period_end': end.isoformat(),
+        'doctor_id': doctor_id,
+    }
+    billable = TARGETED_SQL.format(billable=BILLABLE_SQL.format(
+        source_key=SOURCE_KEYS[mode],
+        doctor_filter='AND a.doctor_id = %(doctor_id)s' if doctor_id else '',
+    ))
+    if mode == MODE_APPOINTMENT:
+        columns = {'appointment_id': 'appointment_id', 'period_start': 'NULL', 'period_end': 'NULL'}
+    else:
+        # period_end is stored inclusive for display; the window itself is half-open
+        columns = {
+            'appointment_id': 'NULL',
+            'period_start': '%(period_start)s::date',
+            'period_end': "(%(period_end)s::date - 1)",
+        }
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_INVOICES_SQL.format(billable=billable, **columns), params)
+            invoices_created = cursor.rowcount
+
+            cursor.execute(CREATE_LINES_SQL.format(billable=billable), params)
+            rows = cursor.fetchall()
+
+        # Balances move in the same transaction as the lines that caused them
+        deltas = [(invoice_id, patient_id, amount) for invoice_id, patient_id, _, amount in rows]
+        post_invoice_deltas(deltas)
+
+    return {
+        'invoices_created': invoices_created,
+        'invoices_touched': len(rows),
+        'lines_created': sum(row[2] for row in rows),
+        'amount': sum((row[3] for row in rows), 0),
+        'deltas': deltas,
+    }
+
+
+def invoice_run_task(start, end, mode=MODE_APPOINTMENT, doctor_id=None):
+    """Job queue entry point (clinics.jobs): ISO dates in, JSON-friendly counters out."""
+    result = generate_invoices(date.fromisoformat(start), date.fromisoformat(end), mode=mode, doctor_id=doctor_id)
+    result.pop('deltas')
+    return result
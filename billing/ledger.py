@@ -0,0 +1,128 @@
+"""
+Patient account ledger.
+
+Every change to what a patient owes goes through here, in the same transaction
+as the invoice/payment that caused it, so PatientAccount.balance is always a
+materialized SUM(invoices) - SUM(payments) and never has to be recomputed on read.
+"""
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from core.cache import PATIENTS, invalidate
+from .models import CANCELLED_INVOICE_MESSAGE, PatientAccount, LedgerEntry, Invoice
+
+# Set-based posting of invoice amounts coming out of the invoice engine.
+# 1. upsert one account per patient, adding the batch total (row lock via ON CONFLICT)
+# 2. write one ledger entry per invoice with a running balance computed by a window
+#    function, ending on the account's new balance.
+POST_INVOICE_DELTAS_SQL = """
+    WITH d AS (
+        SELECT * FROM unnest(%(invoice_ids)s::bigint[], %(patient_ids)s::bigint[], %(amounts)s::numeric[])
+            AS t(invoice_id, patient_id, amount)
+    ),
+    per_patient AS (
+        SELECT patient_id, SUM(amount) AS amount FROM d GROUP BY patient_id
+    ),
+    accounts AS (
+        INSERT INTO billing_patientaccount (patient_id, invoiced_total, paid_total, balance, updated_at)
+        SELECT patient_id, amount, 0, amount, now() FROM per_patient
+        ON CONFLICT (patient_id) DO UPDATE
+        SET invoiced_total = billing_patientaccount.invoiced_total + EXCLUDED.invoiced_total,
+            balance = billing_patientaccount.balance + EXCLUDED.balance,
+            updated_at = now()
+        RETURNING id, patient_id, balance
+    )
+    INSERT INTO billing_ledgerentry (account_id, entry_type, invoice_id, amount, balance_after, created_at)
+    SELECT acc.id, 'INVOICE', d.invoice_id, d.amount,
+           acc.balance - pp.amount + SUM(d.amount) OVER (PARTITION BY d.patient_id ORDER BY d.invoice_id),
+           now()
+    FROM d
+    JOIN accounts acc ON acc.patient_id = d.patient_id
+    JOIN per_patient pp ON pp.patient_id = d.patient_id
+"""
+
+
+def post_invoice_deltas(deltas):
+    """
+    Post (invoice_id, patient_id, amount) rows to the ledger in one statement.
+    Must be called inside the transaction that created the invoice lines.
+    """
+    if not deltas:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(POST_INVOICE_DELTAS_SQL, {
+            'invoice_ids': [row[0] for row in deltas],
+            'patient_ids': [row[1] for row in deltas],
+            'amounts': [row[2] for row in deltas],
+        })
+    # Patient list / detail show the balance
+    invalidate(PATIENTS)
+
+
+def _lock_account(patient_id):
+    account, _ = PatientAccount.objects.select_for_update().get_or_create(patient_id=patient_id)
+    return account
+
+
+def _post(account, entry_type, amount, invoice=None, payment=None):
+    account.balance += amount
+    account.save(update_fields=['invoiced_total', 'paid_total', 'balance', 'updated_at'])
+    invalidate(PATIENTS)
+    return LedgerEntry.objects.create(
+        account=account,
+        entry_type=entry_type,
+        invoice=invoice,
+        payment=payment,
+        amount=amount,
+        balance_after=account.balance,
+    )
+
+
+def record_payment(payment):
+    """
+    Save a new Payment and move the patient's balance in the same transaction.
+    Raises ValidationError if the invoice is cancelled (checked under its row lock).
+    """
+    with transaction.atomic():
+        invoice = Invoice.objects.select_for_update().get(pk=payment.invoice_id)
+        if invoice.status == 'cancelled':
+            raise ValidationError({'invoice': CANCELLED_INVOICE_MESSAGE})
+        payment.patient_id = invoice.patient_id
+        payment.save()
+
+        account = _lock_account(invoice.patient_id)
+        account.paid_total += payment.amount
+        _post(account, 'PAYMENT', -payment.amount, invoice=invoice, payment=payment)
+
+        paid = sum(invoice.payments.values_list('amount', flat=True), Decimal('0'))
+        if invoice.status == 'issued' and paid >= invoice.total:
+            invoice.status = 'paid'
+            invoice.save(update_fields=['status'])
+    return payment
+
+
+def cancel_invoice(invoice):
+    """Cancel an invoice and take its total back off the patient's balance."""
+    with transaction.atomic():
+        invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+        if invoice.status == 'cancelled':
+            return invoice
+        invoice.status = 'cancelled'
+        invoice.save(update_fields=['status'])
+
+        account = _lock_account(invoice.patient_id)
+        account.invoiced_total -= invoice.total
+        _post(account, 'CANCELLATION', -invoice.total, invoice=invoice)
+    return invoice
+
+
+def adjust_account(account, invoiced_total, paid_total):
+    """Force an account to the given source totals, leaving an ADJUSTMENT entry for the difference."""
+    with transaction.atomic():
+        account = PatientAccount.objects.select_for_update().get(pk=account.pk)
+        target = invoiced_total - paid_total
+        delta = target - account.balance
+        account.invoiced_total = invoiced_total
+        account.paid_total = paid_total
+        _post(account, 'ADJUSTMENT', delta)
+    return account
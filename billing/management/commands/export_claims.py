@@ -0,0 +1,67 @@
+import os
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from billing.claims import INSURERS, FORMATS, export_claims_file
+from billing.management.commands.generate_invoices import previous_month
+from clinics.parallel import map_tenants
+
+
+class Command(BaseCommand):
+    help = ('Exports the insurance claims batch file of a period. '
+            'One clinic: manage.py tenant_command export_claims --schema=clinic_atlas --insurer AMO. '
+            'All clinics in parallel: manage.py export_claims --all-tenants --insurer AMO')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--insurer', choices=INSURERS, required=True)
+        parser.add_argument('--start', help='First day of the period (YYYY-MM-DD). Defaults to last month.')
+        parser.add_argument('--end', help='Day after the period (YYYY-MM-DD, exclusive).')
+        parser.add_argument('--format', choices=FORMATS, default='csv', dest='fmt')
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--all-tenants', action='store_true', help='Export every clinic, one process per clinic.')
+        parser.add_argument('--processes', type=int, default=4)
+
+    def handle(self, *args, **options):
+        start, end = previous_month()
+        try:
+            if options['start']:
+                start = date.fromisoformat(options['start'])
+            if options['end']:
+                end = date.fromisoformat(options['end'])
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if start >= end:
+            raise CommandError("--start must be before --end.")
+        os.makedirs(options['output_dir'], exist_ok=True)
+
+        kwargs = {
+            'output_dir': options['output_dir'],
+            'insurer': options['insurer'],
+            'start': start,
+            'end': end,
+            'fmt': options['fmt'],
+            'chunk_size': options['chunk_size'],
+        }
+
+        if options['all_tenants']:
+            failures = 0
+            for schema_name, result, error, _ in map_tenants('billing.claims.export_claims_file',
+                                                          processes=options['processes'], **kwargs):
+                if error:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"[{schema_name}] ❌ {error}"))
+                else:
+                    self._report(schema_name, result)
+            if failures:
+                raise CommandError(f"{failures} clinic(s) failed.")
+            return
+
+        if connection.schema_name == 'public':
+            raise CommandError("Run through tenant_command --schema=<clinic>, or pass --all-tenants.")
+        self._report(connection.schema_name, export_claims_file(**kwargs))
+
+    def _report(self, schema_name, result):
+        self.stdout.write(self.style.SUCCESS(
+            f"[{schema_name}] ✅ {result['count']} acts, {result['total']} MAD -> {result['path']}"
+        ))
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from billing.engine import generate_invoices, MODES, MODE_APPOINTMENT
+
+
+def previous_month():
+    first_of_this_month = date.today().replace(day=1)
+    first_of_last_month = (first_of_this_month - timedelta(days=1)).replace(day=1)
+    return first_of_last_month, first_of_this_month
+
+
+class Command(BaseCommand):
+    help = ('Bills completed treatment steps of the current tenant for a window [start, end). '
+            'Safe to re-run. Usage: manage.py tenant_command generate_invoices --schema=clinic_atlas')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day of the window (YYYY-MM-DD). Defaults to last month.')
+        parser.add_argument('--end', help='Day after the window (YYYY-MM-DD, exclusive).')
+        parser.add_argument('--mode', choices=MODES, default=MODE_APPOINTMENT,
+                            help='One invoice per appointment, or one per patient for the whole period.')
+        parser.add_argument('--doctor', type=int, help='Only bill appointments of this doctor id.')
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Invoices live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        start, end = previous_month()
+        try:
+            if options['start']:
+                start = date.fromisoformat(options['start'])
+            if options['end']:
+                end = date.fromisoformat(options['end'])
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if start >= end:
+            raise CommandError("--start must be before --end.")
+
+        result = generate_invoices(start, end, mode=options['mode'], doctor_id=options['doctor'])
+
+        self.stdout.write(
+            f"[{connection.schema_name}] {start} -> {end}: "
+            f"{result['invoices_created']} new invoices, "
+            f"{result['lines_created']} lines on {result['invoices_touched']} invoices, "
+            f"{result['amount']} MAD billed."
+        )
+        self.stdout.write(self.style.SUCCESS("✅ Invoice run complete"))
@@ -0,0 +1,79 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from billing.ledger import adjust_account
+from billing.models import PatientAccount
+
+# One keyset page of patients with their source totals next to the materialized ones.
+# The LATERAL sums hit the patient_id FK indexes of billing_invoice / billing_payment.
+BATCH_SQL = """
+    SELECT p.id,
+           COALESCE(inv.total, 0),
+           COALESCE(pay.total, 0),
+           acc.id,
+           acc.invoiced_total,
+           acc.paid_total,
+           acc.balance
+    FROM medical_patient p
+    LEFT JOIN billing_patientaccount acc ON acc.patient_id = p.id
+    LEFT JOIN LATERAL (
+        SELECT SUM(total) AS total FROM billing_invoice
+        WHERE patient_id = p.id AND status <> 'cancelled'
+    ) inv ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(amount) AS total FROM billing_payment WHERE patient_id = p.id
+    ) pay ON TRUE
+    WHERE p.id > %s
+    ORDER BY p.id
+    LIMIT %s
+"""
+
+
+class Command(BaseCommand):
+    help = ('Verifies materialized patient balances against invoices and payments, in batches. '
+            'Usage: manage.py tenant_command reconcile_balances --schema=clinic_atlas [--fix]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--fix', action='store_true', help='Rewrite drifted accounts with an ADJUSTMENT entry.')
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Balances live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = drifted = 0
+
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(BATCH_SQL, [last_id, batch_size])
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            for patient_id, invoiced, paid, account_id, acc_invoiced, acc_paid, acc_balance in rows:
+                checked += 1
+                if account_id is None:
+                    if invoiced == 0 and paid == 0:
+                        continue
+                    acc_invoiced = acc_paid = acc_balance = Decimal('0')
+                elif (acc_invoiced, acc_paid, acc_balance) == (invoiced, paid, invoiced - paid):
+                    continue
+
+                drifted += 1
+                self.stdout.write(self.style.WARNING(
+                    f"Patient {patient_id}: ledger {acc_invoiced}/{acc_paid} (balance {acc_balance}) "
+                    f"!= source {invoiced}/{paid} (balance {invoiced - paid})"
+                ))
+                if options['fix']:
+                    account = PatientAccount(pk=account_id) if account_id else \
+                        PatientAccount.objects.get_or_create(patient_id=patient_id)[0]
+                    adjust_account(account, invoiced, paid)
+
+        summary = f"[{connection.schema_name}] {checked} patients checked, {drifted} drifted"
+        if drifted and not options['fix']:
+            self.stdout.write(self.style.ERROR(summary + " (re-run with --fix to repair)"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ {summary}"))
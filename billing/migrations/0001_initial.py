@@ -0,0 +1,60 @@
+# Generated by Django 5.2.9 on 2026-10-19 01:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('medical', '0008_remove_patient_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField(blank=True, null=True)),
+                ('period_end', models.DateField(blank=True, null=True)),
+                ('source_key', models.CharField(max_length=64, unique=True)),
+                ('number', models.CharField(blank=True, max_length=32, null=True, unique=True)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('issued', 'Issued'), ('paid', 'Paid'), ('cancelled', 'Cancelled')], default='issued', max_length=20)),
+                ('total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('issued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='medical.appointment')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='medical.patient')),
+            ],
+            options={
+                'ordering': ['-issued_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InvoiceLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tooth_number', models.IntegerField(blank=True, null=True)),
+                ('step_type', models.CharField(blank=True, max_length=20)),
+                ('description', models.TextField(blank=True)),
+                ('amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='billing.invoice')),
+                ('treatment_step', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoice_line', to='medical.treatmentstep')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('method', models.CharField(choices=[('CASH', 'Espèces'), ('CARD', 'Carte'), ('CHEQUE', 'Chèque'), ('TRANSFER', 'Virement'), ('INSURANCE', 'Assurance')], default='CASH', max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('paid_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='billing.invoice')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='medical.patient')),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.9 on 2026-10-19 01:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0001_initial'),
+        ('medical', '0008_remove_patient_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoiced_total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('paid_total', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='account', to='medical.patient')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('INVOICE', 'Invoice'), ('PAYMENT', 'Payment'), ('CANCELLATION', 'Cancellation'), ('ADJUSTMENT', 'Adjustment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='billing.invoice')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='billing.payment')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='billing.patientaccount')),
+            ],
+            options={
+                'ordering': ['account', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='patientaccount',
+            index=models.Index(condition=models.Q(('balance__gt', 0)), fields=['-balance'], name='billing_acc_outstanding_idx'),
+        ),
+    ]
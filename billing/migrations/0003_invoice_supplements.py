@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-19 02:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_patientaccount_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='supplement_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='supplements', to='billing.invoice'),
+        ),
+    ]
@@ -1,3 +1,124 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+from medical.models import Patient, Appointment, TreatmentStep
 
-# Create your models here.
+
+CANCELLED_INVOICE_MESSAGE = "Cette facture est annulée : aucun paiement ne peut y être enregistré."
+
+
+class Invoice(models.Model):
+    STATUS_CHOICES = [
+        ('draft', 'Draft'),
+        ('issued', 'Issued'),
+        ('paid', 'Paid'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.PROTECT, related_name='invoices')
+    # Set for per-appointment invoices, NULL for per-period invoices
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoices')
+    period_start = models.DateField(null=True, blank=True)
+    period_end = models.DateField(null=True, blank=True)
+
+    # Deterministic key of what this invoice covers ('appt:<id>' or 'period:<patient>:<start>:<end>').
+    # The unique constraint is what makes the invoice engine idempotent.
+    source_key = models.CharField(max_length=64, unique=True)
+    number = models.CharField(max_length=32, unique=True, null=True, blank=True)
+    # Steps completed after the invoice of their source_key was paid or cancelled go on a
+    # supplement ('<source_key>:+<first step id>') pointing at that invoice
+    supplement_of = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='supplements')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='issued')
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    issued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-issued_at']
+
+    def __str__(self):
+        return f"Invoice {self.number or self.source_key} ({self.total} MAD)"
+
+
+class InvoiceLine(models.Model):
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='lines')
+    # One line per treatment step, ever: a step can never be billed twice
+    treatment_step = models.OneToOneField(TreatmentStep, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoice_line')
+    tooth_number = models.IntegerField(null=True, blank=True)
+    step_type = models.CharField(max_length=20, blank=True)
+    description = models.TextField(blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+
+    def __str__(self):
+        return f"{self.step_type} on {self.tooth_number}: {self.amount}"
+
+
+class Payment(models.Model):
+    METHOD_CHOICES = [
+        ('CASH', 'Espèces'),
+        ('CARD', 'Carte'),
+        ('CHEQUE', 'Chèque'),
+        ('TRANSFER', 'Virement'),
+        ('INSURANCE', 'Assurance'),
+    ]
+
+    invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT, related_name='payments')
+    patient = models.ForeignKey(Patient, on_delete=models.PROTECT, related_name='payments')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES, default='CASH')
+    reference = models.CharField(max_length=100, blank=True)
+    paid_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Payment {self.amount} MAD on {self.invoice}"
+
+    def clean(self):
+        if self.invoice_id and self.invoice.status == 'cancelled':
+            raise ValidationError({'invoice': CANCELLED_INVOICE_MESSAGE})
+
+
+class PatientAccount(models.Model):
+    """
+    Materialized running balance per patient (amount owed = invoiced - paid).
+    Only ever updated through billing.ledger, inside the same transaction as the
+    invoice/payment that moved it. `reconcile_balances` checks it against the source rows.
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name='account')
+    invoiced_total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # "Who owes us money" is a single index scan over a small partial index
+            models.Index(fields=['-balance'], name='billing_acc_outstanding_idx', condition=models.Q(balance__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.patient}: {self.balance} MAD"
+
+
+class LedgerEntry(models.Model):
+    ENTRY_CHOICES = [
+        ('INVOICE', 'Invoice'),
+        ('PAYMENT', 'Payment'),
+        ('CANCELLATION', 'Cancellation'),
+        ('ADJUSTMENT', 'Adjustment'),
+    ]
+
+    account = models.ForeignKey(PatientAccount, on_delete=models.CASCADE, related_name='entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_CHOICES)
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    # Signed: positive increases what the patient owes, negative decreases it
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['account', 'id']
+
+    def __str__(self):
+        return f"{self.entry_type} {self.amount} -> {self.balance_after}"
@@ -0,0 +1,51 @@
+from rest_framework import serializers
+from .models import CANCELLED_INVOICE_MESSAGE, Invoice, InvoiceLine, Payment, PatientAccount, LedgerEntry
+
+
+class InvoiceLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InvoiceLine
+        fields = ['id', 'treatment_step', 'tooth_number', 'step_type', 'description', 'amount']
+
+
+class InvoiceSerializer(serializers.ModelSerializer):
+    lines = InvoiceLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Invoice
+        fields = [
+            'id', 'number', 'patient', 'appointment', 'period_start', 'period_end',
+            'supplement_of', 'status', 'total', 'issued_at', 'lines'
+        ]
+
+
+class PaymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Payment
+        fields = ['id', 'invoice', 'patient', 'amount', 'method', 'reference', 'paid_at', 'created_at']
+        read_only_fields = ['patient', 'created_at']
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Le montant doit être positif.")
+        return value
+
+    def validate_invoice(self, value):
+        if value.status == 'cancelled':
+            raise serializers.ValidationError(CANCELLED_INVOICE_MESSAGE)
+        return value
+
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LedgerEntry
+        fields = ['id', 'entry_type', 'invoice', 'payment', 'amount', 'balance_after', 'created_at']
+
+
+class OutstandingAccountSerializer(serializers.ModelSerializer):
+    """Used ONLY for the 'patients who owe money' list."""
+    patient_name = serializers.CharField(source='patient.full_name', read_only=True)
+
+    class Meta:
+        model = PatientAccount
+        fields = ['patient', 'patient_name', 'invoiced_total', 'paid_total', 'balance', 'updated_at']
@@ -1,3 +1,188 @@
-from django.test import TestCase
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+from django.utils import timezone
+from django_tenants.utils import tenant_context
+from rest_framework.test import APIRequestFactory, force_authenticate
+from medical.models import Patient, Appointment, TreatmentStep
+from medical.tests import TwoClinicsMixin
+from users.models import User
+from .claims import write_claims
+from .engine import MODE_PERIOD, generate_invoices
+from .ledger import cancel_invoice
+from .models import Invoice, LedgerEntry, Payment, PatientAccount
+from .views import payment_create
 
-# Create your tests here.
+
+class BillingMixin(TwoClinicsMixin):
+    """A doctor and one appointment of the first clinic's patient, with helpers to add treatment steps."""
+
+    def setUp(self):
+        super().setUp()
+        self.clinic = self.clinics[0]
+        self.user = User.objects.create_user(username='billing_admin', password='x', role='ADMIN',
+                                             clinic_id=self.clinic.id)
+        self.factory = APIRequestFactory()
+        self.start = timezone.localdate() - timedelta(days=7)
+        moment = timezone.now() - timedelta(days=3)
+        with tenant_context(self.clinic):
+            self.patient = Patient.objects.get()
+            self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.user, Subject='Soins',
+                                                          StartTime=moment, EndTime=moment + timedelta(minutes=30))
+
+    def tearDown(self):
+        self.user.delete()
+        super().tearDown()
+
+    def add_step(self, price, tooth_number=11):
+        return TreatmentStep.objects.create(appointment=self.appointment, tooth_number=tooth_number,
+                                            step_type='filling', price=Decimal(price), status='completed')
+
+    def pay(self, invoice, amount):
+        request = self.factory.post('/api/billing/payments/', {'invoice': invoice.pk, 'amount': amount}, format='json')
+        force_authenticate(request, user=self.user)
+        return payment_create(request)
+
+
+class PaymentTests(BillingMixin, TransactionTestCase):
+    """Payments move the balance once, never land on a cancelled invoice and cannot be edited afterwards."""
+
+    def setUp(self):
+        super().setUp()
+        with tenant_context(self.clinic):
+            self.invoice = Invoice.objects.create(patient=self.patient, source_key='appt:test', total=Decimal('300'))
+
+    def test_cancelled_invoice_refuses_payments(self):
+        with tenant_context(self.clinic):
+            cancel_invoice(self.invoice)
+            response = self.pay(self.invoice, '100.00')
+            self.assertEqual((response.status_code, list(response.data)), (400, ['invoice']))
+            self.assertFalse(Payment.objects.exists())
+
+    def test_payment_settles_the_invoice(self):
+        with tenant_context(self.clinic):
+            self.assertEqual(self.pay(self.invoice, '300.00').status_code, 201)
+            self.invoice.refresh_from_db()
+            self.assertEqual(self.invoice.status, 'paid')
+            self.assertEqual(PatientAccount.objects.get(patient=self.patient).paid_total, Decimal('300'))
+
+    def test_admin_payment_is_read_only_once_recorded(self):
+        admin = site._registry[Payment]
+        request = self.factory.get('/admin/billing/payment/')
+        request.user = self.user
+        with tenant_context(self.clinic):
+            self.pay(self.invoice, '50.00')
+            payment = Payment.objects.get()
+            self.assertEqual(set(admin.get_readonly_fields(request, payment)),
+                             {field.name for field in Payment._meta.fields})
+            self.assertEqual(tuple(admin.get_readonly_fields(request)), ('patient',))
+            self.assertFalse(admin.has_delete_permission(request, payment))
+
+
+class InvoiceRunTests(BillingMixin, TransactionTestCase):
+    """End to end: completed steps -> invoices, lines and ledger; re-runs bill nothing twice."""
+
+    def run_invoices(self, **kwargs):
+        return generate_invoices(self.start, timezone.localdate() + timedelta(days=1), **kwargs)
+
+    def balance(self):
+        return PatientAccount.objects.get(patient=self.patient).balance
+
+    def test_run_bills_each_step_once(self):
+        with tenant_context(self.clinic):
+            self.add_step('200.00')
+            self.add_step('150.50', tooth_number=12)
+            TreatmentStep.objects.create(appointment=self.appointment, tooth_number=13, step_type='crown',
+                                         price=Decimal('900'), status='pending')
+
+            result = self.run_invoices()
+            self.assertEqual((result['invoices_created'], result['lines_created'], result['amount']),
+                             (1, 2, Decimal('350.50')))
+            invoice = Invoice.objects.get()
+            self.assertEqual((invoice.source_key, invoice.total, invoice.lines.count()),
+                             (f'appt:{self.appointment.pk}', Decimal('350.50'), 2))
+            self.assertTrue(invoice.number.startswith('F'))
+            self.assertEqual(self.balance(), Decimal('350.50'))
+            self.assertEqual(list(LedgerEntry.objects.values_list('entry_type', 'amount', 'balance_after')),
+                             [('INVOICE', Decimal('350.50'), Decimal('350.50'))])
+
+            again = self.run_invoices()
+            self.assertEqual((again['invoices_created'], again['lines_created']), (0, 0))
+            self.assertEqual(self.balance(), Decimal('350.50'))
+
+    def test_steps_after_payment_go_on_a_supplement(self):
+        with tenant_context(self.clinic):
+            self.add_step('200.00')
+            self.run_invoices()
+            invoice = Invoice.objects.get()
+            self.assertEqual(self.pay(invoice, '200.00').status_code, 201)
+
+            late = self.add_step('80.00', tooth_number=21)
+            self.assertEqual(self.run_invoices()['invoices_created'], 1)
+            supplement = Invoice.objects.get(supplement_of=invoice)
+            self.assertEqual((supplement.source_key, supplement.total, supplement.status),
+                             (f'{invoice.source_key}:+{late.pk}', Decimal('80.00'), 'issued'))
+            self.assertEqual(self.balance(), Decimal('80.00'))
+
+            # The supplement is still open: the next step joins it
+            self.add_step('20.00', tooth_number=22)
+            self.assertEqual(self.run_invoices()['invoices_created'], 0)
+            supplement.refresh_from_db()
+            self.assertEqual(supplement.total, Decimal('100.00'))
+            invoice.refresh_from_db()
+            self.assertEqual((invoice.status, invoice.total), ('paid', Decimal('200.00')))
+            self.assertEqual(self.balance(), Decimal('100.00'))
+
+    def test_period_mode_groups_the_patient(self):
+        with tenant_context(self.clinic):
+            self.add_step('50.00')
+            self.add_step('70.00', tooth_number=12)
+            self.assertEqual(self.run_invoices(mode=MODE_PERIOD)['invoices_created'], 1)
+            invoice = Invoice.objects.get()
+            self.assertEqual((invoice.appointment_id, invoice.period_start, invoice.total),
+                             (None, self.start, Decimal('120.00')))
+
+
+class ClaimsExportTests(BillingMixin, TransactionTestCase):
+    """The batch lists the insurer's completed acts with the decrypted insurance_id, and adds them up."""
+
+    def setUp(self):
+        super().setUp()
+        with tenant_context(self.clinic):
+            self.patient.insurance_type = 'AMO'
+            self.patient.insurance_id = 'AMO-445566'
+            self.patient.save()
+            self.add_step('200.00')
+            self.add_step('150.50', tooth_number=12)
+            TreatmentStep.objects.create(appointment=self.appointment, tooth_number=13, step_type='crown',
+                                         price=Decimal('900'), status='pending')
+
+    def export(self, fmt, insurer='AMO'):
+        out = io.StringIO()
+        with tenant_context(self.clinic):
+            totals = write_claims(out, insurer, self.start, timezone.localdate() + timedelta(days=1), fmt=fmt)
+        return totals, out.getvalue()
+
+    def test_csv_batch(self):
+        (count, total), content = self.export('csv')
+        self.assertEqual((count, total), (2, Decimal('350.50')))
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([(row['insurance_id'], row['amount'], row['sequence']) for row in rows],
+                         [('AMO-445566', '200.00', '1'), ('AMO-445566', '150.50', '2')])
+        self.assertEqual(self.export('csv', insurer='MUTUELLE')[0], (0, Decimal('0')))
+
+    def test_fixed_width_trailer_carries_the_totals(self):
+        _, content = self.export('fixed')
+        header, *details, trailer = content.splitlines()
+        self.assertEqual((header[0], len(details)), ('H', 2))
+        self.assertEqual(details[0][7:27], 'AMO-445566'.ljust(20))
+        self.assertEqual(trailer, 'T' + '000002' + '00000000035050')
+
+    def test_start_must_come_before_end(self):
+        with self.assertRaisesMessage(CommandError, '--start must be before --end.'):
+            call_command('export_claims', insurer='AMO', start='2026-02-01', end='2026-02-01')
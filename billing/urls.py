@@ -0,0 +1,21 @@
+from django.urls import path
+from .views import (
+    invoice_list,
+    invoice_detail,
+    invoice_run,
+    payment_create,
+    patient_account,
+    outstanding_list
+)
+
+urlpatterns = [
+    # Invoices
+    path('invoices/', invoice_list, name='invoice-list'),
+    path('invoices/<int:pk>/', invoice_detail, name='invoice-detail'),
+    path('invoices/generate/', invoice_run, name='invoice-run'),
+
+    # Payments & balances
+    path('payments/', payment_create, name='payment-create'),
+    path('accounts/outstanding/', outstanding_list, name='account-outstanding'),
+    path('accounts/<int:patient_id>/', patient_account, name='patient-account'),
+]
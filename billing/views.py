@@ -1,3 +1,127 @@
-from django.shortcuts import render
+from datetime import date
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404
+from clinics.jobs import enqueue
+from medical.views import StandardResultsSetPagination
+from .models import Invoice, Payment, PatientAccount
+from .serializers import (
+    InvoiceSerializer,
+    PaymentSerializer,
+    LedgerEntrySerializer,
+    OutstandingAccountSerializer
+)
+from .engine import MODES, MODE_APPOINTMENT
+from .ledger import record_payment
 
-# Create your views here.
+
+# --------------------------
+# Invoice Views
+# --------------------------
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def invoice_list(request):
+    """
+    List invoices (optionally filtered by patient).
+    Query Param: ?patient=<id>
+    """
+    invoices = Invoice.objects.prefetch_related('lines')
+
+    patient_id = request.query_params.get('patient')
+    if patient_id:
+        invoices = invoices.filter(patient_id=patient_id)
+
+    paginator = StandardResultsSetPagination()
+    result_page = paginator.paginate_queryset(invoices, request)
+    serializer = InvoiceSerializer(result_page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def invoice_detail(request, pk):
+    invoice = get_object_or_404(Invoice.objects.prefetch_related('lines'), pk=pk)
+    serializer = InvoiceSerializer(invoice, context={'request': request})
+    return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def invoice_run(request):
+    """
+    Queue an invoice run for [start, end) and return its job id right away (202).
+    Body: {"start": "2025-01-01", "end": "2025-02-01", "mode": "appointment", "doctor": <id>}
+    Follow it with GET /api/jobs/<job_id>/.
+    """
+    if request.user.role != 'ADMIN':
+        return Response({'detail': "Facturation réservée aux administrateurs."}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        start = date.fromisoformat(str(request.data.get('start')))
+        end = date.fromisoformat(str(request.data.get('end')))
+        doctor_id = int(request.data['doctor']) if request.data.get('doctor') else None
+    except ValueError:
+        return Response({'detail': "Dates ou médecin invalides (dates au format AAAA-MM-JJ)."}, status=status.HTTP_400_BAD_REQUEST)
+    mode = request.data.get('mode', MODE_APPOINTMENT)
+    if mode not in MODES or start >= end:
+        return Response({'detail': "Période ou mode de facturation invalide."}, status=status.HTTP_400_BAD_REQUEST)
+
+    job = enqueue('billing.engine.invoice_run_task', user=request.user, start=start.isoformat(),
+                  end=end.isoformat(), mode=mode, doctor_id=doctor_id)
+    return Response({'job_id': job.pk}, status=status.HTTP_202_ACCEPTED)
+
+
+# --------------------------
+# Payment / Ledger Views
+# --------------------------
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def payment_create(request):
+    """
+    Record a payment against an invoice. The patient balance moves in the same transaction.
+    """
+    serializer = PaymentSerializer(data=request.data, context={'request': request})
+    if serializer.is_valid():
+        try:
+            payment = record_payment(Payment(**serializer.validated_data))
+        except ValidationError as e:  # invoice cancelled since the serializer looked
+            return Response(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
+        return Response(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def patient_account(request, patient_id):
+    """
+    Amount owed by a patient plus the latest ledger movements. O(1): reads the materialized balance.
+    """
+    account = PatientAccount.objects.filter(patient_id=patient_id).first()
+    if account is None:
+        return Response({'patient': patient_id, 'invoiced_total': '0.00', 'paid_total': '0.00',
+                         'balance': '0.00', 'entries': []})
+
+    entries = account.entries.order_by('-id')[:50]
+    data = OutstandingAccountSerializer(account).data
+    data['entries'] = LedgerEntrySerializer(entries, many=True).data
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def outstanding_list(request):
+    """
+    Patients with an outstanding balance, largest first.
+    Single query on the partial index billing_acc_outstanding_idx.
+    """
+    accounts = PatientAccount.objects.filter(balance__gt=0).select_related('patient').order_by('-balance')
+
+    paginator = StandardResultsSetPagination()
+    result_page = paginator.paginate_queryset(accounts, request)
+    serializer = OutstandingAccountSerializer(result_page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
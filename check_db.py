@@ -8,21 +8,37 @@ from django.db import connection
 from django_tenants.utils import tenant_context
 from clinics.models import Clinic
 
+REQUIRED_TABLES = ['medical_appointment', 'medical_treatmentstep']
+
+def table_status():
+    """Which required tables exist in the current schema."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT table_name 
+            FROM information_schema.tables 
+            WHERE table_schema = %s
+        """, [connection.schema_name])
+        tables = [row[0] for row in cursor.fetchall()]
+    return {table: table in tables for table in REQUIRED_TABLES}
+
+def check_schema_tables():
+    """
+    Per-tenant task for the parallel runner (raises so the tenant is reported as failed):
+    python manage.py run_tenants --task check_db.check_schema_tables
+    """
+    status = table_status()
+    missing = [table for table, present in status.items() if not present]
+    if missing:
+        raise RuntimeError(f"Missing tables: {', '.join(missing)}")
+    return status
+
 def check_tables():
     clinics = Clinic.objects.exclude(schema_name='public')
     for clinic in clinics:
         print(f"--- Checking {clinic.schema_name} ---")
         with tenant_context(clinic):
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT table_name 
-                    FROM information_schema.tables 
-                    WHERE table_schema = %s
-                """, [clinic.schema_name])
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                print(f"medical_appointment: {'✅' if 'medical_appointment' in tables else '❌'}")
-                print(f"medical_treatmentstep: {'✅' if 'medical_treatmentstep' in tables else '❌'}")
+            for table, present in table_status().items():
+                print(f"{table}: {'✅' if present else '❌'}")
 
 if __name__ == '__main__':
     check_tables()
@@ -0,0 +1,228 @@
+"""
+PostgreSQL-backed job queue for heavy tenant operations.
+
+Jobs are rows of clinics.Job in the public schema, tagged with the tenant
+schema they run in. enqueue() returns immediately; views hand the job id back
+to the client, which polls GET /api/jobs/<id>/.
+
+Workers (`manage.py run_jobs --concurrency N`) are separate processes, each
+with its own connection. They claim one job at a time with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers on any number of
+machines never take the same job and never wait on each other.
+A failed job is retried with exponential backoff up to max_attempts. While a
+job runs, a thread refreshes its heartbeat; a job whose worker died (no
+heartbeat for STALE_AFTER) is put back in the queue, or failed once it used
+its max_attempts, so tasks must be safe to re-run (the invoice engine and the
+import deduplication are).
+Tasks report progress with report_progress(); it is a no-op outside a job.
+Uploads a job names in its arguments (files of JOBS_UPLOAD_DIR) are deleted
+once it succeeded or failed for good, never between two attempts.
+"""
+import contextvars
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_tenants.utils import schema_context
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_DELAY = 30  # seconds, doubled on every attempt
+HEARTBEAT_INTERVAL = 30  # seconds
+STALE_AFTER = timedelta(minutes=5)
+PROGRESS_INTERVAL = 1.0  # seconds between two progress writes
+
+CLAIM_SQL = f"""
+    UPDATE {Job._meta.db_table}
+    SET status = 'running', attempts = attempts + 1, worker = %s,
+        started_at = now(), heartbeat_at = now(), progress = 0, progress_message = ''
+    WHERE id = (
+        SELECT id FROM {Job._meta.db_table}
+        WHERE status = 'queued' AND run_after <= now()
+        ORDER BY priority DESC, run_after, id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id
+"""
+
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+
+def enqueue(task, schema_name=None, user=None, priority=0, max_attempts=3, **kwargs):
+    """Queue `task(**kwargs)` (dotted path, JSON arguments) for the current tenant."""
+    return Job.objects.create(
+        task=task,
+        schema_name=schema_name or connection.schema_name,
+        kwargs=kwargs,
+        priority=priority,
+        max_attempts=max_attempts,
+        created_by_id=user.pk if user is not None and user.is_authenticated else None,
+    )
+
+
+class JobProgress:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_write = 0
+
+    def report(self, done, total=None, message=''):
+        now = time.monotonic()
+        if now - self.last_write < PROGRESS_INTERVAL and (total is None or done < total):
+            return
+        self.last_write = now
+        percent = min(100, int(done * 100 / total)) if total else 0
+        Job.objects.filter(pk=self.job_id).update(progress=percent, progress_message=message[:255])
+
+
+def report_progress(done, total=None, message=''):
+    """Called by tasks: `done` out of `total` units, with an optional message."""
+    progress = _current_job.get()
+    if progress is not None:
+        progress.report(done, total, message)
+
+
+# --------------------------
+# Worker side
+# --------------------------
+
+def claim(worker_name):
+    connection.set_schema_to_public()
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL, [worker_name])
+        row = cursor.fetchone()
+    return Job.objects.get(pk=row[0]) if row else None
+
+
+def release_uploads(job):
+    """Delete the files of JOBS_UPLOAD_DIR named in a finished job's arguments."""
+    upload_dir = os.path.realpath(settings.JOBS_UPLOAD_DIR)
+    for value in job.kwargs.values():
+        if isinstance(value, str) and os.path.dirname(os.path.realpath(value)) == upload_dir:
+            try:
+                os.remove(value)
+            except FileNotFoundError:
+                pass
+
+
+def requeue_stale():
+    """
+    Give back jobs whose worker stopped sending heartbeats. A job that already
+    used all its attempts fails instead: a task that kills its worker would
+    otherwise be claimed again forever.
+    """
+    connection.set_schema_to_public()
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=now - STALE_AFTER)
+    exhausted = list(stale.filter(attempts__gte=F('max_attempts')))
+    Job.objects.filter(pk__in=[job.pk for job in exhausted]).update(
+        status='failed', worker='', error='Worker stopped sending heartbeats.', finished_at=now
+    )
+    for job in exhausted:
+        release_uploads(job)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status='queued', worker='', run_after=now)
+
+
+def _heartbeat(job_id, stop):
+    # Own thread, own connection (public schema by default)
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            Job.objects.filter(pk=job_id).update(heartbeat_at=timezone.now())
+    finally:
+        connections.close_all()
+
+
+def run_job(job):
+    token = _current_job.set(JobProgress(job.pk))
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job.pk, stop), daemon=True).start()
+    try:
+        with schema_context(job.schema_name):
+            result = import_string(job.task)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.error("Job %s (%s) failed on attempt %d:\n%s", job.pk, job.task, job.attempts, error)
+        connection.set_schema_to_public()
+        if job.attempts < job.max_attempts:
+            delay = RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', error=error, worker='', run_after=timezone.now() + timedelta(seconds=delay)
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(status='failed', error=error, finished_at=timezone.now())
+            release_uploads(job)
+        return False
+    finally:
+        stop.set()
+        _current_job.reset(token)
+
+    connection.set_schema_to_public()
+    Job.objects.filter(pk=job.pk).update(
+        status='succeeded', result=result, progress=100, error='', finished_at=timezone.now()
+    )
+    release_uploads(job)
+    return True
+
+
+def work(worker_name, poll_interval=2.0, burst=False):
+    """Worker loop: claim and run jobs until stopped (SIGTERM/SIGINT) or, with burst, the queue is empty."""
+    stopping = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stopping.append(True))
+
+    processed = 0
+    try:
+        while not stopping:
+            job = claim(worker_name)
+            if job is None:
+                if burst:
+                    break
+                requeue_stale()
+                time.sleep(poll_interval)
+                continue
+            run_job(job)
+            processed += 1
+    finally:
+        connections.close_all()
+    return processed
+
+
+def _worker_process(worker_name, poll_interval, burst):
+    import django
+    django.setup()
+    work(worker_name, poll_interval, burst)
+
+
+def run_workers(concurrency=2, poll_interval=2.0, burst=False):
+    """Start `concurrency` worker processes and wait for them (the run_jobs command)."""
+    requeue_stale()
+    connections.close_all()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    if concurrency == 1:
+        return work(f"{prefix}-1", poll_interval, burst)
+
+    # Not daemonic: tasks such as imports start their own process pools
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(f"{prefix}-{n}", poll_interval, burst), daemon=False)
+        for n in range(1, concurrency + 1)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Children got the SIGINT too: they finish their current job and exit
+        for process in processes:
+            process.join()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from clinics.provisioning import refresh_template, template_schema_name
+
+
+class Command(BaseCommand):
+    help = ('Creates/migrates the template schema that new clinics are cloned from. '
+            'Run after every `migrate_schemas` so onboarding keeps the fast clone path.')
+
+    def handle(self, *args, **options):
+        template = template_schema_name()
+        self.stdout.write(f"--- Refreshing tenant template '{template}' ---")
+        missing = refresh_template(verbosity=options['verbosity'])
+        if missing:
+            raise CommandError(f"Template is still missing {len(missing)} migrations: {sorted(missing)[:5]}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Template '{template}' is up to date"))
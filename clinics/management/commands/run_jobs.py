@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from clinics.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = ('Runs background job workers (exports, imports, invoice runs...) for every clinic. '
+            'Usage: manage.py run_jobs --concurrency 4')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Worker processes (one DB connection each).')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        self.stdout.write(f"Starting {options['concurrency']} job worker(s)...")
+        run_workers(options['concurrency'], options['poll_interval'], options['burst'])
+        self.stdout.write(self.style.SUCCESS("✅ Job workers stopped"))
@@ -0,0 +1,70 @@
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django_tenants.utils import schema_exists
+from clinics.parallel import run_tenants, tenant_schemas
+from clinics.provisioning import template_schema_name
+
+
+class Command(BaseCommand):
+    help = ('Runs migrations or a per-tenant maintenance callable across all clinic schemas '
+            'with a bounded pool of worker processes (one DB connection each). '
+            'Examples: manage.py run_tenants --migrate --processes 8 --state-file deploy.json; '
+            'manage.py run_tenants --task check_db.check_schema_tables')
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--migrate', action='store_true',
+                            help='migrate_schemas --shared, then every tenant (and the provisioning template) in parallel.')
+        action.add_argument('--task', help='Dotted path of a callable run inside each tenant schema.')
+        parser.add_argument('--arg', action='append', default=[], metavar='KEY=VALUE',
+                            help='Keyword argument passed to --task (repeatable).')
+        parser.add_argument('--schemas', help='Comma-separated subset of schemas. Defaults to all clinics.')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--state-file', help='JSON file recording done/failed schemas.')
+        parser.add_argument('--resume', action='store_true', help='Skip schemas already done in --state-file.')
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['state_file']:
+            raise CommandError("--resume needs --state-file.")
+
+        kwargs = {}
+        for pair in options['arg']:
+            key, sep, value = pair.partition('=')
+            if not sep:
+                raise CommandError(f"--arg expects KEY=VALUE, got '{pair}'.")
+            kwargs[key] = value
+
+        schema_names = options['schemas'].split(',') if options['schemas'] else tenant_schemas()
+
+        if options['migrate']:
+            task = 'clinics.parallel.migrate_schema'
+            self.stdout.write("--- Migrating public schema ---")
+            call_command('migrate_schemas', shared=True, interactive=False, verbosity=options['verbosity'])
+            # Keep the provisioning template in step so onboarding stays on the clone path
+            template = template_schema_name()
+            if not options['schemas'] and schema_exists(template):
+                schema_names.append(template)
+        else:
+            task = options['task']
+
+        self.stdout.write(f"--- {task} on {len(schema_names)} schemas, {options['processes']} processes ---")
+        started = time.monotonic()
+        state = run_tenants(task, schema_names, processes=options['processes'],
+                            state_file=options['state_file'], resume=options['resume'],
+                            progress=self._progress, **kwargs)
+
+        elapsed = time.monotonic() - started
+        if state.failed:
+            for schema_name, error in sorted(state.failed.items()):
+                self.stdout.write(self.style.ERROR(f"  {schema_name}: {error}"))
+            raise CommandError(f"{len(state.failed)} schema(s) failed in {elapsed:.1f}s. "
+                               f"Fix and re-run with --resume to continue.")
+        self.stdout.write(self.style.SUCCESS(f"✅ {len(state.done)} schemas done in {elapsed:.1f}s"))
+
+    def _progress(self, position, total, schema_name, error, seconds):
+        prefix = f"[{position}/{total} {int(100 * position / total)}%] {schema_name}"
+        if error:
+            self.stdout.write(self.style.ERROR(f"{prefix} ❌ {error} ({seconds:.1f}s)"))
+        else:
+            self.stdout.write(f"{prefix} ✅ ({seconds:.1f}s)")
@@ -0,0 +1,68 @@
+import json
+import os
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Summarizes the slow-query log (SLOW_QUERY_MS / SLOW_QUERY_LOG) per statement fingerprint, '
+            'slowest total first. Usage: manage.py slow_queries --schema clinic_atlas --hours 24 --plans')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help='Only this clinic schema.')
+        parser.add_argument('--hours', type=float, help='Only entries of the last N hours.')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--fingerprint', help='Only this fingerprint (implies --plans).')
+        parser.add_argument('--plans', action='store_true', help='Print the EXPLAIN plan of each fingerprint.')
+
+    def handle(self, *args, **options):
+        path = settings.SLOW_QUERY_LOG
+        if not os.path.exists(path):
+            raise CommandError(f"No slow-query log at {path}. Is SLOW_QUERY_MS set?")
+        since = timezone.now() - timedelta(hours=options['hours']) if options['hours'] else None
+
+        groups = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if options['schema'] and entry['schema'] != options['schema']:
+                    continue
+                if options['fingerprint'] and entry['fingerprint'] != options['fingerprint']:
+                    continue
+                if since and datetime.fromisoformat(entry['at']) < since:
+                    continue
+                group = groups.setdefault(entry['fingerprint'], {
+                    'sql': entry['sql'], 'calls': 0, 'total': 0.0, 'max': 0.0,
+                    'schemas': set(), 'views': set(), 'plan': None,
+                })
+                group['calls'] += 1
+                group['total'] += entry['ms']
+                group['max'] = max(group['max'], entry['ms'])
+                group['schemas'].add(entry['schema'])
+                group['views'].add(entry['view'])
+                group['plan'] = entry['plan'] or group['plan']
+
+        if not groups:
+            self.stdout.write("No slow queries recorded for these filters.")
+            return
+
+        show_plans = options['plans'] or options['fingerprint']
+        ranked = sorted(groups.items(), key=lambda item: item[1]['total'], reverse=True)[:options['top']]
+        for key, group in ranked:
+            self.stdout.write(self.style.WARNING(
+                f"{key}  calls={group['calls']}  total={group['total']:.0f}ms  "
+                f"mean={group['total'] / group['calls']:.0f}ms  max={group['max']:.0f}ms"
+            ))
+            self.stdout.write(f"  schemas: {', '.join(sorted(group['schemas'])[:10])}"
+                              f"{' ...' if len(group['schemas']) > 10 else ''}")
+            self.stdout.write(f"  views:   {', '.join(sorted(group['views']))}")
+            self.stdout.write(f"  sql:     {group['sql'][:500]}")
+            if show_plans and group['plan']:
+                self.stdout.write("  plan:")
+                for plan_line in group['plan'].splitlines():
+                    self.stdout.write(f"    {plan_line}")
+            self.stdout.write("")
@@ -1,8 +1,14 @@
 from django.db import models
 
 # Create your models here.
-from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.db import connection
 from django_tenants.models import TenantMixin, DomainMixin
+from django_tenants.postgresql_backend.base import _check_schema_name
+from django_tenants.utils import schema_exists
+from .provisioning import clone_from_template
 
 class Clinic(TenantMixin):
     name = models.CharField(max_length=100)
@@ -12,5 +18,61 @@ class Clinic(TenantMixin):
     # This allows django-tenants to automatically create the Postgres Schema
     auto_create_schema = True
 
+    def create_schema(self, check_if_exists=False, sync_schema=True, verbosity=1):
+        # Onboarding fast path: clone the migrated template schema instead of
+        # replaying every migration. Falls back to migrations if the template is stale.
+        # The name ends up in raw SQL: validated first, as the base implementation does
+        _check_schema_name(self.schema_name)
+        if sync_schema and settings.TENANT_PROVISIONING == 'template':
+            if check_if_exists and schema_exists(self.schema_name):
+                return False
+            if clone_from_template(self.schema_name):
+                connection.set_schema_to_public()
+                return True
+        return super().create_schema(check_if_exists=check_if_exists, sync_schema=sync_schema, verbosity=verbosity)
+
 class Domain(DomainMixin):
-    pass
\ No newline at end of file
+    pass
+
+
+class Job(models.Model):
+    """
+    Background job queue (see clinics/jobs.py). Lives in the public schema so
+    one pool of workers serves every clinic; schema_name says where the task runs.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=200)  # dotted path of the callable
+    schema_name = models.CharField(max_length=63)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    priority = models.IntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_by_id = models.BigIntegerField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # What the workers poll: only queued rows are indexed
+            models.Index(fields=['-priority', 'run_after', 'id'], name='clinics_job_queued_idx',
+                         condition=models.Q(status='queued')),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} {self.task} [{self.schema_name}] {self.status}"
+
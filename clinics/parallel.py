@@ -0,0 +1,134 @@
+"""
+Run a function once per tenant schema, in a pool of worker processes.
+
+Each worker process gets its own database connection (connections are closed
+before the pool forks/spawns), so schemas are processed truly in parallel
+instead of the one-by-one tenant_context loop used in check_db.py.
+The function is passed as a dotted path so it can be pickled to workers.
+
+run_tenants() adds what long maintenance runs need on top of map_tenants():
+progress reporting, per-tenant failure isolation and a resumable JSON state file.
+"""
+import json
+import multiprocessing
+import os
+import time
+from django.core.management import call_command
+from django.db import connection, connections
+from django.utils.module_loading import import_string
+from django_tenants.utils import schema_context, get_public_schema_name
+
+
+def setup_worker():
+    # Needed when workers are spawned (Windows / macOS) rather than forked
+    import django
+    django.setup()
+
+
+def _run_in_schema(job):
+    func_path, schema_name, kwargs = job
+    started = time.monotonic()
+    try:
+        with schema_context(schema_name):
+            result = import_string(func_path)(**kwargs)
+        return schema_name, result, None, time.monotonic() - started
+    except Exception as e:
+        return schema_name, None, f"{type(e).__name__}: {e}", time.monotonic() - started
+    finally:
+        connections.close_all()
+
+
+def tenant_schemas():
+    from clinics.models import Clinic
+    return list(
+        Clinic.objects.exclude(schema_name=get_public_schema_name())
+        .order_by('schema_name')
+        .values_list('schema_name', flat=True)
+    )
+
+
+def map_tenants(func_path, schema_names=None, processes=4, **kwargs):
+    """
+    Call `func_path(**kwargs)` inside every tenant schema.
+    Yields (schema_name, result, error, seconds) as tenants finish; one tenant
+    failing does not stop the others.
+    """
+    if schema_names is None:
+        schema_names = tenant_schemas()
+    jobs = [(func_path, schema_name, kwargs) for schema_name in schema_names]
+    if not jobs:
+        return
+
+    # Never share a live connection with child processes
+    connections.close_all()
+
+    with multiprocessing.Pool(processes=min(processes, len(jobs)), initializer=setup_worker) as pool:
+        yield from pool.imap_unordered(_run_in_schema, jobs)
+
+
+class RunState:
+    """JSON state file: which schemas are done / failed for a given task. Rewritten atomically."""
+
+    def __init__(self, path, task):
+        self.path = path
+        self.task = task
+        self.done = []
+        self.failed = {}
+
+    @classmethod
+    def load(cls, path, task):
+        state = cls(path, task)
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('task') == task:
+                state.done = data.get('done', [])
+                state.failed = data.get('failed', {})
+        return state
+
+    def record(self, schema_name, error):
+        if error:
+            self.failed[schema_name] = error
+        else:
+            self.failed.pop(schema_name, None)
+            self.done.append(schema_name)
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'task': self.task, 'done': self.done, 'failed': self.failed}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_tenants(func_path, schema_names=None, processes=4, state_file=None, resume=False, progress=None, **kwargs):
+    """
+    map_tenants() with bookkeeping. With resume=True, schemas already recorded as
+    done in state_file are skipped, so an interrupted deploy picks up where it stopped.
+    progress(position, total, schema_name, error, seconds) is called as tenants finish.
+    Returns the RunState.
+    """
+    state = RunState.load(state_file, func_path) if resume else RunState(state_file, func_path)
+    if schema_names is None:
+        schema_names = tenant_schemas()
+    pending = [schema_name for schema_name in schema_names if schema_name not in set(state.done)]
+    state.save()
+
+    for position, (schema_name, _, error, seconds) in enumerate(
+            map_tenants(func_path, pending, processes=processes, **kwargs), start=1):
+        state.record(schema_name, error)
+        if progress:
+            progress(position, len(pending), schema_name, error, seconds)
+    return state
+
+
+# --------------------------
+# Per-tenant maintenance tasks
+# --------------------------
+
+def migrate_schema(verbosity=0):
+    """Task: apply pending migrations to the current tenant schema."""
+    call_command('migrate_schemas', tenant=True, schema_name=connection.schema_name,
+                 interactive=False, verbosity=verbosity)
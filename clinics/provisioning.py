@@ -0,0 +1,123 @@
+"""
+Fast tenant provisioning from a template schema.
+
+Running the whole tenant migration history for every signup gets slower with
+each migration we add. Instead we keep one schema (TENANT_TEMPLATE_SCHEMA) fully
+migrated and clone it into the new clinic's schema with django-tenants'
+clone_schema() SQL function, which copies tables, indexes, constraints,
+sequences and the django_migrations rows in a single statement.
+
+Safety net: a template that is missing or behind the migrations on disk is
+never cloned, and a clone whose migration state does not match is dropped.
+In both cases the caller falls back to the regular migrate_schemas path.
+Keep the template fresh after each deploy with `manage.py refresh_tenant_template`.
+"""
+import logging
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django_tenants.clone import CloneSchema
+from django_tenants.postgresql_backend.base import _check_schema_name
+from django_tenants.utils import schema_exists
+
+logger = logging.getLogger(__name__)
+
+_expected_migrations = None
+
+
+def template_schema_name():
+    return settings.TENANT_TEMPLATE_SCHEMA
+
+
+def expected_migrations():
+    """Every migration on disk, as (app_label, name). Computed once per process."""
+    global _expected_migrations
+    if _expected_migrations is None:
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        _expected_migrations = frozenset(loader.graph.nodes)
+    return _expected_migrations
+
+
+def quote_schema(schema_name):
+    # django-tenants accepts any 1-63 character name: escape embedded quotes
+    return '"%s"' % schema_name.replace('"', '""')
+
+
+def applied_migrations(schema_name):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT to_regclass(%s) IS NOT NULL", [f'{quote_schema(schema_name)}.django_migrations']
+        )
+        if not cursor.fetchone()[0]:
+            return set()
+        cursor.execute(f'SELECT app, name FROM {quote_schema(schema_name)}.django_migrations')
+        return set(cursor.fetchall())
+
+
+def table_names(schema_name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s", [schema_name])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def missing_migrations(schema_name):
+    return expected_migrations() - applied_migrations(schema_name)
+
+
+def template_is_current():
+    template = template_schema_name()
+    return schema_exists(template) and not missing_migrations(template)
+
+
+def refresh_template(verbosity=1):
+    """Create the template schema if needed and bring it up to the latest migrations."""
+    template = template_schema_name()
+    connection.set_schema_to_public()
+    if not schema_exists(template):
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE SCHEMA {quote_schema(template)}')
+    call_command('migrate_schemas', tenant=True, schema_name=template, interactive=False, verbosity=verbosity)
+    connection.set_schema_to_public()
+    return missing_migrations(template)
+
+
+def _ensure_clone_function():
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT 1 FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+            WHERE n.nspname = 'public' AND p.proname = 'clone_schema'
+        """)
+        if cursor.fetchone():
+            return
+    # Installing the function is a large DDL script; only done once per database
+    CloneSchema()._create_clone_schema_function()
+
+
+def clone_from_template(schema_name):
+    """
+    Provision `schema_name` by cloning the template. Returns True on success,
+    False when the caller must fall back to running migrations.
+    """
+    _check_schema_name(schema_name)  # interpolated into DROP SCHEMA below
+    template = template_schema_name()
+    connection.set_schema_to_public()
+
+    if not template_is_current():
+        logger.warning("Tenant template '%s' is missing or stale; provisioning '%s' with migrations.",
+                       template, schema_name)
+        return False
+
+    _ensure_clone_function()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT public.clone_schema(%s, %s, %s)", [template, schema_name, 'DATA'])
+
+    missing = missing_migrations(schema_name)
+    missing_tables = table_names(template) - table_names(schema_name)
+    if missing or missing_tables:
+        logger.error("Clone of '%s' into '%s' is incomplete (%d migrations, %d tables missing); "
+                     "dropping it and migrating instead.", template, schema_name, len(missing), len(missing_tables))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {quote_schema(schema_name)} CASCADE')
+        return False
+    return True
@@ -0,0 +1,14 @@
+from rest_framework import serializers
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'task', 'status', 'status_display', 'progress', 'progress_message', 'attempts',
+            'max_attempts', 'result', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -1,3 +1,237 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django_tenants.models import TenantMixin
+from django_tenants.utils import schema_context
+from medical.models import Patient
+from medical.tests import TwoClinicsMixin
+from . import throttling
+from .jobs import STALE_AFTER, requeue_stale, run_job
+from .models import Clinic, Job
+from .parallel import map_tenants, run_tenants
+from .provisioning import missing_migrations, table_names
+from .throttling import TenantThrottleMiddleware, TokenBucket
 
-# Create your tests here.
+
+def schema_owners(fail_in=None):
+    """run_tenants task of the tests below: the patients' last names, or an error in `fail_in`."""
+    if connection.schema_name == fail_in:
+        raise ValueError(f"boom in {fail_in}")
+    return sorted(Patient.objects.values_list('last_name', flat=True))
+
+
+class StaleJobTests(TransactionTestCase):
+    """requeue_stale() gives back a dead worker's job, unless it used all its attempts."""
+
+    def test_stale_jobs_are_requeued(self):
+        stale = Job.objects.create(task='x.y', schema_name='public', status='running', attempts=1,
+                                   worker='host:1-1', heartbeat_at=timezone.now() - STALE_AFTER * 2)
+        alive = Job.objects.create(task='x.y', schema_name='public', status='running', attempts=1,
+                                   worker='host:1-2', heartbeat_at=timezone.now())
+
+        self.assertEqual(requeue_stale(), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker), ('queued', ''))
+        self.assertEqual(Job.objects.get(pk=alive.pk).status, 'running')
+
+    def test_exhausted_job_fails_instead_of_requeueing(self):
+        old = timezone.now() - STALE_AFTER * 2
+        retry = Job.objects.create(task='x.y', schema_name='public', status='running', attempts=1, heartbeat_at=old)
+        exhausted = Job.objects.create(task='x.y', schema_name='public', status='running', attempts=3, heartbeat_at=old)
+
+        self.assertEqual(requeue_stale(), 1)
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.worker), ('failed', ''))
+        self.assertIsNotNone(exhausted.finished_at)
+        self.assertEqual(Job.objects.get(pk=retry.pk).status, 'queued')
+
+
+UPLOAD_DIR = tempfile.mkdtemp(prefix='clinic-job-uploads-')
+
+
+@override_settings(JOBS_UPLOAD_DIR=UPLOAD_DIR)
+class JobUploadTests(TransactionTestCase):
+    """An upload stays for the retries of its job and is deleted once the job failed for good."""
+
+    def upload(self):
+        path = os.path.join(UPLOAD_DIR, 'patients-test.csv')
+        with open(path, 'w') as f:
+            f.write('first_name\n')
+        return path
+
+    def test_failed_job_deletes_its_upload(self):
+        path = self.upload()
+        # json.loads() takes no `path`: the task fails on every attempt
+        job = Job.objects.create(task='json.loads', schema_name='public', status='running', attempts=1,
+                                 max_attempts=2, kwargs={'path': path})
+        self.assertFalse(run_job(job))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'queued')
+        self.assertTrue(os.path.exists(path))
+
+        job.attempts = 2
+        self.assertFalse(run_job(job))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'failed')
+        self.assertFalse(os.path.exists(path))
+
+    def test_stale_exhausted_job_deletes_its_upload(self):
+        path = self.upload()
+        Job.objects.create(task='json.loads', schema_name='public', status='running', attempts=3,
+                           heartbeat_at=timezone.now() - STALE_AFTER * 2, kwargs={'path': path})
+        requeue_stale()
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(TENANT_PLAN_LIMITS={1: {'concurrency': 2, 'rate': 2, 'burst': 3, 'statement_timeout': 1000}})
+class TenantThrottleTests(SimpleTestCase):
+    """Per-clinic token bucket and concurrency slots; streams hold their slot until they close."""
+
+    def setUp(self):
+        throttling._budgets.clear()
+        self.now = 1000.0
+        patches = [mock.patch('clinics.throttling.time.monotonic', lambda: self.now),
+                   mock.patch('clinics.throttling.set_statement_timeout')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.tenant = SimpleNamespace(schema_name='throttle_a', plan_tier=1)
+
+    def call(self, get_response):
+        request = RequestFactory().get('/api/medical/patients/')
+        request.tenant = self.tenant
+        return TenantThrottleMiddleware(get_response)(request)
+
+    def in_flight(self):
+        return throttling._budgets[self.tenant.schema_name].in_flight
+
+    def test_bucket_refills_at_its_rate_up_to_the_burst(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        self.assertEqual([bucket.take() for _ in range(4)], [0, 0, 0, 0.5])
+        self.now += 0.5
+        self.assertEqual((bucket.take(), bucket.take()), (0, 0.5))
+        self.now += 3600
+        self.assertEqual([bucket.take() for _ in range(4)], [0, 0, 0, 0.5])
+
+    def test_over_the_rate_is_429_with_retry_after(self):
+        responses = [self.call(lambda request: HttpResponse()) for _ in range(4)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429])
+        self.assertEqual(responses[-1]['Retry-After'], '1')
+        self.assertEqual(self.in_flight(), 0)
+        # Another clinic has its own bucket
+        self.tenant = SimpleNamespace(schema_name='throttle_b', plan_tier=1)
+        self.assertEqual(self.call(lambda request: HttpResponse()).status_code, 200)
+
+    def test_concurrency_limit_per_clinic(self):
+        statuses = []
+
+        def nested(depth):
+            def get_response(request):
+                if depth:
+                    statuses.append(self.call(nested(depth - 1)).status_code)
+                return HttpResponse()
+            return get_response
+
+        # Three requests of the clinic in flight at once: the innermost one is over the limit
+        self.assertEqual(self.call(nested(2)).status_code, 200)
+        self.assertEqual(statuses, [429, 200])
+        self.assertEqual(self.in_flight(), 0)
+
+    def test_stream_gives_its_slot_back_when_closed(self):
+        def events():
+            while True:
+                yield b'data: {}\n\n'
+
+        response = self.call(lambda request: StreamingHttpResponse(events(), content_type='text/event-stream'))
+        self.assertEqual(next(iter(response)), b'data: {}\n\n')
+        self.assertEqual(self.in_flight(), 1)
+        # The client went away: the server closes the response
+        response.close()
+        self.assertEqual(self.in_flight(), 0)
+
+
+@override_settings(TENANT_PROVISIONING='template', TENANT_TEMPLATE_SCHEMA='test_template')
+class TemplateProvisioningTests(TransactionTestCase):
+    """A clinic cloned from the template gets the template's tables, sequences and triggers."""
+
+    def tearDown(self):
+        connection.set_schema_to_public()
+        Clinic.objects.filter(schema_name='test_clone').delete()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS test_clone CASCADE')
+            cursor.execute('DROP SCHEMA IF EXISTS test_template CASCADE')
+
+    def catalog(self, schema_name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sequence_name FROM information_schema.sequences WHERE sequence_schema = %s",
+                           [schema_name])
+            sequences = {row[0] for row in cursor.fetchall()}
+            # Trigger -> schema of the function it runs
+            cursor.execute("""
+                SELECT t.tgname, pn.nspname FROM pg_trigger t
+                JOIN pg_class c ON c.oid = t.tgrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_proc p ON p.oid = t.tgfoid JOIN pg_namespace pn ON pn.oid = p.pronamespace
+                WHERE NOT t.tgisinternal AND n.nspname = %s
+            """, [schema_name])
+            triggers = dict(cursor.fetchall())
+        return table_names(schema_name), sequences, triggers
+
+    def test_new_clinic_is_a_clone_of_the_template(self):
+        call_command('refresh_tenant_template', verbosity=0, stdout=io.StringIO())
+        with mock.patch.object(TenantMixin, 'create_schema') as migrate:
+            Clinic(schema_name='test_clone', name='test_clone').save(verbosity=0)
+        migrate.assert_not_called()
+
+        tables, sequences, triggers = self.catalog('test_clone')
+        template_tables, template_sequences, template_triggers = self.catalog('test_template')
+        self.assertIn('medical_appointment', tables)
+        self.assertEqual((tables, sequences), (template_tables, template_sequences))
+        self.assertEqual(set(triggers), set(template_triggers))
+        # The live calendar trigger runs the clone's own function, not the template's
+        self.assertEqual(triggers['medical_appointment_notify'], 'test_clone')
+        self.assertFalse(missing_migrations('test_clone'))
+
+        with schema_context('test_clone'):
+            self.assertEqual(Patient.objects.create(first_name='A', last_name='B', phone='0600000000').pk, 1)
+
+
+class RunTenantsTests(TwoClinicsMixin, TransactionTestCase):
+    """A task runs once in every schema, in worker processes; one failing schema does not stop the others."""
+
+    TASK = 'clinics.tests.schema_owners'
+
+    def test_map_tenants_fans_out(self):
+        results = {schema_name: (result, error)
+                   for schema_name, result, error, _ in map_tenants(self.TASK, list(self.SCHEMAS), processes=2)}
+        self.assertEqual(results, {schema_name: ([schema_name], None) for schema_name in self.SCHEMAS})
+
+    def test_failure_is_isolated_and_resumable(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            state = run_tenants(self.TASK, list(self.SCHEMAS), processes=2, state_file=state_file,
+                                fail_in='test_pool_a')
+            self.assertEqual(state.done, ['test_pool_b'])
+            self.assertEqual(state.failed, {'test_pool_a': 'ValueError: boom in test_pool_a'})
+
+            progress = []
+            state = run_tenants(self.TASK, list(self.SCHEMAS), processes=2, state_file=state_file, resume=True,
+                                progress=lambda position, total, schema_name, *_: progress.append(schema_name))
+            self.assertEqual(progress, ['test_pool_a'])
+            self.assertEqual((sorted(state.done), state.failed), (sorted(self.SCHEMAS), {}))
+
+    def test_command_exit_status(self):
+        options = {'task': self.TASK, 'schemas': ','.join(self.SCHEMAS), 'processes': 2}
+        out = io.StringIO()
+        call_command('run_tenants', stdout=out, **options)
+        self.assertIn('2 schemas done', out.getvalue())
+
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 schema(s) failed'):
+            call_command('run_tenants', arg=['fail_in=test_pool_b'], stdout=out, **options)
+        self.assertIn('test_pool_b: ValueError: boom in test_pool_b', out.getvalue())
@@ -0,0 +1,195 @@
+"""
+Per-clinic performance isolation, scaled by Clinic.plan_tier.
+
+Every tenant request goes through TenantThrottleMiddleware, which enforces for
+its schema:
+  - a concurrency limit: at most N requests of one clinic in flight in this
+    worker process, so a bulk export cannot take every worker thread;
+  - a token bucket: `rate` requests/second with bursts up to `burst`;
+  - a PostgreSQL statement_timeout applied to every query of the request.
+Over-limit requests get 429 with a Retry-After header instead of queueing
+behind the noisy clinic. State lives in the worker process (no extra round
+trip per request); effective clinic-wide limits are per-process limits times
+the number of workers.
+"""
+import math
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+from django_tenants.utils import get_public_schema_name
+
+# plan_tier -> limits. Overridable with settings.TENANT_PLAN_LIMITS.
+DEFAULT_PLAN_LIMITS = {
+    1: {'concurrency': 2, 'rate': 5, 'burst': 20, 'statement_timeout': 5000},     # Basic
+    2: {'concurrency': 4, 'rate': 15, 'burst': 60, 'statement_timeout': 15000},   # Pro
+    3: {'concurrency': 8, 'rate': 40, 'burst': 150, 'statement_timeout': 30000},  # Premium
+}
+
+
+def plan_limits(plan_tier):
+    limits = getattr(settings, 'TENANT_PLAN_LIMITS', DEFAULT_PLAN_LIMITS)
+    return limits.get(plan_tier) or limits[min(limits)]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Returns 0 when a token was taken, otherwise the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class TenantBudget:
+    """Concurrency slots + token bucket of one schema. Rebuilt if the plan changes."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = 0
+        self.bucket = TokenBucket(limits['rate'], limits['burst'])
+
+    def acquire(self):
+        """Returns 0 on success, otherwise the suggested Retry-After in seconds."""
+        if self.in_flight >= self.limits['concurrency']:
+            return 1
+        wait = self.bucket.take()
+        if wait:
+            return wait
+        self.in_flight += 1
+        return 0
+
+    def release(self):
+        self.in_flight -= 1
+
+
+_budgets = {}
+_lock = threading.Lock()
+
+
+def acquire(schema_name, plan_tier):
+    limits = plan_limits(plan_tier)
+    with _lock:
+        budget = _budgets.get(schema_name)
+        if budget is None or budget.limits != limits:
+            in_flight = budget.in_flight if budget else 0
+            budget = _budgets[schema_name] = TenantBudget(limits)
+            budget.in_flight = in_flight
+        return budget.acquire()
+
+
+def release(schema_name):
+    with _lock:
+        _budgets[schema_name].release()
+
+
+def too_many_requests(retry_after):
+    response = JsonResponse(
+        {'detail': "Trop de requêtes pour cette clinique. Réessayez plus tard."}, status=429
+    )
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class TenantThrottleMiddleware:
+    """Must come after the tenant middlewares, which set request.tenant."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tenant = getattr(request, 'tenant', None)
+        if tenant is None or tenant.schema_name == get_public_schema_name():
+            return self.get_response(request)
+
+        retry_after = acquire(tenant.schema_name, tenant.plan_tier)
+        if retry_after:
+            return too_many_requests(retry_after)
+
+        finish = self.finisher(tenant)
+        set_statement_timeout(plan_limits(tenant.plan_tier)['statement_timeout'])
+        try:
+            response = self.get_response(request)
+        except Exception:
+            finish()
+            raise
+        return self.finish_with(response, finish)
+
+    async def __acall__(self, request):
+        tenant = getattr(request, 'tenant', None)
+        if tenant is None or tenant.schema_name == get_public_schema_name():
+            return await self.get_response(request)
+
+        retry_after = acquire(tenant.schema_name, tenant.plan_tier)
+        if retry_after:
+            return too_many_requests(retry_after)
+
+        # The timeout belongs to the connection of the request's thread
+        finish = self.finisher(tenant)
+        await sync_to_async(set_statement_timeout)(plan_limits(tenant.plan_tier)['statement_timeout'])
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            await sync_to_async(finish)()
+            raise
+        if response.streaming and not response.is_async:
+            return self.finish_with(response, finish)
+        # Async streams are not consumed on the request's thread: release right away
+        await sync_to_async(finish)()
+        return response
+
+    def finisher(self, tenant):
+        """finish(): reset the timeout and give the slot back, once."""
+        released = False
+
+        def finish():
+            nonlocal released
+            if not released:
+                released = True
+                set_statement_timeout(None)
+                release(tenant.schema_name)
+        return finish
+
+    def finish_with(self, response, finish):
+        if response.streaming:
+            # Exports keep their slot and timeout until the last chunk is sent
+            # (or the client goes away and the server closes the response)
+            response.streaming_content = FinishAfter(response.streaming_content, finish)
+        else:
+            finish()
+        return response
+
+
+def set_statement_timeout(milliseconds):
+    connection.set_statement_timeout(milliseconds)
+
+
+class FinishAfter:
+    """Streaming content wrapper calling finish() once, when exhausted or closed."""
+
+    def __init__(self, content, finish):
+        self.content = content
+        self.close = finish
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
@@ -1,3 +1,25 @@
-from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.db import connection
+from django.shortcuts import get_object_or_404
+from .models import Job
+from .serializers import JobSerializer
 
-# Create your views here.
+
+# --------------------------
+# Background Job Views
+# --------------------------
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_detail(request, pk):
+    """
+    Status, progress and result of a background job of the current clinic.
+    Clients poll it with the job_id returned by the 202 responses.
+    """
+    job = get_object_or_404(Job, pk=pk, schema_name=connection.schema_name)
+    data = JobSerializer(job).data
+    if request.user.role != 'ADMIN':
+        data['error'] = 'Erreur interne.' if job.error else ''
+    return Response(data)
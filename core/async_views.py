@@ -0,0 +1,146 @@
+"""
+Native async (ASGI) read endpoints.
+
+DRF's @api_view is sync only: under ASGI every call occupies a thread for the
+whole view. The hot GET endpoints are instead written as `async def` views
+with Django's async ORM, wrapped with @async_reads(sync_view): GET/HEAD run
+natively, every other method is handed to the existing DRF view unchanged.
+
+Tenant safety across awaits: django-tenants sets the schema on the
+*thread-local* connection. Under ASGI each request gets its own
+ThreadSensitiveContext, so every sync hop of one request (middlewares, async
+ORM queries, sync_to_async calls) runs in the same dedicated thread, on the
+connection that carries the request's tenant. Rules for async code:
+  - never touch `connection`, the caches or anything keyed by
+    connection.schema_name from the event loop: go through sync_to_async;
+  - bind_tenant() re-applies request.tenant on that thread before the first
+    query, so a schema switched by earlier code can never leak into the view;
+  - serializers get no request context (it makes them read connection.tenant)
+    and only see fully fetched objects: a lazy query raises
+    SynchronousOnlyOperation instead of silently blocking the event loop.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed, MethodNotAllowed, NotAuthenticated, NotFound
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def _authenticate(request):
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticator = authentication_class()
+        result = authenticator.authenticate(request)
+        if result is not None:
+            return result[0], authenticator
+    return None, api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+
+
+def _bind_tenant(request):
+    tenant = getattr(request, 'tenant', None)
+    if tenant is not None and connection.schema_name != tenant.schema_name:
+        connection.set_tenant(tenant)
+
+
+async def bind_tenant(request):
+    await sync_to_async(_bind_tenant)(request)
+
+
+def async_reads(sync_view):
+    """
+    Decorate an async GET view; other methods go to `sync_view` (the DRF view),
+    or get a 405 when there is none.
+    Authentication (IsAuthenticated) is done here, as @api_view would.
+    """
+    def decorator(async_view):
+        @csrf_exempt
+        @wraps(async_view)
+        async def view(request, *args, **kwargs):
+            if request.method not in READ_METHODS:
+                if sync_view is None:
+                    return json_response({'detail': MethodNotAllowed(request.method).detail},
+                                         MethodNotAllowed.status_code)
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+            try:
+                user, authenticator = await sync_to_async(_authenticate)(request)
+            except AuthenticationFailed as e:
+                response = json_response(e.detail if isinstance(e.detail, dict) else {'detail': e.detail}, e.status_code)
+                response['WWW-Authenticate'] = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]().authenticate_header(request)
+                return response
+            if user is None:
+                response = json_response({'detail': NotAuthenticated.default_detail}, NotAuthenticated.status_code)
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+                return response
+
+            request.user = user
+            await bind_tenant(request)
+            try:
+                return await async_view(request, *args, **kwargs)
+            except NotFound as e:
+                return json_response({'detail': e.detail}, e.status_code)
+
+        view.sync_view = sync_view
+        return view
+    return decorator
+
+
+async def aget_object_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise NotFound("No %s matches the given query." % queryset.model._meta.object_name)
+
+
+def requested_page_size(params, paginator):
+    """?page_size= capped at the paginator's max_page_size, else its default page_size."""
+    try:
+        page_size = min(int(params[paginator.page_size_query_param]), paginator.max_page_size)
+        if page_size <= 0:
+            raise ValueError
+    except (KeyError, ValueError, TypeError):
+        page_size = paginator.page_size
+    return page_size
+
+
+async def apaginate(request, queryset, serialize, paginator_class):
+    """
+    Async equivalent of PageNumberPagination.paginate_queryset +
+    get_paginated_response: same query params, same {count, next, previous, results}.
+    """
+    paginator = paginator_class()
+    page_size = requested_page_size(request.GET, paginator)
+    count = await queryset.acount()
+    last_page = max(1, -(-count // page_size))
+    raw_page = request.GET.get(paginator.page_query_param, 1)
+    if raw_page in paginator.last_page_strings:
+        raw_page = last_page
+    try:
+        page = int(raw_page)
+        if page < 1 or page > last_page:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise NotFound(paginator.invalid_page_message)
+
+    offset = (page - 1) * page_size
+    results = [obj async for obj in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    previous_url = None
+    if page > 1:
+        previous_url = (remove_query_param(url, paginator.page_query_param) if page == 2
+                        else replace_query_param(url, paginator.page_query_param, page - 1))
+    return {
+        'count': count,
+        'next': replace_query_param(url, paginator.page_query_param, page + 1) if page < last_page else None,
+        'previous': previous_url,
+        'results': serialize(results),
+    }
@@ -0,0 +1,101 @@
+"""
+Batch endpoint: several GETs of the tenant API in one round trip.
+
+Opening a patient on a tablet needs the patient, its treatments, findings,
+prescriptions and the user roster. Over clinic Wi-Fi each sequential call
+costs a full round trip; POST api/batch/ with
+
+    {"requests": ["/api/medical/patients/12/", "/api/medical/treatments/?patient=12", ...]}
+
+runs them in-process, in order, and answers
+
+    {"responses": [{"path": ..., "status": 200, "body": {...}}, ...]}
+
+Shared with the batch request: the JWT authentication (done once, handed to
+the sub-requests as a forced DRF user), the tenant resolved by the
+middlewares, the throttle slot and the statement_timeout. Each sub-request
+is routed to the read replicas exactly as it would be on its own, and the
+batch itself, a POST that writes nothing, does not pin its user to the primary.
+Only GETs of JSON endpoints: streamed responses (exports, live calendar)
+and nested batches are refused per item, before their view runs.
+"""
+import json
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from .replicas import read_only, replica_reads
+
+MAX_REQUESTS = 10
+API_PREFIX = '/api/'
+# Streamed responses, refused before the view runs (an export is audited as soon as it starts)
+NOT_BATCHABLE = {'patient-export', 'appointment-stream', 'batch'}
+
+
+def sub_request(request, path, query_string):
+    """GET `path` with the batch request's headers, tenant and authenticated user."""
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = path
+    sub.META = {**request.META, 'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string}
+    sub.GET = QueryDict(query_string)
+    sub.COOKIES = request.COOKIES
+    sub.tenant = request.tenant
+    sub.urlconf = getattr(request._request, 'urlconf', None)
+    sub.user = request.user
+    # DRF's Request uses these instead of authenticating the JWT again
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def error(path, status_code, detail):
+    return {'path': path, 'status': status_code, 'body': {'detail': detail}}
+
+
+def run_one(request, raw_path):
+    path, _, query_string = raw_path.partition('?')
+    if not path.startswith(API_PREFIX):
+        return error(raw_path, status.HTTP_400_BAD_REQUEST, "Seules les routes /api/ sont acceptées.")
+    sub = sub_request(request, path, query_string)
+    try:
+        match = resolve(path, sub.urlconf)
+    except Resolver404:
+        return error(raw_path, status.HTTP_404_NOT_FOUND, "Route inconnue.")
+
+    # Async read views keep their DRF view for sync callers
+    view = getattr(match.func, 'sync_view', None) or match.func
+    if match.url_name in NOT_BATCHABLE or iscoroutinefunction(view):
+        return error(raw_path, status.HTTP_400_BAD_REQUEST, "Route non disponible en lot.")
+    sub.resolver_match = match
+
+    with replica_reads(sub, view):
+        response = view(sub, *match.args, **match.kwargs)
+    if response.streaming:
+        response.close()
+        return error(raw_path, status.HTTP_400_BAD_REQUEST, "Route non disponible en lot.")
+
+    if hasattr(response, 'data'):
+        body = response.data  # DRF Response: not rendered twice
+    elif response.get('Content-Type', '').startswith('application/json'):
+        body = json.loads(response.content)
+    else:
+        body = response.content.decode(response.charset)
+    return {'path': raw_path, 'status': response.status_code, 'body': body}
+
+
+@read_only  # a POST only so that the paths travel in the body
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request):
+    """Run up to MAX_REQUESTS GET sub-requests of the tenant API, see module docstring."""
+    paths = request.data.get('requests') if isinstance(request.data, dict) else None
+    if not isinstance(paths, list) or not paths or not all(isinstance(path, str) for path in paths):
+        return Response({'requests': ["Liste de chemins attendue."]}, status=status.HTTP_400_BAD_REQUEST)
+    if len(paths) > MAX_REQUESTS:
+        return Response({'requests': [f"{MAX_REQUESTS} requêtes au maximum par lot."]},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response({'responses': [run_one(request, path) for path in paths]})
@@ -0,0 +1,118 @@
+"""
+Tenant-aware two-level cache for read endpoints.
+
+  L1  caches['local']    in-process LocMemCache, a few seconds, no I/O
+  L2  caches['default']  shared between workers (file or database backend)
+
+Both backends use django_tenants.cache.make_key, which prefixes every key with
+connection.schema_name, so a clinic can only ever read its own entries.
+
+Cached pages hold decrypted PII (cin, phone, insurance_id). L2 may be files on
+disk, so its entries are encrypted like the columns they come from; L1 only
+lives in process memory.
+
+Entries belong to a group (patients, roster, analytics). Invalidating a group stores a
+new generation number in L2; since every lookup reads the
+current generation from L2 first and the generation is part of the entry key,
+stale entries of every process (L1 included) simply stop being addressed and
+expire on their own. Invalidation runs on commit, so a reader cannot cache the
+pre-commit state right after we invalidated.
+"""
+import base64
+import pickle
+import time
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django_tenants.utils import schema_context
+from .replicas import primary
+
+PATIENTS = 'patients'
+ROSTER = 'roster'
+ANALYTICS = 'analytics'  # never invalidated, entries expire (medical/analytics.py)
+
+_MISSING = object()
+
+_cipher = Fernet(base64.urlsafe_b64encode(settings.SECRET_KEY[:32].encode().ljust(32)))
+
+
+def _l1():
+    return caches['local']
+
+
+def _l2():
+    return caches['default']
+
+
+def _seal(value):
+    return _cipher.encrypt(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _unseal(token):
+    try:
+        return pickle.loads(_cipher.decrypt(token))
+    except (InvalidToken, TypeError):
+        # Written under another SECRET_KEY, or before entries were sealed: a miss
+        return _MISSING
+
+
+def generation(group):
+    value = _l2().get(f'gen:{group}')
+    if value is None:
+        value = time.time_ns()
+        # add() so two workers racing on a cold cache agree on one generation
+        if not _l2().add(f'gen:{group}', value, timeout=None):
+            value = _l2().get(f'gen:{group}', value)
+    return value
+
+
+def _lookup(group, key):
+    entry_key = f'{group}:{generation(group)}:{key}'
+    value = _l1().get(entry_key, _MISSING)
+    if value is _MISSING:
+        token = _l2().get(entry_key)
+        value = _MISSING if token is None else _unseal(token)
+        if value is not _MISSING:
+            _l1().set(entry_key, value)
+    return entry_key, value
+
+
+def _store(entry_key, value, timeout):
+    _l2().set(entry_key, _seal(value), timeout=timeout)
+    _l1().set(entry_key, value)
+
+
+def get_or_compute(group, key, compute, timeout=None):
+    """Return the cached value for `key` in `group`, calling compute() on a miss."""
+    entry_key, value = _lookup(group, key)
+    if value is _MISSING:
+        # Never cache what a lagging replica returned right after an invalidation
+        with primary():
+            value = compute()
+        _store(entry_key, value, timeout)
+    return value
+
+
+async def aget_or_compute(group, key, compute, timeout=None):
+    """get_or_compute() for async views: `compute` is a coroutine function."""
+    # Keys depend on connection.schema_name: cache I/O runs on the request's thread
+    entry_key, value = await sync_to_async(_lookup)(group, key)
+    if value is _MISSING:
+        with primary():
+            value = await compute()
+        await sync_to_async(_store)(entry_key, value, timeout)
+    return value
+
+
+def _bump(schema_name, groups):
+    with schema_context(schema_name):
+        for group in groups:
+            _l2().set(f'gen:{group}', time.time_ns(), timeout=None)
+
+
+def invalidate(*groups, schema_name=None):
+    """Drop every entry of `groups` for the current (or given) tenant once the transaction commits."""
+    schema_name = schema_name or connection.schema_name
+    transaction.on_commit(lambda: _bump(schema_name, groups))
@@ -1,10 +1,27 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django_tenants.utils import get_tenant_domain_model
 
 class TenantDebugMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.resolve_tenant(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # On the request's thread, where its connection lives
+        await sync_to_async(self.resolve_tenant)(request)
+        return await self.get_response(request)
+
+    def resolve_tenant(self, request):
         from django.db import connection
         from django.conf import settings
         
@@ -22,6 +39,3 @@ class TenantDebugMiddleware:
         # Ensure URLConf is set for tenants
         if hasattr(request, 'tenant') and request.tenant.schema_name != 'public':
             request.urlconf = settings.TENANT_URLCONF
-            
-        response = self.get_response(request)
-        return response
\ No newline at end of file
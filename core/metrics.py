@@ -0,0 +1,275 @@
+"""
+Per-request performance metrics, exposed in Prometheus text format at /metrics.
+
+RequestMetricsMiddleware samples METRICS_SAMPLE_RATE of the requests and
+records, per route pattern and tenant schema:
+  - total time, SQL time and SQL query count (connection.execute_wrapper on
+    'default' and the replicas),
+  - serialization time (rendering of DRF / template responses),
+  - response size,
+as histograms, plus a request counter per status code. Unsampled requests go
+straight through: with a sample rate of 0 the cost is one random() call.
+
+Every worker process keeps its own registry and writes it to METRICS_DIR
+every METRICS_FLUSH_INTERVAL seconds (and at exit); /metrics merges the files
+of all processes, so any worker can answer the scrape. Files of stopped
+workers are kept so counters do not go backwards, until they are
+METRICS_FILE_MAX_AGE seconds old: the next scrape deletes them (Prometheus
+reads the drop as a counter reset).
+"""
+import atexit
+import glob
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, suppress
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'clinic_request_duration_seconds': ("Total time spent handling the request.", DURATION_BUCKETS),
+    'clinic_request_sql_duration_seconds': ("Time spent in SQL queries.", DURATION_BUCKETS),
+    'clinic_request_sql_queries': ("Number of SQL queries.", QUERY_BUCKETS),
+    'clinic_request_serialization_seconds': ("Time spent rendering the response body.", DURATION_BUCKETS),
+    'clinic_response_size_bytes': ("Response body size (0 for streamed responses).", SIZE_BUCKETS),
+}
+REQUESTS_TOTAL = 'clinic_requests_total'
+
+
+def metrics_dir():
+    return str(getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'metrics')))
+
+
+class Registry:
+    """In-process histograms and counters, keyed by label tuples."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.histograms = {name: {} for name in HISTOGRAMS}  # name -> {labels: [bucket counts..., sum]}
+        self.counters = {}  # labels -> count
+        self.last_flush = time.monotonic()
+
+    def observe(self, labels, values, status_code):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked after recording (gunicorn --preload): the parent's numbers are not ours
+                self.reset()
+            for name, value in values.items():
+                buckets = HISTOGRAMS[name][1]
+                series = self.histograms[name].setdefault(labels, [0] * (len(buckets) + 2))
+                series[bisect_left(buckets, value)] += 1
+                series[-1] += value
+            key = (*labels, str(status_code))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            due = time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': {name: [[list(labels), series[:]] for labels, series in data.items()]
+                               for name, data in self.histograms.items()},
+                'counters': [[list(labels), count] for labels, count in self.counters.items()],
+            }
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        snapshot = self.snapshot()
+        if not snapshot['counters']:
+            return
+        directory = metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(f'{path}.tmp', path)
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+# --------------------------
+# Collection
+# --------------------------
+
+def wrap_queries(wrapper):
+    """Install `wrapper` on 'default' and the replicas until the returned stack is closed."""
+    stack = ExitStack()
+    for alias in ('default', *settings.DATABASE_REPLICAS):
+        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+    return stack
+
+
+class RequestSample:
+    def __init__(self):
+        self.sql_seconds = 0.0
+        self.sql_queries = 0
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.sql_queries += 1
+
+
+class RequestMetricsMiddleware:
+    """Goes right after the tenant middlewares, so throttled (429) requests are measured too."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE or request.path == '/metrics':
+            return self.get_response(request)
+
+        sample = request.metrics_sample = RequestSample()
+        started = time.perf_counter()
+        with wrap_queries(sample):
+            response = self.get_response(request)
+        self.observe(request, sample, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE or request.path == '/metrics':
+            return await self.get_response(request)
+
+        sample = request.metrics_sample = RequestSample()
+        started = time.perf_counter()
+        # Queries run on the request's thread: wrap that thread's connections
+        queries = await sync_to_async(wrap_queries)(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(queries.close)()
+        await sync_to_async(self.observe)(request, sample, response, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, sample, response, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        labels = (match.route if match else 'unmatched', connection.schema_name)
+        registry.observe(labels, {
+            'clinic_request_duration_seconds': elapsed,
+            'clinic_request_sql_duration_seconds': sample.sql_seconds,
+            'clinic_request_sql_queries': sample.sql_queries,
+            'clinic_request_serialization_seconds': sample.render_seconds,
+            'clinic_response_size_bytes': 0 if response.streaming else len(response.content),
+        }, response.status_code)
+
+    def process_template_response(self, request, response):
+        sample = getattr(request, 'metrics_sample', None)
+        if sample is not None:
+            render = response.render
+
+            def timed_render():
+                started = time.perf_counter()
+                try:
+                    return render()
+                finally:
+                    sample.render_seconds += time.perf_counter() - started
+
+            response.render = timed_render
+        return response
+
+
+# --------------------------
+# Exposition
+# --------------------------
+
+def _stale(path):
+    """File of a stopped worker, not written for METRICS_FILE_MAX_AGE seconds."""
+    try:
+        if time.time() - os.path.getmtime(path) < settings.METRICS_FILE_MAX_AGE:
+            return False
+        # An idle worker does not flush: only drop the files of dead processes
+        os.kill(int(os.path.basename(path)[len('metrics-'):-len('.json')]), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def _merged():
+    histograms = {name: {} for name in HISTOGRAMS}
+    counters = {}
+    for path in glob.glob(os.path.join(metrics_dir(), 'metrics-*.json')):
+        if _stale(path):
+            with suppress(FileNotFoundError):  # concurrent scrape
+                os.remove(path)
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, rows in data['histograms'].items():
+            for labels, series in rows:
+                merged = histograms[name].setdefault(tuple(labels), [0] * len(series))
+                for i, value in enumerate(series):
+                    merged[i] += value
+        for labels, count in data['counters']:
+            counters[tuple(labels)] = counters.get(tuple(labels), 0) + count
+    return histograms, counters
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def render_metrics():
+    registry.flush()
+    histograms, counters = _merged()
+    lines = [
+        '# HELP clinic_metrics_sample_rate Share of requests recorded by the metrics below.',
+        '# TYPE clinic_metrics_sample_rate gauge',
+        f'clinic_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}',
+        f'# HELP {REQUESTS_TOTAL} Sampled requests by status code.',
+        f'# TYPE {REQUESTS_TOTAL} counter',
+    ]
+    for (route, tenant, status_code), count in sorted(counters.items()):
+        lines.append(f'{REQUESTS_TOTAL}{_labels(route=route, tenant=tenant, status=status_code)} {count}')
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (route, tenant), series in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), series[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(route=route, tenant=tenant, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(route=route, tenant=tenant)} {series[-1]}')
+            lines.append(f'{name}_count{_labels(route=route, tenant=tenant)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Internal scrape endpoint: only METRICS_ALLOWED_IPS (the proxy's forwarded address is not trusted)."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,141 @@
+"""
+N+1 query detector for development and tests.
+
+NPlusOneMiddleware counts the queries of each request by fingerprint (the
+normalized statement of core/slow_queries.py, so `WHERE id = 1` and
+`WHERE id = 2` are the same query). Once a fingerprint repeats
+NPLUSONE_THRESHOLD times, the detector names where it comes from:
+  - the serializer field being rendered (AppointmentSerializer.patient_name),
+  - the lazily loaded relation (Appointment.patient),
+  - otherwise the first project frame (medical/models.py:193 in __str__).
+
+NPLUSONE_MODE: 'raise' (default under `manage.py test`) raises NPlusOneError
+after the response, 'log' (default with DEBUG) logs a warning, 'off' skips
+the wrapper entirely. NPLUSONE_ALLOW lists origins, views or fingerprints to
+ignore. detect_n_plus_one() gives the same check around any block of code.
+"""
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from .metrics import wrap_queries
+from .slow_queries import _SESSION_PREFIX, normalize, fingerprint
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = 'off'
+MODE_LOG = 'log'
+MODE_RAISE = 'raise'
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def _origin(frame):
+    """Serializer field and/or related attribute on the stack, else the first project frame."""
+    from rest_framework.fields import Field
+    relation = serializer_field = project_frame = None
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if 'execute' in frame.f_locals and 'sql' in frame.f_locals:
+            pass  # another execute_wrapper (metrics, slow-query log, pooling)
+        elif relation is None and frame.f_code.co_name in ('__get__', 'get_object') \
+                and getattr(getattr(owner, 'field', None), 'remote_field', None) is not None:
+            relation = f'{owner.field.model.__name__}.{owner.field.name}'
+        elif serializer_field is None and isinstance(owner, Field) and owner.field_name and owner.parent is not None:
+            serializer_field = f'{type(owner.parent).__name__}.{owner.field_name}'
+        elif project_frame is None and frame.f_code.co_filename.startswith(str(settings.BASE_DIR)) \
+                and 'site-packages' not in frame.f_code.co_filename:
+            filename = os.path.relpath(frame.f_code.co_filename, settings.BASE_DIR)
+            project_frame = f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    origin = ' -> '.join(name for name in (serializer_field, relation) if name)
+    return origin or project_frame or 'unknown'
+
+
+class QueryRepeatCounter:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = {}
+        self.repeats = {}  # fingerprint -> (origin, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        normalized = normalize(_SESSION_PREFIX.sub('', sql))
+        key = fingerprint(normalized)
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count == self.threshold:
+            self.repeats[key] = (_origin(sys._getframe(1)), normalized)
+        return execute(sql, params, many, context)
+
+    def report(self, where, allow=()):
+        problems = []
+        for key, (origin, sql) in self.repeats.items():
+            if key in allow or where in allow or any(part in allow for part in origin.split(' -> ')):
+                continue
+            problems.append(f"{self.counts[key]} x {origin} [{key}]: {sql[:200]}")
+        if problems:
+            return f"N+1 queries in {where}:\n  " + '\n  '.join(problems)
+        return None
+
+
+def check(counter, where, mode=None):
+    mode = mode or settings.NPLUSONE_MODE
+    message = counter.report(where, settings.NPLUSONE_ALLOW)
+    if message is None:
+        return
+    if mode == MODE_RAISE:
+        raise NPlusOneError(message)
+    logger.warning(message)
+
+
+@contextmanager
+def detect_n_plus_one(where='block', mode=None, threshold=None):
+    """Count the queries of the block and report repeated ones when it exits."""
+    counter = QueryRepeatCounter(threshold or settings.NPLUSONE_THRESHOLD)
+    with wrap_queries(counter):
+        yield counter
+    check(counter, where, mode)
+
+
+class NPlusOneMiddleware:
+    """Active when NPLUSONE_MODE is not 'off'. Goes after the tenant middlewares."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if settings.NPLUSONE_MODE == MODE_OFF:
+            return self.get_response(request)
+
+        counter = QueryRepeatCounter(settings.NPLUSONE_THRESHOLD)
+        with wrap_queries(counter):
+            response = self.get_response(request)
+        check(counter, self.where(request))
+        return response
+
+    async def __acall__(self, request):
+        if settings.NPLUSONE_MODE == MODE_OFF:
+            return await self.get_response(request)
+
+        # The wrappers go on the connections of the request's thread
+        counter = QueryRepeatCounter(settings.NPLUSONE_THRESHOLD)
+        queries = await sync_to_async(wrap_queries)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(queries.close)()
+        check(counter, self.where(request))
+        return response
+
+    def where(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match and match.view_name else request.path
@@ -0,0 +1,120 @@
+"""
+django-tenants backend made safe for pooled / persistent connections.
+
+django-tenants sends `SET search_path` on every new cursor after set_tenant(),
+even when the physical connection already points at the right schema. With
+CONN_MAX_AGE the same connection serves request after request, so we track
+what the *server* session currently has and only send SET when it differs.
+The per-tenant statement_timeout (see clinics/throttling.py) travels with it.
+The tracker is reset whenever the server may have dropped our setting:
+new connection, close, rollback and savepoint rollback (a SET issued inside a
+transaction is undone by ROLLBACK).
+
+DATABASE_POOL_MODE:
+  session      persistent Django connections or PgBouncer in session mode.
+  transaction  PgBouncer in transaction mode: consecutive statements may run on
+               different server connections, so no session state can be
+               trusted. Every statement is sent as `SET search_path ...; <sql>`
+               in the same round trip (server-side cursors must be disabled).
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.utils import DatabaseError
+from django_tenants.postgresql_backend import base as tenant_backend
+
+POOL_MODE_SESSION = 'session'
+POOL_MODE_TRANSACTION = 'transaction'
+POOL_MODES = (POOL_MODE_SESSION, POOL_MODE_TRANSACTION)
+
+
+def search_path_sql(search_paths):
+    return 'SET search_path = {0}'.format(','.join("'{}'".format(s) for s in search_paths))
+
+
+def statement_timeout_sql(milliseconds):
+    if milliseconds is None:
+        return 'SET statement_timeout TO DEFAULT'
+    return f'SET statement_timeout = {int(milliseconds)}'
+
+
+class DatabaseWrapper(tenant_backend.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        # (search_path, statement_timeout) the server session currently has, None when unknown
+        self.applied_session = None
+        # Per-request statement_timeout in ms, None for the server default
+        self.statement_timeout = None
+        super().__init__(*args, **kwargs)
+        self.pool_mode = getattr(settings, 'DATABASE_POOL_MODE', POOL_MODE_SESSION)
+        if self.pool_mode not in POOL_MODES:
+            raise ImproperlyConfigured(f"DATABASE_POOL_MODE must be one of {POOL_MODES}.")
+        if self.pool_mode == POOL_MODE_TRANSACTION:
+            self.execute_wrappers.append(self._with_search_path)
+
+    def _current_search_paths(self):
+        if not self.schema_name:
+            raise ImproperlyConfigured("Database schema not set. Did you forget "
+                                       "to call set_schema() or set_tenant()?")
+        return self._get_cursor_search_paths()
+
+    def _session_sql(self):
+        return f'{search_path_sql(self._current_search_paths())}; {statement_timeout_sql(self.statement_timeout)}'
+
+    def set_statement_timeout(self, milliseconds):
+        """Applies to the following queries, like set_tenant(). None restores the server default."""
+        self.statement_timeout = milliseconds
+
+    # --------------------------
+    # Tracker resets
+    # --------------------------
+
+    def get_new_connection(self, conn_params):
+        self.applied_session = None
+        return super().get_new_connection(conn_params)
+
+    def close(self):
+        self.applied_session = None
+        super().close()
+
+    def _rollback(self):
+        self.applied_session = None
+        super()._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.applied_session = None
+        super()._savepoint_rollback(sid)
+
+    # --------------------------
+    # Cursors
+    # --------------------------
+
+    def _cursor(self, name=None):
+        # Skip django-tenants' unconditional SET; decide here instead
+        cursor = super(tenant_backend.DatabaseWrapper, self)._cursor(name=name)
+        if self.pool_mode == POOL_MODE_TRANSACTION:
+            return cursor
+
+        session = (self._current_search_paths(), self.statement_timeout)
+        if session == self.applied_session:
+            return cursor
+
+        # A named (server-side) cursor can only run its own query
+        cursor_for_search_path = self.connection.cursor() if name or tenant_backend.is_psycopg3 else cursor
+        try:
+            cursor_for_search_path.execute(self._session_sql())
+        except (DatabaseError, tenant_backend.psycopg.InternalError):
+            # Aborted transaction: the next statement fails anyway, retry after rollback
+            self.applied_session = None
+        else:
+            self.applied_session = session
+        finally:
+            if cursor_for_search_path is not cursor:
+                cursor_for_search_path.close()
+        return cursor
+
+    def _with_search_path(self, execute, sql, params, many, context):
+        """execute_wrapper for transaction pooling: pin the schema in the statement itself."""
+        prefix = self._session_sql()
+        if params is not None:
+            prefix = prefix.replace('%', '%%')
+        return execute(f'{prefix}; {sql}', params, many, context)
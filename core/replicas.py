@@ -0,0 +1,157 @@
+"""
+Read-replica routing for safe GET requests.
+
+ReplicaRoutingMiddleware marks GET/HEAD requests served by a view of
+settings.REPLICA_VIEW_MODULES as replica-eligible; ReplicaRouter then sends
+their reads to one of settings.DATABASE_REPLICAS (picked once per request).
+Everything else, writes included, stays on 'default'.
+
+- Tenant schema: django-tenants only switches the 'default' connection, so the
+  router copies its tenant (and statement_timeout) onto the replica connection
+  before each read.
+- Read-your-writes: a successful write pins its user to the primary for
+  REPLICA_PIN_SECONDS (shared cache, so it holds across workers), which covers
+  the replication lag the user would otherwise notice. Views marked
+  @read_only (a POST that writes nothing, like api/batch/) do not pin.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_request = contextvars.ContextVar('replica_request', default=None)
+
+
+def _pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def pin_to_primary(user):
+    caches['default'].set(_pin_key(user.pk), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def read_only(view):
+    """Mark a non-GET view that writes nothing: its calls do not pin the user to the primary."""
+    view.read_only = True
+    return view
+
+
+@contextmanager
+def primary():
+    """Read from 'default' inside the block, e.g. to fill a cache that outlives the replica lag."""
+    token = _replica_request.set(None)
+    try:
+        yield
+    finally:
+        _replica_request.reset(token)
+
+
+def replica_eligible(request, view_func):
+    return bool(settings.DATABASE_REPLICAS and request.method in SAFE_METHODS
+                and view_func.__module__ in settings.REPLICA_VIEW_MODULES)
+
+
+@contextmanager
+def replica_reads(request, view_func):
+    """Route the block's reads as the middleware routes `view_func` (batch sub-requests)."""
+    if not replica_eligible(request, view_func):
+        yield
+        return
+    token = _replica_request.set(ReplicaRead(request))
+    try:
+        yield
+    finally:
+        _replica_request.reset(token)
+
+
+class ReplicaRead:
+    def __init__(self, request):
+        self.request = request
+        self.alias = random.choice(settings.DATABASE_REPLICAS)
+        self.pinned = None
+
+    def is_pinned(self):
+        # Decided lazily: DRF authenticates (JWT) after the middleware ran
+        if self.pinned is None:
+            user = getattr(self.request, 'user', None)
+            if user is None or not user.is_authenticated:
+                return False
+            self.pinned = bool(caches['default'].get(_pin_key(user.pk)))
+        return self.pinned
+
+
+class ReplicaRouter:
+    """Listed before TenantSyncRouter in DATABASE_ROUTERS."""
+
+    def db_for_read(self, model, **hints):
+        read = _replica_request.get()
+        if read is None or read.is_pinned():
+            return None
+        replica = connections[read.alias]
+        if replica.schema_name != connection.schema_name:
+            replica.set_tenant(connection.tenant, connection.include_public_schema)
+        replica.set_statement_timeout(connection.statement_timeout)
+        return read.alias
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Must come after the tenant middlewares."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request.replica_token is not None:
+                _replica_request.reset(request.replica_token)
+        self.pin_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        # process_view runs in a sync_to_async copy of the context, so its token
+        # cannot be reset here; the request's task context dies with it anyway
+        request.replica_token = None
+        response = await self.get_response(request)
+        await sync_to_async(self.pin_writer)(request, response)
+        return response
+
+    def pin_writer(self, request, response):
+        user = getattr(request, 'user', None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and not getattr(request, 'read_only', False)
+                and user is not None and user.is_authenticated):
+            pin_to_primary(user)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.read_only = getattr(view_func, 'read_only', False)
+        if replica_eligible(request, view_func):
+            request.replica_token = _replica_request.set(ReplicaRead(request))
+        return None
@@ -0,0 +1,164 @@
+"""
+Opt-in slow-query log, tagged with the tenant and the view.
+
+With SLOW_QUERY_MS set, SlowQueryMiddleware wraps every query of the request
+(connection.execute_wrapper on 'default' and the replicas). A query slower
+than the threshold is appended to SLOW_QUERY_LOG as one JSON line with:
+tenant schema, view name, duration, a fingerprint of the normalized statement
+(literals and parameters replaced by ?, IN lists collapsed) and its
+`EXPLAIN` plan (estimates only, the query is not run again).
+EXPLAIN is captured once per fingerprint per process, for the first
+MAX_EXPLAINED fingerprints, inside a savepoint so a failing EXPLAIN can never
+break the request's transaction.
+
+`manage.py slow_queries` aggregates the log per fingerprint.
+Jobs and commands can use `with record_slow_queries('my-task'):` directly.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_EXPLAINED = 1000  # fingerprints remembered per process
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+
+# Transaction pooling prefixes every statement with its SET commands
+_SESSION_PREFIX = re.compile(r'^(?:\s*SET [^;]*;)+\s*', re.IGNORECASE)
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                  # string literals
+    (re.compile(r'%s'), '?'),                              # parameters
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),               # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),  # IN (?, ?, ...)
+    (re.compile(r'\s+'), ' '),
+]
+
+_explained = set()
+_write_lock = threading.Lock()
+
+
+def normalize(sql):
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+class SlowQueryRecorder:
+    def __init__(self, connection, view_name, threshold_ms):
+        self.connection = connection
+        self.view_name = view_name
+        self.threshold = threshold_ms / 1000
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.threshold:
+            self.record(_SESSION_PREFIX.sub('', sql), params, many, elapsed)
+        return result
+
+    def record(self, sql, params, many, elapsed):
+        normalized = normalize(sql)
+        if not normalized:
+            return
+        key = fingerprint(normalized)
+        plan = None
+        # Once _explained is full, new fingerprints are logged without a plan
+        if (not many and key not in _explained and len(_explained) < MAX_EXPLAINED
+                and normalized.lower().startswith(EXPLAINABLE)):
+            _explained.add(key)
+            plan = self.explain(sql, params)
+
+        entry = {
+            'at': timezone.now().isoformat(),
+            'schema': self.connection.schema_name,
+            'database': self.connection.alias,
+            'view': self.view_name,
+            'ms': round(elapsed * 1000, 1),
+            'fingerprint': key,
+            'sql': normalized,
+            'plan': plan,
+        }
+        logger.warning("Slow query %.0f ms [%s] %s: %s", entry['ms'], entry['schema'], self.view_name, normalized[:200])
+        with _write_lock, open(settings.SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def explain(self, sql, params):
+        self.explaining = True
+        try:
+            with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}', params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            return f'EXPLAIN failed: {type(e).__name__}: {e}'
+        finally:
+            self.explaining = False
+
+
+@contextmanager
+def record_slow_queries(view_name):
+    """Log the queries run inside the block that exceed SLOW_QUERY_MS (no-op when unset)."""
+    if not settings.SLOW_QUERY_MS:
+        yield
+        return
+    with ExitStack() as stack:
+        for alias in ('default', *settings.DATABASE_REPLICAS):
+            connection = connections[alias]
+            stack.enter_context(connection.execute_wrapper(
+                SlowQueryRecorder(connection, view_name, settings.SLOW_QUERY_MS)
+            ))
+        yield
+
+
+class SlowQueryMiddleware:
+    """Opt-in with SLOW_QUERY_MS. Goes after the tenant middlewares."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.SLOW_QUERY_MS:
+            return self.get_response(request)
+        with record_slow_queries(request.path):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.SLOW_QUERY_MS:
+            return await self.get_response(request)
+        # Entered and exited on the request's thread, where its queries run
+        recording = ExitStack()
+        await sync_to_async(recording.enter_context)(record_slow_queries(request.path))
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(recording.close)()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Queries from here on are tagged with the view rather than the path
+        view = getattr(view_func, 'view_class', view_func)  # DRF @api_view names its class after the function
+        for alias in ('default', *settings.DATABASE_REPLICAS):
+            for wrapper in connections[alias].execute_wrappers:
+                if isinstance(wrapper, SlowQueryRecorder):
+                    wrapper.view_name = f'{view.__module__}.{view.__name__}'
+        return None
@@ -0,0 +1,363 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_tenants.utils import tenant_context
+from rest_framework.test import APIRequestFactory, force_authenticate
+from clinics.models import Clinic
+from medical.models import Appointment, Patient
+from medical.serializers import AppointmentSerializer
+from medical.tests import TwoClinicsMixin
+from medical.views import patient_list
+from users.models import User
+from .batch import batch
+from .metrics import Registry, render_metrics
+from .nplusone import NPlusOneError, detect_n_plus_one
+from .postgresql_backend.base import POOL_MODE_SESSION, search_path_sql
+from .replicas import ReplicaRoutingMiddleware, _pin_key, primary
+from .slow_queries import MAX_EXPLAINED, SlowQueryRecorder, fingerprint, normalize
+
+
+class PooledConnectionIsolationTests(TwoClinicsMixin, TransactionTestCase):
+    """Reused connections must always query the clinic set on them, never the previous one."""
+
+    THREADS = 8
+    ITERATIONS = 50
+
+    def test_no_cross_tenant_leakage_under_concurrency(self):
+        leaks = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(offset):
+            # Each thread owns one persistent connection, like a WSGI worker thread
+            try:
+                barrier.wait()
+                for i in range(self.ITERATIONS):
+                    clinic = self.clinics[(offset + i) % len(self.clinics)]
+                    connection.set_tenant(clinic)
+                    if i % 5 == 0:
+                        # A rolled back transaction undoes any SET search_path it contained
+                        try:
+                            with transaction.atomic():
+                                Patient.objects.count()
+                                raise RuntimeError
+                        except RuntimeError:
+                            pass
+                    owners = self.visible_owners()
+                    if owners != {clinic.schema_name}:
+                        leaks.append((clinic.schema_name, owners))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(leaks, [])
+
+    def test_search_path_reapplied_after_rollback(self):
+        clinic_a, clinic_b = self.clinics
+        connection.set_tenant(clinic_a)
+        self.visible_owners()
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                connection.set_tenant(clinic_b)
+                self.assertEqual(self.visible_owners(), {clinic_b.schema_name})
+                raise RuntimeError
+
+        # The server went back to clinic_a's search_path; clinic_b must be set again
+        self.assertEqual(self.visible_owners(), {clinic_b.schema_name})
+
+    def test_redundant_search_path_is_skipped(self):
+        if settings.DATABASE_POOL_MODE != POOL_MODE_SESSION:
+            self.skipTest("Transaction pooling sets search_path on every statement.")
+        clinic = self.clinics[0]
+        connection.set_schema_to_public()
+        Clinic.objects.count()
+
+        with mock.patch('core.postgresql_backend.base.search_path_sql', wraps=search_path_sql) as set_calls:
+            for _ in range(3):
+                connection.set_tenant(clinic)
+                self.assertEqual(self.visible_owners(), {clinic.schema_name})
+
+        self.assertEqual(set_calls.call_count, 1)
+
+
+@override_settings(DATABASE_REPLICAS=['test_replica'])
+class ReplicaRoutingTests(TwoClinicsMixin, TransactionTestCase):
+    """Safe GETs of medical.views read from the replica, in the tenant's schema; writers are pinned to the primary."""
+    databases = {'default', 'test_replica'}
+
+    def setUp(self):
+        super().setUp()
+        caches['local'].clear()
+        caches['default'].clear()
+        self.clinic = self.clinics[0]
+        self.user = User.objects.create_user(username='replica_admin', password='x', role='ADMIN',
+                                             clinic_id=self.clinic.id)
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        caches['default'].delete(_pin_key(self.user.pk))
+        self.user.delete()
+        super().tearDown()
+
+    def serve(self, request, view):
+        """Run `view` behind ReplicaRoutingMiddleware; returns the response and the queries of each alias."""
+        request.tenant = self.clinic
+        force_authenticate(request, user=self.user)
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        with tenant_context(self.clinic), CaptureQueriesContext(connections['default']) as primary_queries, \
+                CaptureQueriesContext(connections['test_replica']) as replica_queries:
+            response = middleware(request)
+        return response, primary_queries, replica_queries
+
+    def test_safe_get_reads_the_replica_in_the_tenant_schema(self):
+        schema = self.clinic.schema_name
+        response, primary_queries, replica_queries = self.serve(
+            self.factory.get(f'/api/medical/patients/?search={schema}'), patient_list)
+        self.assertEqual([row['last_name'] for row in response.data['results']], [schema])
+        self.assertEqual(len(primary_queries), 0)
+        self.assertGreater(len(replica_queries), 0)
+        self.assertEqual(connections['test_replica'].schema_name, schema)
+
+    def test_write_pins_the_user_to_the_primary(self):
+        response, _, _ = self.serve(self.factory.post('/api/medical/patients/', {
+            'first_name': 'Nouveau', 'last_name': 'replica', 'phone': '0611111111', 'gender': 'F'}, format='json'),
+            patient_list)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(caches['default'].get(_pin_key(self.user.pk)))
+
+        response, primary_queries, replica_queries = self.serve(
+            self.factory.get('/api/medical/patients/?search=replica'), patient_list)
+        self.assertEqual([row['last_name'] for row in response.data['results']], ['replica'])
+        self.assertGreater(len(primary_queries), 0)
+        self.assertEqual(len(replica_queries), 0)
+
+    def test_primary_overrides_the_replica(self):
+        databases = []
+
+        def get_response(request):
+            middleware.process_view(request, patient_list, (), {})
+            databases.append(Patient.objects.all().db)
+            with primary():
+                databases.append(Patient.objects.all().db)
+            databases.append(Patient.objects.all().db)
+            return HttpResponse()
+
+        request = self.factory.get('/api/medical/patients/')
+        request.user = self.user
+        middleware = ReplicaRoutingMiddleware(get_response)
+        with tenant_context(self.clinic):
+            middleware(request)
+        self.assertEqual(databases, ['test_replica', 'default', 'test_replica'])
+
+
+class MetricsExpositionTests(SimpleTestCase):
+    """Histogram buckets, per-process files and the Prometheus text of core/metrics.py."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        settings_override = override_settings(METRICS_DIR=self.dir, METRICS_FLUSH_INTERVAL=3600,
+                                              METRICS_SAMPLE_RATE=0.5)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.registry = Registry()
+        patcher = mock.patch('core.metrics.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def lines(self, name):
+        return [line for line in render_metrics().splitlines() if line.startswith(name)]
+
+    def test_buckets_are_cumulative_with_inf_and_count(self):
+        labels = ('api/medical/patients/', 'test_pool_a')
+        for seconds, status_code in ((0.25, 200), (0.5, 200), (20, 404)):
+            self.registry.observe(labels, {'clinic_request_duration_seconds': seconds}, status_code)
+
+        series = 'route="api/medical/patients/",tenant="test_pool_a"'
+        self.assertEqual(self.lines('clinic_requests_total{'), [
+            f'clinic_requests_total{{{series},status="200"}} 2',
+            f'clinic_requests_total{{{series},status="404"}} 1',
+        ])
+        # bisect_left: a value equal to a bound falls in that bound's bucket (le is inclusive)
+        buckets = dict(line.rsplit(' ', 1) for line in self.lines('clinic_request_duration_seconds_bucket'))
+        self.assertEqual(buckets[f'clinic_request_duration_seconds_bucket{{{series},le="0.1"}}'], '0')
+        self.assertEqual(buckets[f'clinic_request_duration_seconds_bucket{{{series},le="0.25"}}'], '1')
+        self.assertEqual(buckets[f'clinic_request_duration_seconds_bucket{{{series},le="0.5"}}'], '2')
+        self.assertEqual(buckets[f'clinic_request_duration_seconds_bucket{{{series},le="10.0"}}'], '2')
+        self.assertEqual(buckets[f'clinic_request_duration_seconds_bucket{{{series},le="+Inf"}}'], '3')
+        self.assertEqual(self.lines('clinic_request_duration_seconds_sum'),
+                         [f'clinic_request_duration_seconds_sum{{{series}}} 20.75'])
+        self.assertEqual(self.lines('clinic_request_duration_seconds_count'),
+                         [f'clinic_request_duration_seconds_count{{{series}}} 3'])
+        self.assertIn('clinic_metrics_sample_rate 0.5', render_metrics().splitlines())
+
+    def test_files_of_other_processes_are_merged_until_stale(self):
+        labels = ('api/users/', 'test_pool_a')
+        self.registry.observe(labels, {'clinic_request_sql_queries': 3}, 200)
+        self.registry.flush()
+        # A stopped worker (no such pid) that recorded the same series
+        with open(os.path.join(self.dir, f'metrics-{os.getpid()}.json'), encoding='utf-8') as f:
+            snapshot = f.read()
+        stopped = os.path.join(self.dir, 'metrics-99999999.json')
+        with open(stopped, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+
+        series = 'route="api/users/",tenant="test_pool_a"'
+        self.assertEqual(self.lines('clinic_request_sql_queries_count'),
+                         [f'clinic_request_sql_queries_count{{{series}}} 2'])
+
+        old = time.time() - settings.METRICS_FILE_MAX_AGE - 60
+        os.utime(stopped, (old, old))
+        self.assertEqual(self.lines('clinic_request_sql_queries_count'),
+                         [f'clinic_request_sql_queries_count{{{series}}} 1'])
+        self.assertFalse(os.path.exists(stopped))
+
+
+class SlowQueryLogTests(SimpleTestCase):
+    """Normalization, the SLOW_QUERY_MS threshold and the bounded EXPLAIN cache of core/slow_queries.py."""
+
+    def setUp(self):
+        self.log = tempfile.NamedTemporaryFile(suffix='.ndjson', delete=False).name
+        self.addCleanup(os.remove, self.log)
+        self.connection = mock.Mock(schema_name='test_pool_a', alias='default')
+
+    def entries(self):
+        with open(self.log, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def run_query(self, threshold_ms, sql='SELECT * FROM medical_patient WHERE id = %s'):
+        recorder = SlowQueryRecorder(self.connection, 'medical.views.patient_list', threshold_ms)
+        with override_settings(SLOW_QUERY_LOG=self.log), \
+                mock.patch.object(SlowQueryRecorder, 'explain', return_value='Index Scan') as explain:
+            recorder(lambda *args: None, sql, [42], False, {})
+        return explain
+
+    def test_literals_and_in_lists_share_a_fingerprint(self):
+        one = normalize("SELECT * FROM medical_patient WHERE last_name = 'O''Brien' AND id IN (1, 2, 3)")
+        other = normalize("SELECT *  FROM medical_patient\n WHERE last_name = %s AND id IN (%s)")
+        self.assertEqual(one, 'SELECT * FROM medical_patient WHERE last_name = ? AND id IN (...)')
+        self.assertEqual(fingerprint(one), fingerprint(other))
+        self.assertNotEqual(fingerprint(one), fingerprint(normalize('SELECT * FROM medical_appointment')))
+
+    def test_only_queries_over_the_threshold_are_logged(self):
+        self.run_query(threshold_ms=60_000)
+        self.assertEqual(self.entries(), [])
+        self.run_query(threshold_ms=0)
+        [entry] = self.entries()
+        self.assertEqual((entry['schema'], entry['view']), ('test_pool_a', 'medical.views.patient_list'))
+        self.assertEqual(entry['sql'], 'SELECT * FROM medical_patient WHERE id = ?')
+
+    def test_no_explain_once_the_cache_is_full(self):
+        with mock.patch('core.slow_queries._explained', {str(n) for n in range(MAX_EXPLAINED)}):
+            explain = self.run_query(threshold_ms=0)
+        explain.assert_not_called()
+        self.assertIsNone(self.entries()[0]['plan'])
+
+
+class NPlusOneDetectorTests(TwoClinicsMixin, TransactionTestCase):
+    """Serializing related fields without select_related must be caught, and named."""
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = User.objects.create_user(username='nplusone_doctor', password='x', role='DOCTOR')
+        self.clinic = self.clinics[0]
+        with tenant_context(self.clinic):
+            patient = Patient.objects.get()
+            start = timezone.now()
+            Appointment.objects.bulk_create([
+                Appointment(patient=patient, doctor=self.doctor, Subject=f'Visit {i}',
+                            StartTime=start + timedelta(hours=i), EndTime=start + timedelta(hours=i, minutes=30))
+                for i in range(6)
+            ])
+
+    def test_lazy_relations_raise_with_their_origin(self):
+        with tenant_context(self.clinic):
+            with self.assertRaises(NPlusOneError) as raised:
+                with detect_n_plus_one('appointments', mode='raise'):
+                    AppointmentSerializer(Appointment.objects.all(), many=True).data
+        self.assertIn('AppointmentSerializer.patient_name -> Appointment.patient', str(raised.exception))
+
+    def test_prefetched_queryset_passes(self):
+        with tenant_context(self.clinic):
+            with detect_n_plus_one('appointments', mode='raise'):
+                qs = Appointment.objects.select_related('patient', 'doctor').prefetch_related('treatment_steps')
+                self.assertEqual(len(AppointmentSerializer(qs, many=True).data), 6)
+
+
+class BatchEndpointTests(TwoClinicsMixin, TransactionTestCase):
+    """Sub-requests of api/batch/ run in the batch request's clinic, with its user."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='batch_admin', password='x', role='ADMIN')
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        self.user.delete()
+        super().tearDown()
+
+    def post_batch(self, clinic, paths):
+        request = self.factory.post('/api/batch/', {'requests': paths}, format='json')
+        request.tenant = clinic
+        request.urlconf = settings.TENANT_URLCONF
+        force_authenticate(request, user=self.user)
+        return batch(request)
+
+    def test_sub_requests_stay_in_the_clinic(self):
+        for clinic in self.clinics:
+            with tenant_context(clinic):
+                patient_id = Patient.objects.get().pk
+                response = self.post_batch(clinic, [
+                    f'/api/medical/patients/{patient_id}/',
+                    f'/api/medical/treatments/?patient={patient_id}',
+                    '/api/medical/patients/?page_size=5',
+                ])
+            self.assertEqual(response.status_code, 200)
+            detail, treatments, patients = response.data['responses']
+            self.assertEqual(detail['body']['last_name'], clinic.schema_name)
+            self.assertEqual((treatments['status'], treatments['body']), (200, []))
+            self.assertEqual([row['last_name'] for row in patients['body']['results']], [clinic.schema_name])
+
+    def test_unknown_and_streamed_routes_fail_per_item(self):
+        clinic = self.clinics[0]
+        with tenant_context(clinic):
+            response = self.post_batch(clinic, ['/api/unknown/', '/api/medical/patients/export/', '/admin/'])
+        self.assertEqual([item['status'] for item in response.data['responses']], [404, 400, 400])
+
+    def test_batch_leaves_no_primary_pin(self):
+        clinic = self.clinics[0]
+        request = self.factory.post('/api/batch/', {'requests': ['/api/medical/patients/']}, format='json')
+        request.tenant, request.urlconf = clinic, settings.TENANT_URLCONF
+        force_authenticate(request, user=self.user)
+
+        def get_response(request):
+            middleware.process_view(request, batch, (), {})
+            return batch(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        with tenant_context(clinic):
+            self.assertEqual(middleware(request).status_code, 200)
+        self.assertEqual(request.user, self.user)  # set by DRF: pin_writer did see the user
+        self.assertIsNone(caches['default'].get(_pin_key(self.user.pk)))
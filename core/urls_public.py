@@ -2,11 +2,15 @@ from django.contrib import admin
 from django.urls import path, include
 from users.views import CustomTokenObtainPairView # Import the view directly
 from rest_framework_simplejwt.views import TokenRefreshView
+from core.metrics import metrics_view
 
 print("[PUBLIC] URLS LOADED (Public Schema)")
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+
+    # Prometheus scrape endpoint (internal IPs only)
+    path('metrics', metrics_view, name='metrics'),
     
     # Auth endpoints (Directly assigned, no circular 'include')
     path('api/auth/login/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
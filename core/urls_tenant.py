@@ -2,11 +2,16 @@ from django.contrib import admin
 from django.urls import path, include
 from users.views import CustomTokenObtainPairView
 from rest_framework_simplejwt.views import TokenRefreshView
+from core.batch import batch
+from core.metrics import metrics_view
 
 print("[TENANT] URLS LOADED (Clinic Schema)")
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+
+    # Prometheus scrape endpoint (internal IPs only)
+    path('metrics', metrics_view, name='metrics'),
     
     # We define login here too so it works on the subdomain
     path('api/auth/login/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -17,4 +22,13 @@ urlpatterns = [
     
     # This provides /api/medical/...
     path('api/medical/', include('medical.urls')),
+
+    # This provides /api/billing/...
+    path('api/billing/', include('billing.urls')),
+
+    # This provides /api/jobs/<id>/ (background job status)
+    path('api/jobs/', include('clinics.urls')),
+
+    # Several GETs of the routes above in one round trip (core/batch.py)
+    path('api/batch/', batch, name='batch'),
 ]
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Occupancy analytics: booked versus free time per doctor and hour of the week.
+
+occupancy(start, end) loads the period's appointments in one query as NumPy
+arrays (start / end in minutes since the epoch, clinic local time, computed
+by PostgreSQL) plus the expanded occurrences of recurring series, then works
+on whole arrays, never row by row:
+  - every appointment is cut into the clock hours it covers (np.repeat over
+    the number of hours spanned) and the minutes of each piece are summed per
+    doctor and hour of the week with np.bincount: the heatmap is booked
+    minutes over available minutes, 7 rows of 24 hours, Monday first
+    (above 1 when the doctor is double-booked);
+  - utilization: booked minutes within ANALYTICS_OPENING_DAYS / _HOURS over
+    the opening minutes of the period, for each active doctor of the clinic
+    (booked or not) and for the clinic as a whole (every doctor's chair);
+  - no-show rate: NO_SHOW appointments among those already over;
+  - overrun rate: completed appointments with a treatment step recorded after
+    the end of their slot (no check-out time is stored: a step entered late
+    means the chair was still taken), among completed ones.
+Cancelled appointments take no time. Archived appointments (medical/archive.py)
+are not counted. Bookings change the figures too often for invalidation to
+pay off: cached_occupancy() keeps them ANALYTICS_CACHE_SECONDS per tenant and
+period.
+"""
+from datetime import datetime
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Extract
+from django.utils import timezone
+from core.cache import ANALYTICS, get_or_compute
+from users.models import User
+from .models import Appointment, TreatmentStep
+from .recurrence import FREE_STATUSES, MAX_DURATION, active_series, expand
+
+NO_SHOW = 'NoShow'
+COMPLETED = 'Completed'
+
+HOURS_PER_WEEK = 7 * 24
+EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday (Monday = 0)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def local_minutes(moment):
+    """Minutes since the epoch on the clinic's wall clock."""
+    return (timezone.localtime(moment).replace(tzinfo=None) - _EPOCH).total_seconds() / 60
+
+
+def load(start, end, doctor_id=None):
+    """
+    Appointments overlapping [start, end) as arrays:
+    doctor ids, start and end minutes (local), no-show / completed / overrun flags.
+    """
+    rows = (
+        Appointment.objects.filter(StartTime__lt=end, EndTime__gt=start).exclude(Status__in=FREE_STATUSES)
+        # Extract converts to the current time zone before taking the epoch
+        .annotate(start_epoch=Extract('StartTime', 'epoch'), end_epoch=Extract('EndTime', 'epoch'),
+                  overran=Exists(TreatmentStep.objects.filter(appointment=OuterRef('pk'),
+                                                              created_at__gt=OuterRef('EndTime'))))
+        .values_list('doctor_id', 'start_epoch', 'end_epoch', 'Status', 'overran')
+    )
+    series = active_series(start - MAX_DURATION, end)
+    if doctor_id is not None:
+        rows = rows.filter(doctor_id=doctor_id)
+        series = series.filter(doctor_id=doctor_id)
+
+    rows = list(rows)
+    occurrences = [
+        (one.doctor_id, local_minutes(one.StartTime), local_minutes(one.EndTime))
+        for one in expand(series, start - MAX_DURATION, end) if one.EndTime > start
+    ]
+    doctors = np.array([row[0] for row in rows] + [row[0] for row in occurrences], dtype=np.int64)
+    starts = np.array([float(row[1]) / 60 for row in rows] + [row[1] for row in occurrences], dtype=np.float64)
+    ends = np.array([float(row[2]) / 60 for row in rows] + [row[2] for row in occurrences], dtype=np.float64)
+    padding = [False] * len(occurrences)  # occurrences are scheduled, in the future
+    no_show = np.array([row[3] == NO_SHOW for row in rows] + padding, dtype=bool)
+    completed = np.array([row[3] == COMPLETED for row in rows] + padding, dtype=bool)
+    overran = np.array([row[3] == COMPLETED and row[4] for row in rows] + padding, dtype=bool)
+    return doctors, starts, ends, no_show, completed, overran
+
+
+def hour_pieces(starts, ends):
+    """(row, hour since the epoch, minutes) for every clock hour each [start, end) covers."""
+    first = np.floor(starts / 60).astype(np.int64)
+    spans = np.maximum(np.ceil(ends / 60).astype(np.int64) - first, 0)
+    rows = np.repeat(np.arange(len(starts)), spans)
+    # Position of each piece within its appointment: 0, 1, ... spans - 1
+    offsets = np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+    hours = first[rows] + offsets
+    minutes = np.minimum(ends[rows], (hours + 1) * 60.0) - np.maximum(starts[rows], hours * 60.0)
+    return rows, hours, minutes
+
+
+def hour_of_week(hours):
+    return ((hours // 24 + EPOCH_WEEKDAY) % 7) * 24 + hours % 24
+
+
+def opening_mask():
+    mask = np.zeros(HOURS_PER_WEEK, dtype=bool)
+    opens, closes = settings.ANALYTICS_OPENING_HOURS
+    for day in settings.ANALYTICS_OPENING_DAYS:
+        mask[day * 24 + opens:day * 24 + closes] = True
+    return mask
+
+
+def _rate(count, total):
+    return round(float(count) / total, 3) if total else None
+
+
+def _summary(booked, capacity, mask, appointments, over, no_shows, completed, overran):
+    """Figures of one doctor (or of the clinic) from its booked minutes per hour of the week."""
+    heatmap = np.divide(booked, capacity, out=np.zeros(HOURS_PER_WEEK), where=capacity > 0)
+    open_capacity = capacity[mask].sum()
+    return {
+        'appointments': int(appointments),
+        'booked_hours': round(float(booked.sum()) / 60, 1),
+        'free_hours': round(float(np.maximum(capacity - booked, 0)[mask].sum()) / 60, 1),
+        'utilization': _rate(booked[mask].sum(), open_capacity),
+        'no_show_rate': _rate(no_shows, over),
+        'overrun_rate': _rate(overran, completed),
+        'heatmap': np.round(heatmap, 3).reshape(7, 24).tolist(),
+    }
+
+
+def occupancy(start, end, doctor_id=None):
+    """Occupancy of [start, end) per doctor and for the whole clinic, see module docstring."""
+    period_start, period_end = local_minutes(start), local_minutes(end)
+    doctors, starts, ends, no_show, completed, overran = load(start, end, doctor_id)
+    starts, ends = np.maximum(starts, period_start), np.minimum(ends, period_end)
+    over = ends <= local_minutes(timezone.now())
+
+    # Minutes available in each hour of the week over the period
+    period_hours = np.arange(np.floor(period_start / 60), np.ceil(period_end / 60)).astype(np.int64)
+    capacity = np.bincount(hour_of_week(period_hours), minlength=HOURS_PER_WEEK) * 60.0
+    mask = opening_mask()
+
+    # Active doctors without a booking count too: their time is all free.
+    # Users are shared between clinics: only this clinic's
+    roster = User.objects.filter(clinic_id=connection.tenant.id)
+    roster = roster.filter(pk=doctor_id) if doctor_id is not None else \
+        roster.filter(Q(role='DOCTOR', is_active=True) | Q(id__in=np.unique(doctors).tolist()))
+    names = dict(roster.values_list('id', 'username'))
+    ids = np.array(sorted(names), dtype=np.int64)
+    known = np.isin(doctors, ids)
+    doctors, starts, ends, over = doctors[known], starts[known], ends[known], over[known]
+    no_show, completed, overran = no_show[known], completed[known], overran[known]
+    doctor_index = np.searchsorted(ids, doctors)
+    rows, hours, minutes = hour_pieces(starts, ends)
+    cells = doctor_index[rows] * HOURS_PER_WEEK + hour_of_week(hours)
+    booked = np.bincount(cells, weights=minutes, minlength=len(ids) * HOURS_PER_WEEK).reshape(len(ids), HOURS_PER_WEEK)
+
+    def per_doctor(flags):
+        return np.bincount(doctor_index, weights=flags, minlength=len(ids))
+
+    counts = [per_doctor(np.ones(len(doctors))), per_doctor(over), per_doctor(no_show & over),
+              per_doctor(completed), per_doctor(overran)]
+    return {
+        'start': start,
+        'end': end,
+        'opening': {'days': settings.ANALYTICS_OPENING_DAYS, 'hours': list(settings.ANALYTICS_OPENING_HOURS)},
+        'doctors': [
+            {'doctor': int(pk), 'doctor_name': names[pk],
+             **_summary(booked[i], capacity, mask, *(count[i] for count in counts))}
+            for i, pk in enumerate(ids.tolist())
+        ],
+        'clinic': _summary(booked.sum(axis=0), capacity * max(len(ids), 1), mask,
+                           *(count.sum() for count in counts)),
+    }
+
+
+def cached_occupancy(start, end, doctor_id=None):
+    key = f'occupancy:{start.isoformat()}:{end.isoformat()}:{doctor_id or "all"}'
+    return get_or_compute(ANALYTICS, key, lambda: occupancy(start, end, doctor_id),
+                          timeout=settings.ANALYTICS_CACHE_SECONDS)
@@ -0,0 +1,99 @@
+"""
+Archival of old completed appointments.
+
+archive_appointments() moves 'Completed' appointments older than the cutoff,
+with their treatment steps and prescriptions, into ArchivedAppointment (one
+JSON document each) and deletes them from the hot tables. Work is done in
+small batches, each in its own short transaction; rows are claimed with
+FOR UPDATE SKIP LOCKED so the clinic keeps working while it runs.
+
+Findings stay in medical_toothfinding: they are the patient's dental chart,
+not history. The archive keeps a copy of the ones discovered during the
+appointment, and the live rows simply lose their found_in link.
+
+archived_history() is the read path used by the patient timeline.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from core.cache import PATIENTS, invalidate
+from .exports import RELATED_TABLES
+from .models import Appointment, ArchivedAppointment, TreatmentStep, Prescription, ToothFinding
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_OLDER_THAN_DAYS = 3 * 365
+ARCHIVED_STATUS = 'Completed'
+
+
+def _grouped(model, columns, link, appointment_ids):
+    grouped = {}
+    for row in model.objects.filter(**{f'{link}__in': appointment_ids}).order_by('id').values(*columns):
+        grouped.setdefault(row[link], []).append(row)
+    return grouped
+
+
+def build_documents(appointment_ids):
+    """Nested documents for a batch: one query per table."""
+    _, appointment_columns, _ = RELATED_TABLES['appointments']
+    steps = _grouped(TreatmentStep, RELATED_TABLES['treatments'][1], 'appointment_id', appointment_ids)
+    prescriptions = _grouped(Prescription, RELATED_TABLES['prescriptions'][1], 'appointment_id', appointment_ids)
+    findings = _grouped(ToothFinding, RELATED_TABLES['findings'][1], 'found_in_id', appointment_ids)
+
+    documents = []
+    for appointment in Appointment.objects.filter(id__in=appointment_ids).order_by('id').values(*appointment_columns):
+        documents.append(ArchivedAppointment(
+            appointment_id=appointment['id'],
+            patient_id=appointment['patient_id'],
+            start_time=appointment['StartTime'],
+            document=dict(
+                appointment,
+                treatment_steps=steps.get(appointment['id'], []),
+                prescriptions=prescriptions.get(appointment['id'], []),
+                findings=findings.get(appointment['id'], []),
+            ),
+        ))
+    return documents
+
+
+def archive_batch(cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Archive up to batch_size appointments. Returns how many were moved."""
+    with transaction.atomic():
+        ids = list(
+            Appointment.objects
+            .filter(Status=ARCHIVED_STATUS, StartTime__lt=cutoff)
+            .order_by('StartTime')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        ArchivedAppointment.objects.bulk_create(build_documents(ids))
+        # Cascades to steps and prescriptions, unlinks findings and invoices (SET_NULL)
+        Appointment.objects.filter(id__in=ids).delete()
+        # SET_NULL is a queryset update (no post_save): patient reads embed the findings
+        invalidate(PATIENTS)
+    return len(ids)
+
+
+def archive_appointments(older_than_days=DEFAULT_OLDER_THAN_DAYS, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    Archive the current tenant's completed appointments older than `older_than_days`.
+    Also usable as a run_tenants task. Returns the number archived.
+    """
+    cutoff = timezone.now() - timedelta(days=int(older_than_days))
+    total = batches = 0
+    while max_batches is None or batches < int(max_batches):
+        moved = archive_batch(cutoff, int(batch_size))
+        if not moved:
+            break
+        total += moved
+        batches += 1
+    return total
+
+
+def archived_history(patient_id, doctor_id=None):
+    """Archived appointment documents of a patient (with one doctor's only), newest first."""
+    archived = ArchivedAppointment.objects.filter(patient_id=patient_id)
+    if doctor_id is not None:
+        archived = archived.filter(document__doctor_id=doctor_id)
+    return list(archived.order_by('-start_time').values_list('document', flat=True))
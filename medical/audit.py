@@ -0,0 +1,224 @@
+"""
+Asynchronous, batched PHI access audit log.
+
+Views call record_access(); the event is stamped and appended to an
+in-process buffer, and a background thread writes the buffer to
+PatientAccessLog with multi-row INSERTs (one per tenant per batch), off the
+request path.
+
+  - Backpressure: the buffer is bounded. When it is full the request thread
+    writes a batch itself instead of dropping events, so a slow database slows
+    audited requests down rather than losing audit rows.
+  - Shutdown: an atexit hook stops the writer and flushes what is left.
+  - Crash safety: events that cannot be written (database down at shutdown,
+    repeated failures) are spilled to NDJSON files in AUDIT_SPILL_DIR and
+    inserted by the next writer that starts.
+"""
+import atexit
+import glob
+import ipaddress
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 2.0  # seconds
+MAX_BUFFER = 10000
+MAX_ATTEMPTS = 3
+
+
+def _address(value):
+    try:
+        return ipaddress.ip_address(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def client_ip(request):
+    """
+    REMOTE_ADDR, unless the peer is one of TRUSTED_PROXIES: then the right-most
+    X-Forwarded-For hop that is not a trusted proxy. Hops left of it were written
+    by the client and can be forged.
+    """
+    proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.TRUSTED_PROXIES]
+
+    def trusted(address):
+        return address is not None and any(address in network for network in proxies)
+
+    address = _address(request.META.get('REMOTE_ADDR'))
+    if trusted(address):
+        hops = [hop for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        for hop in reversed(hops):
+            address = _address(hop)
+            if not trusted(address):
+                break
+    return str(address) if address else None
+
+
+class AuditWriter:
+    def __init__(self, max_buffer=MAX_BUFFER, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.buffer = queue.Queue(maxsize=max_buffer)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stopping = threading.Event()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    # --------------------------
+    # Producer side (request threads)
+    # --------------------------
+
+    def record(self, event):
+        """event: (schema_name, accessed_at, user_id, patient_id, action, path, ip_address)"""
+        self.ensure_started()
+        try:
+            self.buffer.put_nowait(event)
+        except queue.Full:
+            # Backpressure: help drain instead of dropping the event
+            self.flush()
+            self.buffer.put(event)
+
+    def ensure_started(self):
+        # Restart after a fork (gunicorn --preload): threads do not survive it
+        if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid() and self.thread and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='audit-writer', daemon=True)
+            self.thread.start()
+
+    # --------------------------
+    # Writer side
+    # --------------------------
+
+    def run(self):
+        self.replay_spill()
+        try:
+            while not self.stopping.wait(self.flush_interval):
+                while self.flush() == self.batch_size:
+                    pass
+        finally:
+            connections.close_all()
+
+    def drain(self):
+        events = []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def flush(self):
+        """Write one batch. Returns how many events it took from the buffer."""
+        with self.flush_lock:
+            events = self.drain()
+            if events:
+                self.write(events)
+            return len(events)
+
+    def write(self, events, attempts=MAX_ATTEMPTS):
+        for attempt in range(1, attempts + 1):
+            try:
+                insert_events(events)
+                return
+            except Exception:
+                logger.exception("Audit log write failed (attempt %d/%d, %d events).", attempt, attempts, len(events))
+                if not connection.in_atomic_block:
+                    connection.close()
+                if attempt < attempts and not self.stopping.is_set():
+                    time.sleep(attempt)
+        spill(events)
+
+    def close(self):
+        """Stop the writer and flush everything. Registered with atexit."""
+        self.stopping.set()
+        if self.thread and self.thread.is_alive() and self.pid == os.getpid():
+            self.thread.join(timeout=self.flush_interval + 5)
+        while self.flush():
+            pass
+
+    def replay_spill(self):
+        for path in sorted(glob.glob(os.path.join(spill_dir(), '*.ndjson'))):
+            claimed = f'{path}.{os.getpid()}.replaying'
+            try:
+                os.rename(path, claimed)  # another worker may have claimed it first
+            except OSError:
+                continue
+            with open(claimed, encoding='utf-8') as f:
+                events = [
+                    (schema_name, datetime.fromisoformat(accessed_at), *rest)
+                    for schema_name, accessed_at, *rest in (json.loads(line) for line in f if line.strip())
+                ]
+            try:
+                insert_events(events)
+            except Exception:
+                logger.exception("Could not replay audit spill file %s; leaving it for the next writer.", path)
+                os.rename(claimed, path)
+            else:
+                os.remove(claimed)
+
+
+def insert_events(events):
+    """One multi-row INSERT per tenant schema."""
+    from .models import PatientAccessLog
+    by_schema = {}
+    for schema_name, *fields in events:
+        by_schema.setdefault(schema_name, []).append(fields)
+    for schema_name, rows in by_schema.items():
+        with schema_context(schema_name):
+            PatientAccessLog.objects.bulk_create([
+                PatientAccessLog(accessed_at=accessed_at, user_id=user_id, patient_id=patient_id,
+                                 action=action, path=path, ip_address=ip_address)
+                for accessed_at, user_id, patient_id, action, path, ip_address in rows
+            ])
+
+
+def spill_dir():
+    return str(getattr(settings, 'AUDIT_SPILL_DIR', os.path.join(settings.BASE_DIR, 'audit_spill')))
+
+
+def spill(events):
+    directory = spill_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'audit-{os.getpid()}-{time.time_ns()}.ndjson')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        for schema_name, accessed_at, *rest in events:
+            f.write(json.dumps([schema_name, accessed_at.isoformat(), *rest]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{path}.tmp', path)
+    logger.error("Spilled %d audit events to %s.", len(events), path)
+
+
+writer = AuditWriter()
+atexit.register(writer.close)
+
+
+def record_access(request, patient_id, action='view'):
+    """Queue one PHI access event for the current tenant. Never touches the database."""
+    user = getattr(request, 'user', None)
+    writer.record((
+        connection.schema_name,
+        timezone.now(),
+        user.pk if user is not None and user.is_authenticated else None,
+        patient_id,
+        action,
+        request.path[:255],
+        client_ip(request),
+    ))
@@ -0,0 +1,140 @@
+"""
+Patient cohorts: structured filters and keyset pages for the patient list.
+
+    patients/?high_risk=1&age_min=65&insurance=AMO&visited_after=2026-04-19
+
+cohort_filters() turns the query params into ORM lookups:
+  - high_risk (1/0), gender (M/F), insurance (one or more, comma separated);
+  - age_min / age_max become date_of_birth bounds (Patient.age is computed
+    in Python and cannot be filtered on);
+  - visited_after / visited_before filter on Patient.last_visit_at.
+Each common combination is served by an index of Patient.Meta (partial index
+on high-risk patients, insurance + date of birth, last visit).
+
+last_visit_at is denormalized: the start of the patient's latest completed
+appointment, live or archived. refresh_last_visit() recomputes it whenever an
+appointment is saved or deleted (medical/signals.py), and only writes (and
+invalidates the cached patient reads) when the value actually changes.
+
+With ?after=<id> (empty for the first page) the list is paged on the id
+instead of page numbers: no COUNT over the cohort, and each page is an index
+range scan however deep the client scrolls. The answer is {next, results}.
+"""
+from datetime import datetime, time
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.utils.urls import replace_query_param
+from core.cache import PATIENTS, invalidate
+from .models import Patient
+
+COMPLETED = 'Completed'
+AFTER_PARAM = 'after'
+
+LAST_VISIT_SQL = """
+    UPDATE medical_patient p SET last_visit_at = v.at
+    FROM (
+        SELECT GREATEST(
+            (SELECT MAX("StartTime") FROM medical_appointment WHERE patient_id = %(id)s AND "Status" = %(status)s),
+            (SELECT MAX(start_time) FROM medical_archivedappointment WHERE patient_id = %(id)s)
+        ) AS at
+    ) v
+    WHERE p.id = %(id)s AND p.last_visit_at IS DISTINCT FROM v.at
+"""
+
+
+def refresh_last_visit(patient_id):
+    """Recompute a patient's last_visit_at (index lookups, no write when unchanged)."""
+    with connection.cursor() as cursor:
+        cursor.execute(LAST_VISIT_SQL, {'id': patient_id, 'status': COMPLETED})
+        changed = cursor.rowcount
+    if changed:
+        invalidate(PATIENTS)
+
+
+def _years_ago(today, years):
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:  # 29 February
+        return today.replace(year=today.year - years, day=28)
+
+
+def cohort_filters(params, today=None):
+    """Query params -> (Patient filter kwargs, errors). Also validates ?after=, see keyset_slice()."""
+    today = today or timezone.localdate()
+    filters, errors = {}, {}
+
+    high_risk = params.get('high_risk')
+    if high_risk:
+        if high_risk not in ('1', '0', 'true', 'false'):
+            errors['high_risk'] = ["Valeur attendue : 1 ou 0."]
+        filters['is_high_risk'] = high_risk in ('1', 'true')
+
+    gender = params.get('gender')
+    if gender:
+        if gender not in dict(Patient.GENDER_CHOICES):
+            errors['gender'] = ["Genre invalide (M ou F)."]
+        filters['gender'] = gender
+
+    insurance = params.get('insurance')
+    if insurance:
+        types = insurance.split(',')
+        if not set(types) <= set(dict(Patient.INSURANCE_CHOICES)):
+            errors['insurance'] = ["Type d'assurance inconnu."]
+        filters['insurance_type__in'] = types
+
+    for param, lookup in (('age_min', 'date_of_birth__lte'), ('age_max', 'date_of_birth__gt')):
+        value = params.get(param)
+        if value:
+            try:
+                age = int(value)
+                if not 0 <= age <= 150:
+                    raise ValueError
+            except ValueError:
+                errors[param] = ["Âge invalide."]
+                continue
+            # age >= N: born N years ago or before; age <= N: born less than N + 1 years ago
+            filters[lookup] = _years_ago(today, age if param == 'age_min' else age + 1)
+
+    for param, lookup in (('visited_after', 'last_visit_at__gte'), ('visited_before', 'last_visit_at__lt')):
+        value = params.get(param)
+        if value:
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                errors[param] = ["Date invalide (format AAAA-MM-JJ)."]
+                continue
+            # Midnight bounds rather than __date, which would not use the index
+            filters[lookup] = timezone.make_aware(datetime.combine(day, time.min))
+
+    after = params.get(AFTER_PARAM)
+    if after:
+        try:
+            int(after)
+        except ValueError:
+            errors[AFTER_PARAM] = ["Identifiant de patient invalide."]
+
+    return (None, errors) if errors else (filters, None)
+
+
+def keyset_slice(queryset, params, page_size):
+    """
+    The rows of one keyset page (queryset ordered by -id), plus one to know
+    whether there is a next page. ?after= must have been checked by cohort_filters().
+    """
+    after = params.get(AFTER_PARAM)
+    if after:
+        queryset = queryset.filter(id__lt=int(after))
+    return queryset.order_by('-id')[:page_size + 1]
+
+
+def keyset_response(url, rows, page_size, serialize):
+    """{next, results} for the rows fetched with keyset_slice()."""
+    rows = list(rows)
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = replace_query_param(url, AFTER_PARAM, rows[-1].id)
+    return {'next': next_url, 'results': serialize(rows)}
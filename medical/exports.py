@@ -0,0 +1,156 @@
+"""
+Streaming export of a clinic's patients and their medical history.
+
+Everything is read through server-side cursors (.iterator(chunk_size=...)) and
+written out chunk by chunk, so exporting 100k patients keeps the same memory
+footprint as exporting 100:
+  - NDJSON: one nested document per patient (appointments with their treatment
+    steps and prescriptions, plus findings). Related rows are fetched with one
+    query per table per chunk of patients.
+  - CSV: one flat table per entity (patients, appointments, treatments, ...).
+Encrypted patient fields are selected as raw ciphertext and decrypted per chunk.
+"""
+import csv
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from .models import Patient, Appointment, ToothFinding, TreatmentStep, Prescription, decrypt_tokens
+
+DEFAULT_CHUNK_SIZE = 500
+FORMATS = ('ndjson', 'csv')
+
+PATIENT_FIELDS = [
+    'id', 'first_name', 'last_name', 'gender', 'date_of_birth', 'medical_alerts',
+    'allergies', 'is_high_risk', 'insurance_type', 'created_at',
+]
+ENCRYPTED_PATIENT_FIELDS = ['cin', 'phone', 'insurance_id']
+
+# entity -> (model, columns, patient link used to group rows under their patient)
+RELATED_TABLES = {
+    'appointments': (Appointment, [
+        'id', 'patient_id', 'doctor_id', 'Subject', 'StartTime', 'EndTime',
+        'Description', 'Status', 'CategoryColor', 'series_id', 'occurrence_start',
+    ], 'patient_id'),
+    'treatments': (TreatmentStep, [
+        'id', 'appointment_id', 'tooth_number', 'step_type', 'description',
+        'price', 'status', 'created_at', 'updated_at',
+    ], 'appointment__patient_id'),
+    'findings': (ToothFinding, [
+        'id', 'patient_id', 'tooth_number', 'condition', 'surface', 'notes', 'found_in_id', 'created_at',
+    ], 'patient_id'),
+    'prescriptions': (Prescription, [
+        'id', 'patient_id', 'appointment_id', 'medications', 'notes', 'created_at',
+    ], 'patient_id'),
+}
+ENTITIES = ['patients'] + list(RELATED_TABLES)
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_patient_chunks(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of patient dicts, decrypted one chunk at a time."""
+    tokens = {f'{field}_token': Cast(field, TextField()) for field in ENCRYPTED_PATIENT_FIELDS}
+    rows = (
+        Patient.objects.order_by('id')
+        .annotate(**tokens)
+        .values_list(*PATIENT_FIELDS, *tokens)
+        .iterator(chunk_size=chunk_size)
+    )
+    plain_count = len(PATIENT_FIELDS)
+    for chunk in iter_chunks(rows, chunk_size):
+        decrypted = [
+            decrypt_tokens([row[plain_count + i] for row in chunk])
+            for i in range(len(ENCRYPTED_PATIENT_FIELDS))
+        ]
+        patients = []
+        for index, row in enumerate(chunk):
+            patient = dict(zip(PATIENT_FIELDS, row[:plain_count]))
+            for i, field in enumerate(ENCRYPTED_PATIENT_FIELDS):
+                patient[field] = decrypted[i][index]
+            patients.append(patient)
+        yield patients
+
+
+def _rows_for_patients(entity, patient_ids):
+    """One query for a whole chunk of patients, grouped by patient id."""
+    model, columns, patient_link = RELATED_TABLES[entity]
+    extra = [] if patient_link in columns else [patient_link]
+    rows = model.objects.filter(**{f'{patient_link}__in': patient_ids}).order_by('id').values(*columns, *extra)
+    grouped = {}
+    for row in rows:
+        owner = row.pop(patient_link) if extra else row[patient_link]
+        grouped.setdefault(owner, []).append(row)
+    return grouped
+
+
+def iter_patient_documents(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield one nested dict per patient with the full medical history."""
+    for patients in iter_patient_chunks(chunk_size):
+        ids = [patient['id'] for patient in patients]
+        appointments = _rows_for_patients('appointments', ids)
+        treatments = _rows_for_patients('treatments', ids)
+        findings = _rows_for_patients('findings', ids)
+        prescriptions = _rows_for_patients('prescriptions', ids)
+
+        for patient in patients:
+            steps_by_appointment = {}
+            for step in treatments.get(patient['id'], []):
+                steps_by_appointment.setdefault(step['appointment_id'], []).append(step)
+            prescriptions_by_appointment = {}
+            for prescription in prescriptions.get(patient['id'], []):
+                prescriptions_by_appointment.setdefault(prescription['appointment_id'], []).append(prescription)
+
+            patient['appointments'] = [
+                dict(appointment,
+                     treatment_steps=steps_by_appointment.get(appointment['id'], []),
+                     prescriptions=prescriptions_by_appointment.get(appointment['id'], []))
+                for appointment in appointments.get(patient['id'], [])
+            ]
+            patient['findings'] = findings.get(patient['id'], [])
+            yield patient
+
+
+def ndjson_stream(chunk_size=DEFAULT_CHUNK_SIZE):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for document in iter_patient_documents(chunk_size):
+        yield encoder.encode(document) + '\n'
+
+
+class Echo:
+    """File-like object whose write() just returns the line, for streaming csv.writer output."""
+    def write(self, value):
+        return value
+
+
+def csv_stream(entity='patients', chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    if entity == 'patients':
+        columns = PATIENT_FIELDS + ENCRYPTED_PATIENT_FIELDS
+        yield writer.writerow(columns)
+        for patients in iter_patient_chunks(chunk_size):
+            yield ''.join(writer.writerow([patient[column] for column in columns]) for patient in patients)
+        return
+
+    model, columns, _ = RELATED_TABLES[entity]
+    yield writer.writerow(columns)
+    rows = model.objects.order_by('id').values_list(*columns).iterator(chunk_size=chunk_size)
+    for chunk in iter_chunks(rows, chunk_size):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def export_stream(fmt='ndjson', entity='patients', chunk_size=DEFAULT_CHUNK_SIZE):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Expected one of {FORMATS}.")
+    if entity not in ENTITIES:
+        raise ValueError(f"Unknown entity '{entity}'. Expected one of {ENTITIES}.")
+    if fmt == 'ndjson':
+        return ndjson_stream(chunk_size)
+    return csv_stream(entity, chunk_size)
@@ -0,0 +1,183 @@
+"""
+High-throughput bulk patient import from CSV.
+
+The file is read as a stream and handled chunk by chunk:
+  1. validate each row with PatientImportSerializer (no per-row queries)
+  2. hash + encrypt the PII columns in a process pool (Fernet is the CPU hot spot)
+  3. drop duplicates, inside the file and against the clinic, using cin_hash /
+     phone_hash with one query per chunk
+  4. insert the survivors with a single bulk_create per chunk
+Every invalid or duplicate row ends up in the ImportReport errors with its
+line number and reason; `rejected` counts the invalid rows, `duplicates` the others.
+Uploads over SYNC_MAX_BYTES are never imported inside the web request: the
+endpoint hands them to the job queue (import_patients_file).
+"""
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.db import transaction
+from clinics.jobs import report_progress
+from clinics.parallel import setup_worker
+from core.cache import PATIENTS, invalidate
+from .exports import iter_chunks
+from .models import Patient, encrypt_value, hash_value
+from .serializers import PatientImportSerializer
+
+DEFAULT_CHUNK_SIZE = 1000
+SYNC_MAX_BYTES = 1024 * 1024  # about 10 000 rows
+IMPORT_COLUMNS = PatientImportSerializer.Meta.fields
+HASHED_FIELDS = ('cin', 'phone', 'insurance_id')
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.would_create = 0  # dry run: rows that would have been inserted
+        self.duplicates = 0
+        self.rejected = 0  # invalid rows (duplicates are counted apart)
+        self.errors = []  # (line, field, message)
+
+    def add_error(self, line, field, message):
+        self.errors.append((line, field, str(message)))
+
+    def as_dict(self, max_errors=None):
+        errors = self.errors if max_errors is None else self.errors[:max_errors]
+        return {
+            'created': self.created,
+            'would_create': self.would_create,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'errors': [{'line': line, 'field': field, 'message': message} for line, field, message in errors],
+        }
+
+    def write_csv(self, out):
+        writer = csv.writer(out)
+        writer.writerow(['line', 'field', 'message'])
+        writer.writerows(self.errors)
+
+
+def prepare_rows(rows):
+    """
+    Pool worker: add the *_hash twins and replace PII by ciphertext.
+    Same rules as Patient.save(), which bulk_create does not call.
+    """
+    for _, data in rows:
+        for field in HASHED_FIELDS:
+            value = data.get(field)
+            data[f'{field}_hash'] = hash_value(value)
+            if value:
+                data[field] = encrypt_value(value)
+    return rows
+
+
+def _dedupe_key(data):
+    # CIN identifies a person; without one, fall back to phone + name (families share phones)
+    if data.get('cin_hash'):
+        return ('cin', data['cin_hash'])
+    return ('phone', data['phone_hash'], data['first_name'].lower(), data['last_name'].lower())
+
+
+def _existing_keys(rows):
+    cin_hashes = [data['cin_hash'] for _, data in rows if data.get('cin_hash')]
+    phone_hashes = [data['phone_hash'] for _, data in rows if not data.get('cin_hash')]
+    keys = set()
+    if cin_hashes:
+        keys.update(('cin', h) for h in Patient.objects.filter(cin_hash__in=cin_hashes).values_list('cin_hash', flat=True))
+    if phone_hashes:
+        keys.update(
+            ('phone', h, first.lower(), last.lower())
+            for h, first, last in Patient.objects.filter(phone_hash__in=phone_hashes)
+            .values_list('phone_hash', 'first_name', 'last_name')
+        )
+    return keys
+
+
+def _validate_chunk(chunk, report):
+    valid = []
+    for line, raw in chunk:
+        data = {key: value.strip() for key, value in raw.items() if key in IMPORT_COLUMNS and value and value.strip()}
+        serializer = PatientImportSerializer(data=data)
+        if serializer.is_valid():
+            valid.append((line, dict(serializer.validated_data)))
+        else:
+            report.rejected += 1
+            for field, messages in serializer.errors.items():
+                for message in messages:
+                    report.add_error(line, field, message)
+    return valid
+
+
+def _split(rows, parts):
+    size = max(1, -(-len(rows) // parts))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def import_patients(stream, chunk_size=DEFAULT_CHUNK_SIZE, processes=None, dry_run=False, progress=None):
+    """
+    Import patients from a CSV text stream into the current tenant schema.
+    processes=None uses one worker per CPU, processes=1 stays in-process (web requests).
+    Each chunk commits on its own, so a failure never loses the chunks already imported.
+    progress, if given, is called with the number of data lines handled after each chunk.
+    """
+    report = ImportReport()
+    reader = csv.DictReader(stream)
+    missing = {'first_name', 'last_name', 'phone'} - set(reader.fieldnames or [])
+    if missing:
+        report.add_error(1, 'header', f"Missing required columns: {', '.join(sorted(missing))}")
+        return report
+
+    seen = set()
+    workers = processes or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker) if workers > 1 else None
+    try:
+        # Line 1 is the header
+        for chunk in iter_chunks(enumerate(reader, start=2), chunk_size):
+            valid = _validate_chunk(chunk, report)
+            if not valid:
+                continue
+
+            if pool:
+                prepared = [row for part in pool.map(prepare_rows, _split(valid, workers)) for row in part]
+            else:
+                prepared = prepare_rows(valid)
+
+            existing = _existing_keys(prepared)
+            patients = []
+            for line, data in prepared:
+                key = _dedupe_key(data)
+                if key in existing or key in seen:
+                    report.duplicates += 1
+                    report.add_error(line, key[0], "Doublon: patient déjà présent.")
+                    continue
+                seen.add(key)
+                patients.append(Patient(**data))
+
+            if dry_run:
+                report.would_create += len(patients)
+            elif patients:
+                with transaction.atomic():
+                    Patient.objects.bulk_create(patients, batch_size=chunk_size)
+                report.created += len(patients)
+            if progress:
+                progress(chunk[-1][0] - 1)
+    finally:
+        if pool:
+            pool.shutdown()
+        if report.created and not dry_run:
+            # bulk_create sends no post_save: drop the cached patient pages here
+            invalidate(PATIENTS)
+    return report
+
+
+def import_patients_file(path, dry_run=False, processes=None):
+    """
+    Job queue entry point (clinics.jobs): import an uploaded CSV saved at `path`,
+    reporting progress. Returns the report (first 1000 errors). The queue deletes
+    the file once the job is finished.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        total = max(0, sum(1 for _ in f) - 1)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_patients(f, processes=processes, dry_run=dry_run,
+                                 progress=lambda done: report_progress(done, total, f"{done}/{total} lignes"))
+    return report.as_dict(max_errors=1000)
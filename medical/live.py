@@ -0,0 +1,256 @@
+"""
+Live calendar: appointment changes pushed to open calendars (server-sent events).
+
+Every write to medical_appointment fires a trigger (migration 0012) that runs
+    NOTIFY appointment_changes, '{"schema", "op", "id", "doctor", "old_doctor"}'
+when the transaction commits. Each ASGI worker process holds ONE listening
+connection (AppointmentHub) and fans the notifications out to its streams:
+  - the changed appointment is loaded from the primary and serialized once
+    per process, not once per subscriber, and only when someone in that
+    clinic is listening;
+  - ADMIN / ASSISTANT streams get every appointment of the clinic (or one
+    doctor's with ?doctor=), a doctor's stream only their own;
+  - an appointment moved to another doctor is a deletion for the former one.
+
+Events: `resync` means "reload your window with appointments/": it comes
+once the stream is live, and again whenever deltas may have been missed
+(listener reconnect, client too slow to keep up). After it, `created` and
+`updated` carry the appointment as serialized by appointments/, `deleted`
+carries {"id": ...}. A created appointment with `series` and
+`occurrence_start` replaces that expanded occurrence of a recurring series;
+changes to a series itself come as `resync`. Streams close after LIVE_STREAM_MAX_AGE so the client
+reconnects with a fresh access token.
+
+LISTEN needs a real session: behind PgBouncer in transaction mode, point
+LIVE_DATABASE_URL at PostgreSQL itself (the stream refuses to start without).
+The listener task runs in a context of its own, not in the request that
+happened to start it, and does its database work on pool threads.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import weakref
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections
+from django_tenants.utils import schema_context
+from core.postgresql_backend.base import POOL_MODE_TRANSACTION
+from core.replicas import primary
+from .models import Appointment
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'appointment_changes'
+QUEUE_SIZE = 100  # events buffered per stream before it is told to resync
+RETRY_MS = 3000  # client reconnect delay (EventSource `retry:`)
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)  # seconds, listener connection
+
+EVENTS = {'INSERT': 'created', 'UPDATE': 'updated', 'DELETE': 'deleted'}
+RESYNC = 'resync'
+
+# The function comes with migration 0012; partition_appointments() recreates the trigger
+CREATE_TRIGGER_SQL = """
+    CREATE TRIGGER medical_appointment_notify
+        AFTER INSERT OR UPDATE OR DELETE ON medical_appointment
+        FOR EACH ROW EXECUTE FUNCTION medical_appointment_notify()
+"""
+
+
+def listen_database():
+    """Connection settings of the listener. Raises ImproperlyConfigured behind a transaction pooler."""
+    if settings.LIVE_DATABASE:
+        return settings.LIVE_DATABASE
+    if settings.DATABASE_POOL_MODE == POOL_MODE_TRANSACTION:
+        # Notifications would silently never arrive
+        raise ImproperlyConfigured("LISTEN does not work through a transaction pooler: set LIVE_DATABASE_URL.")
+    return connections['default'].settings_dict
+
+
+def connect_listener():
+    database = listen_database()
+    conn = psycopg2.connect(
+        dbname=database['NAME'], user=database['USER'], password=database['PASSWORD'],
+        host=database['HOST'], port=database['PORT'],
+        # A dead peer must surface as an error, not as a silent calendar
+        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+        **database['OPTIONS'],
+    )
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'LISTEN {CHANNEL}')
+    return conn
+
+
+def serialize_appointment(schema_name, pk):
+    from .serializers import AppointmentSerializer
+    close_old_connections()
+    # NOTIFY is sent at commit on the primary: a replica may not have the row yet
+    with primary(), schema_context(schema_name):
+        appointment = (Appointment.objects.select_related('patient', 'doctor')
+                       .prefetch_related('treatment_steps').filter(pk=pk).first())
+        return AppointmentSerializer(appointment).data if appointment else None
+
+
+class AppointmentHub:
+    """One LISTEN connection per process, fanned out to the streams of its event loop."""
+
+    def __init__(self):
+        self.streams = {}  # (schema_name, doctor_id or None) -> set of queues
+        self.connected = False
+        self.task = None
+
+    # --------------------------
+    # Streams
+    # --------------------------
+
+    def subscribe(self, schema_name, doctor_id=None):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        if self.connected:
+            queue.put_nowait((RESYNC, {}))
+        # Otherwise the listener sends resync to everyone once it is listening
+        self.streams.setdefault((schema_name, doctor_id), set()).add(queue)
+        if self.task is None or self.task.done():
+            # A fresh context: the task outlives the request that starts it and
+            # must not inherit its thread-sensitive executor or context vars
+            self.task = asyncio.get_running_loop().create_task(self.listen(), context=contextvars.Context())
+        return queue
+
+    def unsubscribe(self, schema_name, doctor_id, queue):
+        queues = self.streams.get((schema_name, doctor_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.streams[(schema_name, doctor_id)]
+
+    def listening(self, schema_name):
+        return any(key[0] == schema_name for key in self.streams)
+
+    @staticmethod
+    def put(queue, event, data):
+        try:
+            queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # Slow client: drop its backlog, it reloads its window instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait((RESYNC, {}))
+
+    def push(self, key, event, data):
+        for queue in self.streams.get(key, ()):
+            self.put(queue, event, data)
+
+    def resync(self, schema_name=None):
+        for key, queues in self.streams.items():
+            if schema_name is None or key[0] == schema_name:
+                for queue in queues:
+                    self.put(queue, RESYNC, {})
+
+    # --------------------------
+    # Listener
+    # --------------------------
+
+    @staticmethod
+    def on_readable(conn, inbox):
+        try:
+            conn.poll()
+        except psycopg2.Error as e:
+            inbox.put_nowait(e)
+            return
+        while conn.notifies:
+            inbox.put_nowait(conn.notifies.pop(0).payload)
+
+    async def listen(self):
+        loop = asyncio.get_running_loop()
+        failures = 0
+        while True:
+            try:
+                conn = await sync_to_async(connect_listener, thread_sensitive=False)()
+            except psycopg2.Error as e:
+                delay = RECONNECT_DELAYS[min(failures, len(RECONNECT_DELAYS) - 1)]
+                logger.warning("Live calendar: cannot LISTEN (%s), retrying in %ss.", e, delay)
+                failures += 1
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
+            inbox = asyncio.Queue()
+            loop.add_reader(conn.fileno(), self.on_readable, conn, inbox)
+            self.connected = True
+            self.resync()
+            try:
+                while True:
+                    payload = await inbox.get()
+                    if isinstance(payload, Exception):
+                        raise payload
+                    await self.dispatch(json.loads(payload))
+            except psycopg2.Error as e:
+                logger.warning("Live calendar: listener connection lost (%s).", e)
+            finally:
+                self.connected = False
+                loop.remove_reader(conn.fileno())
+                conn.close()
+
+    async def dispatch(self, change):
+        schema_name = change['schema']
+        if not self.listening(schema_name):
+            return
+        if change['op'] == 'SERIES':
+            # Its occurrences are expanded on read (medical/recurrence.py): reload
+            self.resync(schema_name)
+            return
+        event = EVENTS[change['op']]
+        data = {'id': change['id']}
+        if event != 'deleted':
+            try:
+                data = await sync_to_async(serialize_appointment, thread_sensitive=False)(schema_name, change['id'])
+            except Exception:
+                logger.exception("Live calendar: appointment %s (%s) could not be loaded.", change['id'], schema_name)
+                self.resync(schema_name)
+                return
+            if data is None:
+                return  # deleted since: its own notification follows
+
+        doctor, old_doctor = change['doctor'], change.get('old_doctor')
+        self.push((schema_name, None), event, data)
+        self.push((schema_name, doctor), event, data)
+        if old_doctor is not None and old_doctor != doctor:
+            self.push((schema_name, old_doctor), 'deleted', {'id': change['id']})
+
+
+_hubs = weakref.WeakKeyDictionary()  # event loop -> hub
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = AppointmentHub()
+    return hub
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n"
+
+
+async def event_stream(schema_name, doctor_id=None):
+    """Server-sent events for one clinic (and one doctor), until LIVE_STREAM_MAX_AGE."""
+    hub = get_hub()
+    queue = hub.subscribe(schema_name, doctor_id)
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + settings.LIVE_STREAM_MAX_AGE
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while (remaining := closes_at - loop.time()) > 0:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), min(settings.LIVE_HEARTBEAT, remaining))
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": ping\n\n"
+                continue
+            yield format_event(event, data)
+    finally:
+        hub.unsubscribe(schema_name, doctor_id, queue)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from medical.archive import archive_appointments, DEFAULT_BATCH_SIZE, DEFAULT_OLDER_THAN_DAYS
+
+
+class Command(BaseCommand):
+    help = ('Moves completed appointments older than --older-than-days (with their treatment steps '
+            'and prescriptions) to the archive table, in short batches. '
+            'Usage: manage.py tenant_command archive_appointments --schema=clinic_atlas, '
+            'or for every clinic: manage.py run_tenants --task medical.archive.archive_appointments')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=DEFAULT_OLDER_THAN_DAYS)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches (spread the work over several nights).')
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Appointments live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        archived = archive_appointments(options['older_than_days'], options['batch_size'], options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f"✅ {connection.schema_name}: {archived} appointments archived."))
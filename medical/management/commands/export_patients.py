@@ -0,0 +1,31 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from medical.exports import export_stream, FORMATS, ENTITIES, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Streams the patients and medical history of a clinic to a file (constant memory). '
+            'Usage: manage.py tenant_command export_patients --schema=clinic_atlas --output atlas.ndjson')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Destination file. Defaults to stdout.')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson', dest='fmt')
+        parser.add_argument('--entity', choices=ENTITIES, default='patients',
+                            help='Table to export in CSV format (NDJSON always nests the full history).')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Patients live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for piece in export_stream(options['fmt'], options['entity'], options['chunk_size']):
+                out.write(piece)
+        finally:
+            if options['output']:
+                out.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"✅ Export written to {options['output']}"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from medical.imports import import_patients, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = ('Bulk-imports patients from a CSV file (streamed, chunked, deduplicated on cin/phone hashes). '
+            'Usage: manage.py tenant_command import_patients --schema=clinic_atlas patients.csv --report errors.csv')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row (first_name,last_name,phone,cin,...).')
+        parser.add_argument('--report', help='Write the row-level error report to this CSV file.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--processes', type=int, help='Encryption workers. Defaults to one per CPU.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and deduplicate without inserting.')
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Patients live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+            report = import_patients(stream, chunk_size=options['chunk_size'],
+                                     processes=options['processes'], dry_run=options['dry_run'])
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as out:
+                report.write_csv(out)
+
+        summary = report.as_dict(max_errors=0)
+        imported = (f"{summary['would_create']} would be imported" if options['dry_run']
+                    else f"{summary['created']} imported")
+        self.stdout.write(
+            f"[{connection.schema_name}] {imported}, "
+            f"{summary['duplicates']} duplicates, {summary['rejected']} rows rejected"
+            + (" (dry run)" if options['dry_run'] else "")
+        )
+        style = self.style.SUCCESS if not report.errors else self.style.WARNING
+        self.stdout.write(style("✅ Import complete" if not report.errors else "⚠️ Import complete with rejected rows"))
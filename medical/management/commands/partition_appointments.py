@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from medical.partitioning import partition_appointments, DEFAULT_MONTHS_AHEAD
+
+
+class Command(BaseCommand):
+    help = ('Converts a clinic\'s appointments table to monthly partitions on StartTime (existing rows '
+            'are moved; takes an exclusive lock). Usage: manage.py tenant_command partition_appointments '
+            '--schema=clinic_atlas. Keep future months created with: manage.py run_tenants '
+            '--task medical.partitioning.ensure_future_partitions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=DEFAULT_MONTHS_AHEAD,
+                            help='Future monthly partitions to create in advance.')
+
+    def handle(self, *args, **options):
+        if connection.schema_name == 'public':
+            raise CommandError("Appointments live in tenant schemas. Run through tenant_command --schema=<clinic>.")
+
+        try:
+            result = partition_appointments(options['months_ahead'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {connection.schema_name}: {result['rows']} appointments moved, "
+            f"{len(result['partitions'])} partitions created."
+        ))
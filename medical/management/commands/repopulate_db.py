@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.db import connection
+from django.conf import settings
 from django_tenants.utils import tenant_context
 from clinics.models import Clinic, Domain
 from medical.models import Patient, Appointment, ToothFinding, TreatmentStep, Prescription
@@ -35,7 +36,8 @@ class Command(BaseCommand):
             rogue_schemas = [r[0] for r in cursor.fetchall()]
             
             for schema in rogue_schemas:
-                if schema != 'public':
+                # The provisioning template looks like a zombie but must survive
+                if schema not in ('public', settings.TENANT_TEMPLATE_SCHEMA):
                     self.stdout.write(f"Dropping zombie schema: {schema}")
                     cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
             
@@ -46,7 +48,9 @@ class Command(BaseCommand):
                 DROP TABLE IF EXISTS medical_toothfinding CASCADE;
                 DROP TABLE IF EXISTS medical_prescription CASCADE;
                 DROP TABLE IF EXISTS medical_appointment CASCADE;
+                DROP TABLE IF EXISTS medical_archivedappointment CASCADE;
                 DROP TABLE IF EXISTS medical_patient CASCADE;
+                DROP TABLE IF EXISTS billing_invoiceline CASCADE;
                 DROP TABLE IF EXISTS billing_invoice CASCADE;
                 DROP TABLE IF EXISTS billing_payment CASCADE;
             """)
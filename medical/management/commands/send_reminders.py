@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from clinics.parallel import run_tenants, tenant_schemas
+from medical.reminders import DEFAULT_BATCH_SIZE, get_backend
+
+TASK = 'medical.reminders.send_reminders'
+
+
+class Command(BaseCommand):
+    help = ("Sends SMS/WhatsApp reminders for tomorrow's scheduled appointments in every clinic, "
+            "with a pool of worker processes. Safe to re-run: reminded appointments are skipped. "
+            'Usage: manage.py send_reminders --processes 8 --rate 50')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', help='YYYY-MM-DD of the appointments to remind. Defaults to tomorrow.')
+        parser.add_argument('--schemas', help='Comma-separated subset of schemas. Defaults to all clinics.')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--rate', type=float, help='Messages per second for the whole run (REMINDER_RATE per process by default).')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the due reminders.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError("--processes must be at least 1.")
+        if not options['dry_run']:
+            get_backend()  # fail here rather than once per clinic
+        schema_names = options['schemas'].split(',') if options['schemas'] else tenant_schemas()
+        rate = options['rate'] / options['processes'] if options['rate'] else None
+
+        self.stdout.write(f"--- Reminders for {len(schema_names)} clinics, {options['processes']} processes ---")
+        started = time.monotonic()
+        state = run_tenants(TASK, schema_names, processes=options['processes'], progress=self._progress,
+                            day=options['day'], rate=rate, batch_size=options['batch_size'],
+                            dry_run=options['dry_run'])
+
+        elapsed = time.monotonic() - started
+        if state.failed:
+            for schema_name, error in sorted(state.failed.items()):
+                self.stdout.write(self.style.ERROR(f"  {schema_name}: {error}"))
+            raise CommandError(f"{len(state.failed)} clinic(s) failed in {elapsed:.1f}s. Re-run to retry them.")
+        self.stdout.write(self.style.SUCCESS(f"✅ {len(state.done)} clinics done in {elapsed:.1f}s"))
+
+    def _progress(self, position, total, schema_name, error, seconds):
+        prefix = f"[{position}/{total}] {schema_name}"
+        if error:
+            self.stdout.write(self.style.ERROR(f"{prefix} ❌ {error} ({seconds:.1f}s)"))
+        else:
+            self.stdout.write(f"{prefix} ✅ ({seconds:.1f}s)")
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-19 01:49
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0008_remove_patient_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('appointment_id', models.BigIntegerField(unique=True)),
+                ('start_time', models.DateTimeField()),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='medical.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', '-start_time'], name='medical_arch_patient_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.9 on 2026-10-19 01:51
+
+from django.db import migrations, models
+
+# Monthly range partitions on accessed_at (created ahead by
+# medical.partitioning.ensure_future_partitions), append-only by trigger.
+CREATE_ACCESS_LOG_SQL = """
+    CREATE SEQUENCE medical_patientaccesslog_id_seq;
+    CREATE TABLE medical_patientaccesslog (
+        id bigint NOT NULL DEFAULT nextval('medical_patientaccesslog_id_seq'),
+        accessed_at timestamp with time zone NOT NULL,
+        user_id bigint NULL,
+        patient_id bigint NULL,
+        action varchar(10) NOT NULL,
+        path varchar(255) NOT NULL,
+        ip_address inet NULL,
+        PRIMARY KEY (id, accessed_at)
+    ) PARTITION BY RANGE (accessed_at);
+    ALTER SEQUENCE medical_patientaccesslog_id_seq OWNED BY medical_patientaccesslog.id;
+    CREATE TABLE medical_patientaccesslog_default PARTITION OF medical_patientaccesslog DEFAULT;
+    CREATE INDEX medical_accesslog_patient_idx ON medical_patientaccesslog (patient_id, accessed_at);
+
+    CREATE FUNCTION medical_patientaccesslog_append_only() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'medical_patientaccesslog is append-only';
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER medical_patientaccesslog_append_only
+        BEFORE UPDATE OR DELETE ON medical_patientaccesslog
+        FOR EACH ROW EXECUTE FUNCTION medical_patientaccesslog_append_only();
+"""
+
+DROP_ACCESS_LOG_SQL = """
+    DROP TABLE medical_patientaccesslog;
+    DROP FUNCTION medical_patientaccesslog_append_only();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0009_archivedappointment'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(CREATE_ACCESS_LOG_SQL, DROP_ACCESS_LOG_SQL)],
+            state_operations=[
+                migrations.CreateModel(
+                    name='PatientAccessLog',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('accessed_at', models.DateTimeField()),
+                        ('user_id', models.BigIntegerField(null=True)),
+                        ('patient_id', models.BigIntegerField(null=True)),
+                        ('action', models.CharField(choices=[('view', 'View'), ('update', 'Update'), ('export', 'Export')], max_length=10)),
+                        ('path', models.CharField(blank=True, max_length=255)),
+                        ('ip_address', models.GenericIPAddressField(null=True)),
+                    ],
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-19 03:12
+
+from django.db import migrations
+
+# Live calendar (medical/live.py): every appointment change is announced on
+# the appointment_changes channel when its transaction commits.
+CREATE_NOTIFY_SQL = """
+    CREATE FUNCTION medical_appointment_notify() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+        old_doctor bigint;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+        IF TG_OP = 'UPDATE' THEN
+            -- Reminder bookkeeping is not a calendar change
+            IF to_jsonb(NEW) - 'reminder_sent_at' = to_jsonb(OLD) - 'reminder_sent_at' THEN
+                RETURN NULL;
+            END IF;
+            old_doctor := OLD.doctor_id;
+        END IF;
+        PERFORM pg_notify('appointment_changes', json_build_object(
+            'schema', TG_TABLE_SCHEMA,
+            'op', TG_OP,
+            'id', changed.id,
+            'doctor', changed.doctor_id,
+            'old_doctor', old_doctor
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER medical_appointment_notify
+        AFTER INSERT OR UPDATE OR DELETE ON medical_appointment
+        FOR EACH ROW EXECUTE FUNCTION medical_appointment_notify();
+"""
+
+DROP_NOTIFY_SQL = """
+    DROP TRIGGER medical_appointment_notify ON medical_appointment;
+    DROP FUNCTION medical_appointment_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0011_appointment_reminders'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NOTIFY_SQL, DROP_NOTIFY_SQL),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.9 on 2026-10-19 02:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Live calendar (medical/live.py): a changed series moves many occurrences at
+# once, its streams are told to resync.
+CREATE_SERIES_NOTIFY_SQL = """
+    CREATE FUNCTION medical_appointmentseries_notify() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+        PERFORM pg_notify('appointment_changes', json_build_object(
+            'schema', TG_TABLE_SCHEMA,
+            'op', 'SERIES',
+            'id', changed.id,
+            'doctor', changed.doctor_id,
+            'old_doctor', NULL
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER medical_appointmentseries_notify
+        AFTER INSERT OR UPDATE OR DELETE ON medical_appointmentseries
+        FOR EACH ROW EXECUTE FUNCTION medical_appointmentseries_notify();
+"""
+
+DROP_SERIES_NOTIFY_SQL = """
+    DROP TRIGGER medical_appointmentseries_notify ON medical_appointmentseries;
+    DROP FUNCTION medical_appointmentseries_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0012_appointment_notify'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='occurrence_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('Subject', models.CharField(max_length=200)),
+                ('StartTime', models.DateTimeField()),
+                ('EndTime', models.DateTimeField()),
+                ('Description', models.TextField(blank=True)),
+                ('CategoryColor', models.CharField(default='#0077BE', max_length=7)),
+                ('frequency', models.CharField(choices=[('WEEKLY', 'Hebdomadaire'), ('MONTHLY', 'Mensuelle')], max_length=10)),
+                ('interval', models.PositiveSmallIntegerField(default=1)),
+                ('until', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_series', to='medical.patient')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='medical.appointmentseries'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['series', 'occurrence_start'], name='medical_appt_series_idx'),
+        ),
+        migrations.RunSQL(CREATE_SERIES_NOTIFY_SQL, DROP_SERIES_NOTIFY_SQL),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.9 on 2026-10-19 02:21
+
+from django.db import migrations, models
+
+# Patient cohorts (medical/cohorts.py): last_visit_at of the existing patients,
+# afterwards kept up to date on every appointment write.
+BACKFILL_LAST_VISIT_SQL = """
+    UPDATE medical_patient p SET last_visit_at = v.at
+    FROM (
+        SELECT patient_id, MAX(at) AS at FROM (
+            SELECT patient_id, "StartTime" AS at FROM medical_appointment WHERE "Status" = 'Completed'
+            UNION ALL
+            SELECT patient_id, start_time FROM medical_archivedappointment
+        ) visits
+        GROUP BY patient_id
+    ) v
+    WHERE p.id = v.patient_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0013_appointment_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='last_visit_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_LAST_VISIT_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'Status', 'StartTime'], name='medical_appt_patient_visit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('is_high_risk', True)), fields=['date_of_birth'], name='medical_patient_risk_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['insurance_type', 'date_of_birth'], name='medical_patient_ins_dob_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_visit_at'], name='medical_patient_visit_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.9 on 2026-10-19 04:05
+
+from django.db import migrations
+
+
+def create_month_partitions(apps, schema_editor):
+    # 0010 only created the DEFAULT partition: give the current and next month
+    # their own, so the daily ensure_future_partitions run starts from there
+    from medical.partitioning import ensure_future_partitions
+    ensure_future_partitions(months_ahead=1, tables=['medical_patientaccesslog'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0014_patient_cohorts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_month_partitions, migrations.RunPython.noop),
+    ]
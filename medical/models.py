@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from cryptography.fernet import Fernet
 import base64
 import datetime
@@ -10,20 +11,50 @@ import hashlib
 SECRET_KEY_FOR_ENCRYPTION = base64.urlsafe_b64encode(settings.SECRET_KEY[:32].encode().ljust(32))
 cipher_suite = Fernet(SECRET_KEY_FOR_ENCRYPTION)
 
+class EncryptedValue(str):
+    """Ciphertext produced ahead of time (e.g. in a bulk import worker). Saved as-is, never re-encrypted."""
+
+def encrypt_value(value):
+    return EncryptedValue(cipher_suite.encrypt(value.encode()).decode())
+
+def hash_value(value):
+    """Deterministic search/uniqueness twin of an encrypted field. None for empty values."""
+    if value:
+        return hashlib.sha256(value.strip().encode()).hexdigest()
+    return None
+
+def decrypt_value(value):
+    if value:
+        try:
+            return cipher_suite.decrypt(value.encode()).decode()
+        except:
+            return value # Return as is if decryption fails
+    return value
+
+def decrypt_tokens(tokens):
+    """
+    Decrypt a chunk of raw ciphertexts at once (e.g. selected with Cast(field, TextField())
+    so the ORM does not decrypt them row by row). Identical tokens are decrypted once.
+    """
+    cache = {}
+    result = []
+    for token in tokens:
+        if token not in cache:
+            cache[token] = decrypt_value(token)
+        result.append(cache[token])
+    return result
+
 class EncryptedCharField(models.CharField):
     """Custom field that encrypts data before saving to DB"""
     def get_prep_value(self, value):
+        if isinstance(value, EncryptedValue):
+            return str(value)
         if value:
             return cipher_suite.encrypt(value.encode()).decode()
         return value
 
     def from_db_value(self, value, expression, connection):
-        if value:
-            try:
-                return cipher_suite.decrypt(value.encode()).decode()
-            except:
-                return value # Return as is if decryption fails
-        return value
+        return decrypt_value(value)
 
 class Patient(models.Model):
     INSURANCE_CHOICES = (
@@ -61,23 +92,22 @@ class Patient(models.Model):
     insurance_id_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    # Start of the latest completed appointment, live or archived (medical/cohorts.py)
+    last_visit_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Cohort filters of the patient list (medical/cohorts.py)
+            models.Index(fields=['date_of_birth'], condition=models.Q(is_high_risk=True),
+                         name='medical_patient_risk_dob_idx'),
+            models.Index(fields=['insurance_type', 'date_of_birth'], name='medical_patient_ins_dob_idx'),
+            models.Index(fields=['last_visit_at'], name='medical_patient_visit_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.cin:
-            self.cin_hash = hashlib.sha256(self.cin.strip().encode()).hexdigest()
-        else:
-            self.cin_hash = None
-            
-        if self.phone:
-            self.phone_hash = hashlib.sha256(self.phone.strip().encode()).hexdigest()
-        else:
-            self.phone_hash = None
-
-        if self.insurance_id:
-            self.insurance_id_hash = hashlib.sha256(self.insurance_id.strip().encode()).hexdigest()
-        else:
-            self.insurance_id_hash = None
-            
+        self.cin_hash = hash_value(self.cin)
+        self.phone_hash = hash_value(self.phone)
+        self.insurance_id_hash = hash_value(self.insurance_id)
         super().save(*args, **kwargs)
 
     @property
@@ -94,6 +124,34 @@ class Patient(models.Model):
     def __str__(self):
         return self.full_name
 
+class AppointmentSeries(models.Model):
+    """
+    Recurring follow-ups (orthodontics, implants). Occurrences are expanded on
+    read for the requested window (see medical/recurrence.py); an Appointment
+    row is only created once an occurrence is modified or completed.
+    StartTime / EndTime are those of the first occurrence.
+    """
+    FREQUENCY_CHOICES = [
+        ('WEEKLY', 'Hebdomadaire'),
+        ('MONTHLY', 'Mensuelle'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointment_series')
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    Subject = models.CharField(max_length=200)
+    StartTime = models.DateTimeField()
+    EndTime = models.DateTimeField()
+    Description = models.TextField(blank=True)
+    CategoryColor = models.CharField(max_length=7, default='#0077BE')
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES)
+    interval = models.PositiveSmallIntegerField(default=1)  # every N weeks / months
+    until = models.DateField(null=True, blank=True)  # last possible day, open-ended when empty
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.Subject} ({self.get_frequency_display()}, {self.StartTime})"
+
+
 class Appointment(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
     doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -103,6 +161,20 @@ class Appointment(models.Model):
     Description = models.TextField(blank=True)
     Status = models.CharField(max_length=50, default='Scheduled')
     CategoryColor = models.CharField(max_length=7, default='#0077BE')
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+    # Materialized occurrence of a series: its original slot, which the expansion skips
+    series = models.ForeignKey(AppointmentSeries, on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='occurrences', db_index=False)  # medical_appt_series_idx
+    occurrence_start = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Calendar by status and the reminder scan (medical/reminders.py)
+            models.Index(fields=['Status', 'StartTime'], name='medical_appt_status_start_idx'),
+            models.Index(fields=['series', 'occurrence_start'], name='medical_appt_series_idx'),
+            # Patient.last_visit_at recomputation (medical/cohorts.py)
+            models.Index(fields=['patient', 'Status', 'StartTime'], name='medical_appt_patient_visit_idx'),
+        ]
 
     def __str__(self):
         return f"{self.Subject} ({self.StartTime})"
@@ -175,3 +247,47 @@ class Prescription(models.Model):
 
     def __str__(self):
         return f"Prescription for {self.patient.full_name} on {self.created_at.date()}"
+
+
+class ArchivedAppointment(models.Model):
+    """
+    Cold storage for old completed appointments (see medical/archive.py): one JSON
+    document per appointment with its treatment steps, prescriptions and findings.
+    PostgreSQL compresses the documents (TOAST) and they stay out of the hot tables.
+    """
+    appointment_id = models.BigIntegerField(unique=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='archived_appointments')
+    start_time = models.DateTimeField()
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['patient', '-start_time'], name='medical_arch_patient_idx')]
+
+    def __str__(self):
+        return f"Archived appointment {self.appointment_id} ({self.start_time})"
+
+
+class PatientAccessLog(models.Model):
+    """
+    Append-only record of who opened which patient's PHI (see medical/audit.py).
+    The table is partitioned by month on accessed_at and rejects UPDATE/DELETE;
+    retention is done by dropping old partitions. No foreign keys, so entries
+    outlive the patient and user they mention.
+    """
+    ACTION_CHOICES = [
+        ('view', 'View'),
+        ('update', 'Update'),
+        ('export', 'Export'),
+    ]
+
+    accessed_at = models.DateTimeField()
+    user_id = models.BigIntegerField(null=True)
+    patient_id = models.BigIntegerField(null=True)  # NULL for clinic-wide exports
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    path = models.CharField(max_length=255, blank=True)
+    ip_address = models.GenericIPAddressField(null=True)
+
+    def __str__(self):
+        return f"{self.action} patient {self.patient_id} by user {self.user_id} at {self.accessed_at}"
+
@@ -0,0 +1,228 @@
+"""
+Optional monthly range partitioning of medical_appointment on "StartTime".
+
+Large clinics can be converted one at a time with
+`manage.py tenant_command partition_appointments --schema=<clinic>`; the
+other tenants keep the plain table. In a converted schema:
+  - medical_appointment is a partitioned parent with one partition per month
+    (medical_appointment_y2025m01, ...) plus a DEFAULT partition;
+  - date-window queries (calendar, revenue, reminders) only scan the months
+    they cover (partition pruning on "StartTime");
+  - the primary key becomes (id, "StartTime") as PostgreSQL requires. Django
+    still treats `id` as the pk; ids keep coming from one sequence.
+  - foreign keys *to* appointments (treatment steps, findings, prescriptions,
+    invoices) cannot reference a partitioned table by id alone, so their
+    database constraints are dropped. Django's on_delete handling runs in
+    Python and keeps working as before. Only the columns of
+    REFERENCING_COLUMNS are dropped: a conversion meeting any other foreign
+    key refuses to run, so a new one gets reviewed before it loses its constraint.
+  - the live calendar trigger (medical/live.py) is recreated on the new table.
+Future months are created ahead of time by ensure_future_partitions(), meant
+to run daily through `manage.py run_tenants --task medical.partitioning.ensure_future_partitions`.
+It also covers the other monthly-partitioned tables (PARTITIONED_TABLES), such
+as the PHI access log which is created partitioned by its migration.
+"""
+from datetime import date, datetime, time
+from django.db import connection, transaction
+from django.utils import timezone
+from .live import CREATE_TRIGGER_SQL
+
+TABLE = 'medical_appointment'
+SEQUENCE = 'medical_appointment_id_part_seq'
+DEFAULT_MONTHS_AHEAD = 3
+
+# table -> partition key column
+PARTITIONED_TABLES = {
+    TABLE: 'StartTime',
+    'medical_patientaccesslog': 'accessed_at',
+}
+
+# Foreign keys to TABLE whose constraint partition_appointments() may drop, as (table, column).
+# Their on_delete must keep working from the ORM alone.
+REFERENCING_COLUMNS = {
+    ('medical_treatmentstep', 'appointment_id'),  # CASCADE
+    ('medical_prescription', 'appointment_id'),  # CASCADE
+    ('medical_toothfinding', 'found_in_id'),  # SET_NULL
+    ('billing_invoice', 'appointment_id'),  # SET_NULL
+}
+
+# table -> trigger rejecting UPDATE / DELETE (migration 0010)
+APPEND_ONLY_TRIGGERS = {
+    'medical_patientaccesslog': 'medical_patientaccesslog_append_only',
+}
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month, table=TABLE):
+    return f'{table}_y{month:%Y}m{month:%m}'
+
+
+def default_partition_name(table=TABLE):
+    return f'{table}_default'
+
+
+def is_partitioned(table=TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relname = %s AND n.nspname = current_schema()
+            )
+        """, [table])
+        return cursor.fetchone()[0]
+
+
+def existing_partitions(table=TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits i
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            JOIN pg_class child ON child.oid = i.inhrelid
+            JOIN pg_namespace n ON n.oid = parent.relnamespace
+            WHERE parent.relname = %s AND n.nspname = current_schema()
+        """, [table])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _bounds(month):
+    # Partition bounds are timestamptz: use the clinic's midnight, like the rest of the app
+    return (timezone.make_aware(datetime.combine(month, time.min)),
+            timezone.make_aware(datetime.combine(add_months(month, 1), time.min)))
+
+
+def create_month_partition(cursor, month, table=TABLE, parent=None):
+    """
+    Create the partition of `table` for `month` (attached to `parent`, which
+    defaults to the table itself). Rows that landed in the DEFAULT partition
+    for that month are moved into it first, otherwise ATTACH would fail;
+    append-only tables included.
+    """
+    parent = parent or table
+    column = PARTITIONED_TABLES[table]
+    name = partition_name(month, table)
+    default = default_partition_name(table)
+    start, end = _bounds(month)
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{parent}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    if default in existing_partitions(parent):
+        # Moving rows to their month is not an edit: lift the append-only trigger
+        # of the DEFAULT partition for the move only (DDL, so inside this transaction)
+        trigger = APPEND_ONLY_TRIGGERS.get(table)
+        if trigger:
+            cursor.execute(f'ALTER TABLE "{default}" DISABLE TRIGGER "{trigger}"')
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM "{default}" WHERE "{column}" >= %s AND "{column}" < %s RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+        """, [start, end])
+        if trigger:
+            cursor.execute(f'ALTER TABLE "{default}" ENABLE TRIGGER "{trigger}"')
+    cursor.execute(f'ALTER TABLE "{parent}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)', [start, end])
+    return name
+
+
+def ensure_future_partitions(months_ahead=DEFAULT_MONTHS_AHEAD, tables=None):
+    """Task: create the missing partitions up to `months_ahead` months from now. Skips plain tables."""
+    created = []
+    current = month_start(timezone.localdate())
+    for table in tables or PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        existing = existing_partitions(table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            for offset in range(int(months_ahead) + 1):
+                month = add_months(current, offset)
+                if partition_name(month, table) not in existing:
+                    created.append(create_month_partition(cursor, month, table))
+    return created
+
+
+def _constraints(cursor, where):
+    """Foreign keys as (table, name, definition, first column)."""
+    cursor.execute(f"""
+        SELECT rel.relname, con.conname, pg_get_constraintdef(con.oid), att.attname
+        FROM pg_constraint con
+        JOIN pg_class rel ON rel.oid = con.conrelid
+        JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND {where}
+    """, [TABLE])
+    return cursor.fetchall()
+
+
+def partition_appointments(months_ahead=DEFAULT_MONTHS_AHEAD):
+    """
+    Convert the current tenant's medical_appointment into a partitioned table,
+    moving every existing row. Runs in one transaction holding an exclusive
+    lock on the table: schedule it outside opening hours. Raises ValueError,
+    changing nothing, if a foreign key outside REFERENCING_COLUMNS points at it.
+    Returns {'rows': moved, 'partitions': created}.
+    """
+    if is_partitioned():
+        return {'rows': 0, 'partitions': ensure_future_partitions(months_ahead)}
+
+    new_table = f'{TABLE}_new'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+
+        incoming = _constraints(cursor, "con.confrelid = %s::regclass")
+        unknown = sorted(f'{table}.{column}' for table, _, _, column in incoming
+                         if (table, column) not in REFERENCING_COLUMNS)
+        if unknown:
+            raise ValueError(f"Foreign keys to {TABLE} not in REFERENCING_COLUMNS: {', '.join(unknown)}. "
+                             "Check that their on_delete works without the constraint, then add them.")
+        outgoing = _constraints(cursor, "con.conrelid = %s::regclass")
+        cursor.execute("""
+            SELECT indexdef FROM pg_indexes i
+            WHERE i.tablename = %s AND i.schemaname = current_schema()
+              AND i.indexname NOT IN (
+                  SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'
+              )
+        """, [TABLE, TABLE])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'SELECT min("StartTime"), COALESCE(max(id), 0) FROM "{TABLE}"')
+        first_start, max_id = cursor.fetchone()
+
+        for table, name, _, _ in incoming:
+            cursor.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"')
+
+        # Identity columns cannot move to the new table: use a plain sequence
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS "{SEQUENCE}"')
+        cursor.execute("SELECT setval(%s, %s, %s)", [SEQUENCE, max_id or 1, bool(max_id)])
+        cursor.execute(f"""
+            CREATE TABLE "{new_table}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE ("StartTime")
+        """)
+        cursor.execute(f'ALTER TABLE "{new_table}" ALTER COLUMN id SET DEFAULT nextval(%s)', [SEQUENCE])
+        cursor.execute(f'ALTER TABLE "{new_table}" ADD CONSTRAINT "{TABLE}_part_pkey" PRIMARY KEY (id, "StartTime")')
+        cursor.execute(f'CREATE TABLE "{default_partition_name()}" PARTITION OF "{new_table}" DEFAULT')
+
+        current = month_start(timezone.localdate())
+        month = month_start(timezone.localtime(first_start).date()) if first_start else current
+        created = []
+        while month <= add_months(current, int(months_ahead)):
+            created.append(create_month_partition(cursor, month, parent=new_table))
+            month = add_months(month, 1)
+
+        cursor.execute(f'INSERT INTO "{new_table}" SELECT * FROM "{TABLE}"')
+        moved = cursor.rowcount
+
+        cursor.execute(f'DROP TABLE "{TABLE}"')
+        cursor.execute(f'ALTER TABLE "{new_table}" RENAME TO "{TABLE}"')
+        cursor.execute(f'ALTER SEQUENCE "{SEQUENCE}" OWNED BY "{TABLE}".id')
+        for _, name, definition, _ in outgoing:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS "{TABLE}_starttime_idx" ON "{TABLE}" ("StartTime")')
+        cursor.execute(CREATE_TRIGGER_SQL)
+    return {'rows': moved, 'partitions': created}
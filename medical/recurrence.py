@@ -0,0 +1,209 @@
+"""
+Recurring appointment series, expanded lazily.
+
+An AppointmentSeries stores the rule (first occurrence, WEEKLY / MONTHLY
+every `interval`, optional `until` day), never its occurrences. Reads expand
+it only inside the requested window:
+  - slot_starts() walks the rule in the clinic's local time, so a 09:00
+    follow-up stays at 09:00 across DST changes, and a monthly series on
+    the 31st falls on the last day of shorter months;
+  - expand() returns unsaved Appointment objects for the slots without a
+    row. Rows are matched on `occurrence_start` (the original slot), so a
+    moved occurrence does not reappear at its old time; archived rows
+    (medical/archive.py) keep their slot too;
+  - materialize() creates the row of one occurrence, the first time it is
+    modified, completed or reminded. From then on it is a plain appointment.
+conflicts() checks a doctor's rows and expanded occurrences alike.
+Editing a series changes every occurrence that has no row yet; to change a
+schedule from a given day on, end the series (`until`) and start a new one.
+"""
+from bisect import bisect_left
+from calendar import monthrange
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Appointment, AppointmentSeries, ArchivedAppointment
+
+WEEKLY = 'WEEKLY'
+MONTHLY = 'MONTHLY'
+SCHEDULED = 'Scheduled'
+FREE_STATUSES = ('Cancelled',)  # appointments that do not block their slot
+
+MAX_WINDOW = timedelta(days=366)  # longest calendar window expanded in one read
+CONFLICT_HORIZON = timedelta(days=180)  # open-ended series are checked this far ahead
+MAX_SHIFT = timedelta(days=31)  # how far an archived occurrence may have been moved
+MAX_DURATION = timedelta(days=1)
+
+
+def _local(moment):
+    return timezone.localtime(moment).replace(tzinfo=None)
+
+
+def _add_months(moment, months):
+    year, month = divmod(moment.year * 12 + moment.month - 1 + months, 12)
+    month += 1
+    return moment.replace(year=year, month=month, day=min(moment.day, monthrange(year, month)[1]))
+
+
+def slot_starts(series, start, end):
+    """Original starts of the series' occurrences in [start, end), oldest first."""
+    first = _local(series.StartTime)
+    window_start = _local(start)
+    if series.frequency == WEEKLY:
+        step = timedelta(weeks=series.interval)
+        index = max(0, (window_start - first) // step)
+
+        def nth(i):
+            return first + i * step
+    else:
+        months = (window_start.year - first.year) * 12 + window_start.month - first.month
+        index = max(0, months // series.interval - 1)
+
+        def nth(i):
+            return _add_months(first, i * series.interval)
+
+    while True:
+        local = nth(index)
+        if series.until and local.date() > series.until:
+            return
+        moment = timezone.make_aware(local)
+        if moment >= end:
+            return
+        if moment >= start:
+            yield moment
+        index += 1
+
+
+def is_slot(series, moment):
+    return moment in slot_starts(series, moment, moment + timedelta(microseconds=1))
+
+
+def occurrence(series, slot):
+    """Unsaved appointment for one slot (series with patient and doctor loaded)."""
+    return Appointment(
+        patient=series.patient,
+        doctor=series.doctor,
+        Subject=series.Subject,
+        Description=series.Description,
+        CategoryColor=series.CategoryColor,
+        StartTime=slot,
+        EndTime=slot + (series.EndTime - series.StartTime),
+        Status=SCHEDULED,
+        series=series,
+        occurrence_start=slot,
+    )
+
+
+def active_series(start, end):
+    """Series that may have occurrences in [start, end)."""
+    return (
+        AppointmentSeries.objects.filter(StartTime__lt=end)
+        .filter(Q(until__isnull=True) | Q(until__gte=timezone.localtime(start).date()))
+        .select_related('patient', 'doctor')
+    )
+
+
+def taken_slots(series_list, start, end):
+    """(series_id, occurrence_start) of the window's slots that have a row, live or archived."""
+    ids = [series.id for series in series_list]
+    taken = set(
+        Appointment.objects.filter(series_id__in=ids, occurrence_start__gte=start, occurrence_start__lt=end)
+        .values_list('series_id', 'occurrence_start')
+    )
+    archived = (
+        ArchivedAppointment.objects
+        .filter(patient_id__in={series.patient_id for series in series_list},
+                start_time__gte=start - MAX_SHIFT, start_time__lt=end + MAX_SHIFT,
+                document__series_id__in=ids)
+        .values_list('document__series_id', 'document__occurrence_start')
+    )
+    for series_id, slot in archived:
+        if slot:
+            taken.add((series_id, parse_datetime(slot)))
+    return taken
+
+
+def expand(series, start, end):
+    """Unsaved appointments for the occurrences of `series` in [start, end) that have no row."""
+    series = list(series)
+    if not series:
+        return []
+    taken = taken_slots(series, start, end)
+    return [
+        occurrence(one, slot)
+        for one in series
+        for slot in slot_starts(one, start, end)
+        if (one.id, slot) not in taken
+    ]
+
+
+def materialize(series, slot):
+    """
+    Row of the occurrence whose original start is `slot`: (appointment, created).
+    Raises ValueError when the series has no occurrence there.
+    """
+    with transaction.atomic():
+        # Serializes concurrent materializations: there is no unique index
+        # on (series, occurrence_start), the table may be partitioned
+        series = (AppointmentSeries.objects.select_for_update(of=('self',))
+                  .select_related('patient', 'doctor').get(pk=series.pk))
+        existing = Appointment.objects.filter(series=series, occurrence_start=slot).first()
+        if existing is not None:
+            return existing, False
+        if not is_slot(series, slot):
+            raise ValueError(f"No occurrence of series {series.pk} at {slot}.")
+        appointment = occurrence(series, slot)
+        appointment.save()
+        return appointment, True
+
+
+def materialize_window(start, end):
+    """Create the rows of every occurrence in [start, end). Returns how many were created."""
+    created = 0
+    for appointment in expand(active_series(start, end), start, end):
+        created += materialize(appointment.series, appointment.occurrence_start)[1]
+    return created
+
+
+# --------------------------
+# Conflicts
+# --------------------------
+
+def series_slots(series, horizon=CONFLICT_HORIZON):
+    """(start, end) of the upcoming occurrences to check for a new or edited series."""
+    start = max(series.StartTime, timezone.now())
+    duration = series.EndTime - series.StartTime
+    return [(slot, slot + duration) for slot in slot_starts(series, start, start + horizon)]
+
+
+def conflicts(doctor_id, slots, series_id=None, appointment_id=None):
+    """
+    The doctor's appointments and expanded occurrences overlapping one of
+    `slots` [(start, end), ...], which must not overlap each other. The series
+    or appointment being edited is left out; cancelled appointments are free.
+    """
+    if not slots:
+        return []
+    slots = sorted(slots)
+    start, end = slots[0][0], max(slot_end for _, slot_end in slots)
+
+    rows = (Appointment.objects.filter(doctor_id=doctor_id, StartTime__lt=end, EndTime__gt=start)
+            .exclude(Status__in=FREE_STATUSES).select_related('patient', 'doctor'))
+    if series_id is not None:
+        rows = rows.exclude(series_id=series_id)
+    if appointment_id is not None:
+        rows = rows.exclude(pk=appointment_id)
+    others = active_series(start - MAX_DURATION, end).filter(doctor_id=doctor_id)
+    if series_id is not None:
+        others = others.exclude(pk=series_id)
+
+    busy = []
+    starts = [slot_start for slot_start, _ in slots]
+    for appointment in [*rows, *expand(others, start - MAX_DURATION, end)]:
+        # Last slot starting before the appointment ends: the only one that can overlap it
+        index = bisect_left(starts, appointment.EndTime) - 1
+        if index >= 0 and slots[index][1] > appointment.StartTime:
+            busy.append(appointment)
+    return sorted(busy, key=lambda appointment: appointment.StartTime)
@@ -0,0 +1,177 @@
+"""
+SMS / WhatsApp reminders for tomorrow's scheduled appointments.
+
+send_reminders() works on the current tenant schema and is meant to be fanned
+out over every clinic by the send_reminders command (run_tenants process pool):
+  0. the day's occurrences of recurring series are materialized first
+     (medical/recurrence.py), so they are reminded and stamped like any row;
+  1. due appointments come straight from the (Status, StartTime) index:
+     'Scheduled', starting on the target day, not reminded yet;
+  2. only those patients' phones are decrypted, one batch at a time (raw
+     ciphertexts selected with Cast, as in the exports);
+  3. messages go to the REMINDER_BACKEND sender through a token bucket of
+     REMINDER_RATE messages per second per process;
+  4. reminder_sent_at is stamped after each batch, so a re-run skips what was
+     already sent (after a crash, at most the batch in flight goes out twice).
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, time as day_start
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from clinics.throttling import TokenBucket
+from .models import Appointment, decrypt_tokens
+from .recurrence import active_series, expand, materialize_window
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DUE_STATUS = 'Scheduled'
+MESSAGE = ("Rappel {clinic}: {first_name}, vous avez rendez-vous le {date} à {time}. "
+           "En cas d'empêchement, merci de prévenir le cabinet.")
+
+
+# --------------------------
+# Sender backends
+# --------------------------
+
+class BaseReminderBackend:
+    """send() returns True once the provider accepted the message."""
+
+    def send(self, schema_name, phone, text):
+        raise NotImplementedError
+
+
+class ConsoleBackend(BaseReminderBackend):
+    """Development stub: prints the messages."""
+
+    def send(self, schema_name, phone, text):
+        print(f"[{schema_name}] {phone}: {text}")
+        return True
+
+
+class FileBackend(BaseReminderBackend):
+    """Test stub: appends one JSON line per message to REMINDER_FILE_PATH."""
+
+    lock = threading.Lock()
+
+    def send(self, schema_name, phone, text):
+        line = json.dumps({'schema': schema_name, 'phone': phone, 'text': text}, ensure_ascii=False)
+        with self.lock, open(settings.REMINDER_FILE_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+        return True
+
+
+_backend = None
+_buckets = {}
+
+
+def get_backend():
+    # One sender per process: run_tenants workers handle many clinics each
+    global _backend
+    if _backend is None:
+        if not settings.REMINDER_BACKEND:
+            raise ImproperlyConfigured("REMINDER_BACKEND is not set: no SMS/WhatsApp sender is configured.")
+        _backend = import_string(settings.REMINDER_BACKEND)()
+    return _backend
+
+
+def throttle(rate):
+    """Block until the process-wide bucket for `rate` messages/second has a token."""
+    bucket = _buckets.get(rate)
+    if bucket is None:
+        bucket = _buckets[rate] = TokenBucket(rate, max(1.0, rate))
+    wait = bucket.take()
+    while wait:
+        time.sleep(wait)
+        wait = bucket.take()
+
+
+# --------------------------
+# Per-tenant task
+# --------------------------
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, day_start.min))
+    return start, start + timedelta(days=1)
+
+
+def due_appointments(day):
+    start, end = day_bounds(day)
+    return Appointment.objects.filter(
+        Status=DUE_STATUS,
+        StartTime__gte=start,
+        StartTime__lt=end,
+        reminder_sent_at__isnull=True,
+    )
+
+
+def clinic_name():
+    from clinics.models import Clinic
+    return Clinic.objects.filter(schema_name=connection.schema_name).values_list('name', flat=True).first() or ''
+
+
+def send_reminders(day=None, rate=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Task: remind the current tenant's patients of their appointments on `day`
+    (ISO date or date, defaults to tomorrow). Returns the counters.
+    """
+    if day is None:
+        day = timezone.localdate() + timedelta(days=1)
+    elif isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    rate = float(rate or settings.REMINDER_RATE)
+    batch_size = int(batch_size)
+    dry_run = dry_run in (True, '1', 'true')
+
+    backend = get_backend()
+    clinic = clinic_name()
+    counters = {'due': 0, 'sent': 0, 'skipped': 0, 'failed': 0}
+    start, end = day_bounds(day)
+    if dry_run:
+        counters['due'] += len(expand(active_series(start, end), start, end))
+    else:
+        materialize_window(start, end)
+    last_id = 0
+    while True:
+        batch = list(
+            due_appointments(day).filter(id__gt=last_id).order_by('id')
+            .annotate(phone_token=Cast('patient__phone', TextField()))
+            .values_list('id', 'StartTime', 'patient__first_name', 'phone_token')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        counters['due'] += len(batch)
+        if dry_run:
+            continue
+
+        sent_ids = []
+        for (appointment_id, start, first_name, _), phone in zip(batch, decrypt_tokens([row[3] for row in batch])):
+            if not phone:
+                counters['skipped'] += 1
+                continue
+            start = timezone.localtime(start)
+            text = MESSAGE.format(clinic=clinic, first_name=first_name,
+                                  date=start.strftime('%d/%m'), time=start.strftime('%H:%M'))
+            throttle(rate)
+            try:
+                accepted = backend.send(connection.schema_name, phone, text)
+            except Exception:
+                logger.exception("Reminder for appointment %s (%s) could not be sent.", appointment_id, connection.schema_name)
+                accepted = False
+            if accepted:
+                sent_ids.append(appointment_id)
+            else:
+                counters['failed'] += 1
+
+        Appointment.objects.filter(id__in=sent_ids).update(reminder_sent_at=timezone.now())
+        counters['sent'] += len(sent_ids)
+    return counters
@@ -1,7 +1,9 @@
 from rest_framework import serializers
-from .models import Patient, Appointment, ToothFinding, TreatmentStep, Prescription
+from .models import Patient, Appointment, AppointmentSeries, ToothFinding, TreatmentStep, Prescription
 from django.contrib.auth import get_user_model
 from django.db import connection
+from django.core.exceptions import ObjectDoesNotExist
+from .recurrence import MAX_DURATION
 
 User = get_user_model()
 
@@ -29,11 +31,20 @@ class PrescriptionSerializer(serializers.ModelSerializer):
 
 # serializers.py
 
+def patient_balance(patient):
+    """Amount owed, read from the materialized billing account (select_related('account'))."""
+    try:
+        return str(patient.account.balance)
+    except ObjectDoesNotExist:
+        return '0.00'
+
 class PatientListSerializer(serializers.ModelSerializer):
     """
     Used ONLY for the Patient List table. 
     Excludes findings, alerts, and heavy medical history.
     """
+    balance = serializers.SerializerMethodField()
+
     class Meta:
         model = Patient
         fields = [
@@ -44,21 +55,44 @@ class PatientListSerializer(serializers.ModelSerializer):
             'gender', 
             'date_of_birth', 
             'is_high_risk', 
-            'phone' # For O(1) search in frontend if needed
+            'phone', # For O(1) search in frontend if needed
+            'balance',
+            'last_visit_at'
         ]
 
+    def get_balance(self, obj):
+        return patient_balance(obj)
+
 class PatientDetailSerializer(serializers.ModelSerializer):
     """
     Used ONLY for the EMR Hub. Includes everything.
     """
     findings = ToothFindingSerializer(many=True, read_only=True)
+    balance = serializers.SerializerMethodField()
     
     class Meta:
         model = Patient
         fields = '__all__' # Or specify all heavy fields
+
+    def get_balance(self, obj):
+        return patient_balance(obj)
         
 
 
+class PatientImportSerializer(serializers.ModelSerializer):
+    """
+    Used ONLY to validate bulk-imported CSV rows. No nested fields, no DB lookups:
+    hashing, encryption and deduplication are done by medical.imports per chunk.
+    """
+    class Meta:
+        model = Patient
+        fields = [
+            'first_name', 'last_name', 'gender', 'date_of_birth',
+            'phone', 'cin', 'insurance_type', 'insurance_id',
+            'allergies', 'medical_alerts', 'is_high_risk'
+        ]
+
+
 class AppointmentSerializer(serializers.ModelSerializer):
     # We pull these from the related Patient model
     patient_name = serializers.SerializerMethodField()
@@ -95,8 +129,10 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'id', 'Subject', 'StartTime', 'EndTime', 
             'Description', 'Status', 'CategoryColor',
             'patient', 'patient_name', 'patient_phone','doctor_name', 'doctor',
-            'treatment_steps'
+            'treatment_steps', 'series', 'occurrence_start'
         ]
+        # Set when an occurrence of a series is materialized (medical/recurrence.py)
+        read_only_fields = ['series', 'occurrence_start']
 
     def get_patient_name(self, obj):
         try:
@@ -114,4 +150,52 @@ class AppointmentSerializer(serializers.ModelSerializer):
         try:
             return obj.doctor.username if obj.doctor else None
         except Exception as e:
-            return None
\ No newline at end of file
+            return None
+
+
+class OccurrenceSerializer(AppointmentSerializer):
+    """Expanded occurrence of a series, not materialized yet: no id, no treatment steps."""
+    treatment_steps = serializers.SerializerMethodField()
+
+    def get_treatment_steps(self, obj):
+        return []
+
+
+class ConflictSerializer(serializers.ModelSerializer):
+    patient_name = serializers.CharField(source='patient.full_name', read_only=True)
+
+    class Meta:
+        model = Appointment
+        fields = ['id', 'series', 'occurrence_start', 'Subject', 'StartTime', 'EndTime', 'patient', 'patient_name']
+
+
+class AppointmentSeriesSerializer(serializers.ModelSerializer):
+    patient_name = serializers.CharField(source='patient.full_name', read_only=True)
+    doctor_name = serializers.CharField(source='doctor.username', read_only=True)
+    doctor = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(role='DOCTOR'))
+    interval = serializers.IntegerField(min_value=1, max_value=52, default=1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        tenant = getattr(connection, 'tenant', None)
+        if 'request' in self.context and tenant is not None and tenant.schema_name != 'public':
+            # Doctors of the current clinic only
+            self.fields['doctor'].queryset = User.objects.filter(clinic_id=tenant.id, role='DOCTOR')
+
+    class Meta:
+        model = AppointmentSeries
+        fields = [
+            'id', 'patient', 'patient_name', 'doctor', 'doctor_name',
+            'Subject', 'StartTime', 'EndTime', 'Description', 'CategoryColor',
+            'frequency', 'interval', 'until', 'created_at',
+        ]
+
+    def validate(self, data):
+        start = data.get('StartTime', getattr(self.instance, 'StartTime', None))
+        end = data.get('EndTime', getattr(self.instance, 'EndTime', None))
+        until = data.get('until', getattr(self.instance, 'until', None))
+        if start and end and not start < end <= start + MAX_DURATION:
+            raise serializers.ValidationError({'EndTime': "La fin doit suivre le début, dans la journée."})
+        if start and until and until < start.date():
+            raise serializers.ValidationError({'until': "La date de fin précède la première séance."})
+        return data
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from core.cache import PATIENTS, invalidate
+from .cohorts import refresh_last_visit
+from .models import Patient, Appointment, ToothFinding
+
+# Cached reads embedding each model's rows (patient detail embeds the findings)
+CACHE_GROUPS = {
+    Patient: (PATIENTS,),
+    ToothFinding: (PATIENTS,),
+}
+
+
+@receiver([post_save, post_delete])
+def invalidate_cached_reads(sender, **kwargs):
+    groups = CACHE_GROUPS.get(sender)
+    if groups:
+        invalidate(*groups)
+
+
+@receiver([post_save, post_delete], sender=Appointment)
+def update_last_visit(sender, instance, **kwargs):
+    refresh_last_visit(instance.patient_id)
@@ -1,3 +1,761 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import pickle
+import tempfile
+import zlib
+from unittest import mock
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django_tenants.utils import tenant_context
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+from billing.models import Invoice
+from clinics.models import Clinic, Job
+from core.cache import PATIENTS, get_or_compute
+from users.models import User
+from users.views import user_detail_async
+from . import audit
+from .analytics import occupancy
+from .archive import archive_appointments
+from .imports import import_patients
+from .live import connect_listener
+from .models import (Patient, Appointment, AppointmentSeries, ArchivedAppointment, PatientAccessLog, Prescription,
+                     ToothFinding, TreatmentStep, hash_value)
+from .partitioning import (REFERENCING_COLUMNS, add_months, ensure_future_partitions, existing_partitions,
+                           is_partitioned, month_start, partition_appointments, partition_name)
+from .recurrence import active_series, conflicts, expand, materialize
+from .reminders import send_reminders
+from .views import (patient_list, patient_detail, patient_export, patient_history, patient_import,
+                    patient_list_async, appointment_list_async, appointment_detail_async)
 
-# Create your tests here.
+
+class TwoClinicsMixin:
+    """Two real tenant schemas, each with one patient whose last_name is the schema name."""
+
+    SCHEMAS = ('test_pool_a', 'test_pool_b')
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.clinics = []
+        for schema_name in self.SCHEMAS:
+            clinic = Clinic(schema_name=schema_name, name=schema_name)
+            clinic.save(verbosity=0)
+            with tenant_context(clinic):
+                # last_name doubles as the owner tag checked by the tests
+                Patient.objects.create(first_name='Test', last_name=schema_name, phone='0600000000')
+            self.clinics.append(clinic)
+
+    def tearDown(self):
+        connection.set_schema_to_public()
+        for clinic in self.clinics:
+            clinic.delete(force_drop=True)
+
+    def visible_owners(self):
+        return set(Patient.objects.values_list('last_name', flat=True))
+
+
+CACHE_DIR = tempfile.mkdtemp(prefix='clinic-cache-tests-')
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'KEY_FUNCTION': 'django_tenants.cache.make_key',
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'clinic-l1-tests',
+        'KEY_FUNCTION': 'django_tenants.cache.make_key',
+    },
+})
+class TenantCacheTests(TwoClinicsMixin, TransactionTestCase):
+    """Cached reads must stay inside their clinic and follow writes."""
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        caches['local'].clear()
+        self.user = User.objects.create_user(username='cache_admin', password='x', role='ADMIN')
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        self.user.delete()
+        super().tearDown()
+
+    def get(self, view, path, **kwargs):
+        request = self.factory.get(path)
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs)
+
+    def listed_owners(self):
+        return {row['last_name'] for row in self.get(patient_list, '/api/medical/patients/').data['results']}
+
+    def test_same_key_is_isolated_per_tenant(self):
+        clinic_a, clinic_b = self.clinics
+        with tenant_context(clinic_a):
+            self.assertEqual(get_or_compute(PATIENTS, 'k', lambda: clinic_a.schema_name), clinic_a.schema_name)
+        with tenant_context(clinic_b):
+            self.assertEqual(get_or_compute(PATIENTS, 'k', lambda: clinic_b.schema_name), clinic_b.schema_name)
+        with tenant_context(clinic_a):
+            self.assertEqual(get_or_compute(PATIENTS, 'k', lambda: 'recomputed'), clinic_a.schema_name)
+
+    def test_patient_pages_are_not_served_across_tenants(self):
+        # Identical URLs and primed caches on both sides, in both orders
+        for _ in range(2):
+            for clinic in self.clinics:
+                with tenant_context(clinic):
+                    self.assertEqual(self.listed_owners(), {clinic.schema_name})
+
+        # Fresh schemas have their own sequences: both patients are id 1, same detail URL
+        for _ in range(2):
+            for clinic in self.clinics:
+                with tenant_context(clinic):
+                    patient_id = Patient.objects.get().pk
+                    self.assertEqual(self.get(patient_detail, '/', pk=patient_id).data['last_name'],
+                                     clinic.schema_name)
+
+    def test_writes_invalidate_cached_reads(self):
+        clinic = self.clinics[0]
+        with tenant_context(clinic):
+            patient = Patient.objects.get()
+            self.assertEqual(self.listed_owners(), {clinic.schema_name})
+            self.assertEqual(self.get(patient_detail, '/', pk=patient.pk).data['findings'], [])
+
+            Patient.objects.create(first_name='Test', last_name='new_patient', phone='0611111111')
+            ToothFinding.objects.create(patient=patient, tooth_number=11, condition='CARIES')
+
+            self.assertEqual(self.listed_owners(), {clinic.schema_name, 'new_patient'})
+            self.assertEqual(len(self.get(patient_detail, '/', pk=patient.pk).data['findings']), 1)
+
+    def test_shared_cache_holds_no_plaintext_pii(self):
+        pii = {'cin': 'BK123456', 'phone': '0612345678', 'insurance_id': 'AMO-998877'}
+        with tenant_context(self.clinics[0]):
+            patient = Patient.objects.create(first_name='Test', last_name='pii', **pii)
+            self.listed_owners()
+            self.assertEqual(self.get(patient_detail, '/', pk=patient.pk).data['cin'], pii['cin'])
+
+        stored = b''
+        for root, _, names in os.walk(CACHE_DIR):
+            for name in names:
+                with open(os.path.join(root, name), 'rb') as f:
+                    pickle.load(f)  # FileBasedCache: expiry, then the zlib-compressed pickle
+                    stored += zlib.decompress(f.read())
+        self.assertTrue(stored)
+        for value in pii.values():
+            self.assertNotIn(value.encode(), stored)
+
+
+class PatientExportTests(TwoClinicsMixin, TransactionTestCase):
+    """Admins stream the clinic's patients with their history, decrypted; each export is audited."""
+
+    def setUp(self):
+        super().setUp()
+        self.clinic = self.clinics[0]
+        self.admin = User.objects.create_user(username='export_admin', password='x', role='ADMIN',
+                                              clinic_id=self.clinic.id)
+        self.doctor = User.objects.create_user(username='export_doctor', password='x', role='DOCTOR',
+                                               clinic_id=self.clinic.id)
+        self.factory = APIRequestFactory()
+        start = timezone.now() - timedelta(days=2)
+        with tenant_context(self.clinic):
+            self.patient = Patient.objects.get()
+            self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, Subject='Soins',
+                                                          StartTime=start, EndTime=start + timedelta(minutes=30))
+            TreatmentStep.objects.create(appointment=self.appointment, tooth_number=11, step_type='filling',
+                                         price=Decimal('100'), status='completed')
+
+    def tearDown(self):
+        self.admin.delete()
+        self.doctor.delete()
+        super().tearDown()
+
+    def export(self, user, query=''):
+        request = self.factory.get(f'/api/medical/patients/export/{query}')
+        request.tenant = self.clinic
+        force_authenticate(request, user=user)
+        return patient_export(request)
+
+    def test_ndjson_streams_the_history(self):
+        with tenant_context(self.clinic):
+            response = self.export(self.admin)
+            self.assertTrue(response.streaming)
+            documents = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(documents), 1)
+        document = documents[0]
+        self.assertEqual((document['last_name'], document['phone']), (self.clinic.schema_name, '0600000000'))
+        self.assertEqual([appointment['id'] for appointment in document['appointments']], [self.appointment.pk])
+        self.assertEqual([step['tooth_number'] for step in document['appointments'][0]['treatment_steps']], [11])
+
+    def test_csv_entity_and_audit_entry(self):
+        with tenant_context(self.clinic):
+            response = self.export(self.admin, '?output=csv&entity=appointments')
+            self.assertEqual(response['Content-Disposition'],
+                             f'attachment; filename="{self.clinic.schema_name}_appointments.csv"')
+            rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+            self.assertEqual([int(row['id']) for row in rows], [self.appointment.pk])
+
+            audit.writer.flush()
+            self.assertEqual(list(PatientAccessLog.objects.values_list('action', 'user_id', 'patient_id')),
+                             [('export', self.admin.pk, None)])
+
+    def test_export_is_admin_only(self):
+        with tenant_context(self.clinic):
+            self.assertEqual(self.export(self.doctor).status_code, 403)
+            self.assertEqual(self.export(self.admin, '?output=xml').status_code, 400)
+
+
+IMPORT_CSV = """first_name,last_name,phone,cin,gender
+Amine,Alaoui,0611111111,AB100,M
+Sara,Bennani,,,F
+Omar,Idrissi,0622222222,,X
+Amine,Alaoui,0699999999,AB100,M
+Test,test_pool_a,0600000000,,
+"""
+
+
+class PatientImportTests(TwoClinicsMixin, TransactionTestCase):
+    """Invalid rows are rejected, duplicates (in the file or the clinic) skipped; big uploads are queued."""
+
+    def setUp(self):
+        super().setUp()
+        self.clinic = self.clinics[0]
+        self.user = User.objects.create_user(username='import_admin', password='x', role='ADMIN',
+                                             clinic_id=self.clinic.id)
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        self.user.delete()
+        super().tearDown()
+
+    def upload(self, query=''):
+        request = self.factory.post(f'/api/medical/patients/import/{query}', {
+            'file': SimpleUploadedFile('patients.csv', IMPORT_CSV.encode(), content_type='text/csv'),
+        }, format='multipart')
+        force_authenticate(request, user=self.user)
+        return patient_import(request)
+
+    def test_report_counts_each_row_once(self):
+        with tenant_context(self.clinic):
+            report = import_patients(io.StringIO(IMPORT_CSV), processes=1).as_dict()
+            self.assertEqual({key: report[key] for key in ('created', 'duplicates', 'rejected')},
+                             {'created': 1, 'duplicates': 2, 'rejected': 2})
+            self.assertEqual([(error['line'], error['field']) for error in report['errors']],
+                             [(3, 'phone'), (4, 'gender'), (5, 'cin'), (6, 'phone')])
+            imported = Patient.objects.get(last_name='Alaoui')
+            self.assertEqual((imported.cin, imported.phone_hash), ('AB100', hash_value('0611111111')))
+
+    def test_dry_run_inserts_nothing(self):
+        with tenant_context(self.clinic):
+            response = self.upload('?dry_run=1')
+            self.assertEqual((response.status_code, response.data['would_create'], response.data['created']),
+                             (200, 1, 0))
+            self.assertEqual(Patient.objects.count(), 1)
+
+    def test_large_upload_goes_to_the_job_queue(self):
+        with tenant_context(self.clinic), tempfile.TemporaryDirectory() as upload_dir, \
+                override_settings(JOBS_UPLOAD_DIR=upload_dir), mock.patch('medical.views.SYNC_MAX_BYTES', 10):
+            response = self.upload()
+            self.assertEqual(response.status_code, 202)
+            job = Job.objects.get(pk=response.data['job_id'])
+            self.assertEqual((job.task, job.schema_name),
+                             ('medical.imports.import_patients_file', self.clinic.schema_name))
+            self.assertTrue(os.path.exists(job.kwargs['path']))
+            self.assertEqual(Patient.objects.count(), 1)
+
+
+class AsyncReadViewTests(TwoClinicsMixin, TransactionTestCase):
+    """The async GET views answer like the DRF views they stand in for; other methods reach the DRF views."""
+
+    def setUp(self):
+        super().setUp()
+        caches['local'].clear()
+        caches['default'].clear()
+        self.clinic = self.clinics[0]
+        self.admin = User.objects.create_user(username='async_admin', password='x', role='ADMIN', clinic_id=self.clinic.id)
+        self.doctors = [User.objects.create_user(username=f'async_doctor_{i}', password='x', role='DOCTOR',
+                                                 clinic_id=self.clinic.id) for i in range(2)]
+        self.factory = AsyncRequestFactory()
+        start = timezone.now() + timedelta(days=1)
+        with tenant_context(self.clinic):
+            for i in range(4):
+                Patient.objects.create(first_name=f'A{i}', last_name='async', phone='0600000000')
+            patient = Patient.objects.first()
+            self.appointments = [
+                Appointment.objects.create(patient=patient, doctor=doctor, Subject='Contrôle',
+                                           StartTime=start, EndTime=start + timedelta(minutes=30))
+                for doctor in self.doctors
+            ]
+
+    def tearDown(self):
+        User.objects.filter(pk__in=[self.admin.pk, *(doctor.pk for doctor in self.doctors)]).delete()
+        super().tearDown()
+
+    def call(self, view, path, user=None, method='get', **kwargs):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+        if method == 'post':
+            request = self.factory.post(path, json.dumps(kwargs.pop('data')), content_type='application/json',
+                                        headers=headers)
+        else:
+            request = self.factory.get(path, headers=headers)
+        request.tenant = self.clinic
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_unauthenticated_gets_401_with_challenge(self):
+        response = self.call(patient_list_async, '/api/medical/patients/')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response['WWW-Authenticate'].startswith('Bearer'))
+
+    def test_page_matches_the_drf_view(self):
+        path = '/api/medical/patients/?page=2&page_size=2'
+        page = json.loads(self.call(patient_list_async, path, self.admin).content)
+        caches['local'].clear()
+        caches['default'].clear()
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=self.admin)
+        with tenant_context(self.clinic):
+            expected = patient_list(request).data
+        self.assertEqual(page, json.loads(json.dumps(expected)))
+        self.assertEqual(self.call(patient_list_async, '/api/medical/patients/?page=9', self.admin).status_code, 404)
+
+    def test_doctor_only_reads_own_appointments(self):
+        own, other = self.appointments
+        listed = json.loads(self.call(appointment_list_async, '/api/medical/appointments/', self.doctors[0]).content)
+        self.assertEqual([row['id'] for row in listed], [own.id])
+        response = self.call(appointment_detail_async, f'/api/medical/appointments/{other.id}/', self.doctors[0], pk=other.id)
+        self.assertEqual(response.status_code, 404)
+        listed = json.loads(self.call(appointment_list_async, '/api/medical/appointments/', self.admin).content)
+        self.assertEqual({row['id'] for row in listed}, {own.id, other.id})
+
+    def test_post_falls_through_to_the_drf_view(self):
+        response = self.call(patient_list_async, '/api/medical/patients/', self.admin, method='post',
+                             data={'first_name': 'Nouveau', 'last_name': 'async', 'phone': '0611111111', 'gender': 'F'})
+        self.assertEqual(response.status_code, 201)
+        with tenant_context(self.clinic):
+            self.assertTrue(Patient.objects.filter(first_name='Nouveau').exists())
+
+    def test_user_of_another_clinic_is_not_found(self):
+        outsider = User.objects.create_user(username='async_outsider', password='x', role='DOCTOR',
+                                            clinic_id=self.clinics[1].id)
+        try:
+            response = self.call(user_detail_async, f'/api/users/{outsider.pk}/', self.admin, pk=outsider.pk)
+            self.assertEqual(response.status_code, 404)
+        finally:
+            outsider.delete()
+
+
+class LiveCalendarTriggerTests(TwoClinicsMixin, TransactionTestCase):
+    """Appointment writes must be announced on the live calendar channel, tagged with their clinic."""
+
+    def setUp(self):
+        super().setUp()
+        self.listener = connect_listener()
+        self.doctors = [
+            User.objects.create_user(username=f'live_doctor_{i}', password='x', role='DOCTOR') for i in range(2)
+        ]
+        self.clinic = self.clinics[0]
+
+    def tearDown(self):
+        self.listener.close()
+        super().tearDown()
+
+    def changes(self):
+        self.listener.poll()
+        changes = [json.loads(notify.payload) for notify in self.listener.notifies]
+        self.listener.notifies.clear()
+        return [(change['schema'], change['op'], change['doctor'], change['old_doctor']) for change in changes]
+
+    def test_writes_are_announced_with_their_schema_and_doctors(self):
+        first, second = (doctor.id for doctor in self.doctors)
+        with tenant_context(self.clinic):
+            start = timezone.now()
+            appointment = Appointment.objects.create(
+                patient=Patient.objects.get(), doctor=self.doctors[0], Subject='Live',
+                StartTime=start, EndTime=start + timedelta(minutes=30),
+            )
+            appointment.doctor = self.doctors[1]
+            appointment.save()
+            appointment.delete()
+        schema_name = self.clinic.schema_name
+        self.assertEqual(self.changes(), [
+            (schema_name, 'INSERT', first, None),
+            (schema_name, 'UPDATE', second, first),
+            (schema_name, 'DELETE', second, None),
+        ])
+
+    def test_reminder_bookkeeping_is_not_announced(self):
+        with tenant_context(self.clinic):
+            start = timezone.now()
+            appointment = Appointment.objects.create(
+                patient=Patient.objects.get(), doctor=self.doctors[0], Subject='Live',
+                StartTime=start, EndTime=start + timedelta(minutes=30),
+            )
+            self.changes()
+            Appointment.objects.filter(pk=appointment.pk).update(reminder_sent_at=timezone.now())
+        self.assertEqual(self.changes(), [])
+
+
+class RecurringSeriesTests(TwoClinicsMixin, TransactionTestCase):
+    """Series occurrences are expanded per window and only stored once modified."""
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = User.objects.create_user(username='series_doctor', password='x', role='DOCTOR')
+        self.clinic = self.clinics[0]
+        self.first = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        with tenant_context(self.clinic):
+            self.series = AppointmentSeries.objects.create(
+                patient=Patient.objects.get(), doctor=self.doctor, Subject='Orthodontie', frequency='WEEKLY',
+                StartTime=self.first, EndTime=self.first + timedelta(minutes=30),
+            )
+
+    def window(self, weeks):
+        start, end = self.first - timedelta(hours=1), self.first + timedelta(weeks=weeks)
+        return [occurrence.StartTime for occurrence in expand(active_series(start, end), start, end)]
+
+    def test_only_the_window_is_expanded_and_nothing_is_stored(self):
+        with tenant_context(self.clinic):
+            self.assertEqual(self.window(4), [self.first + timedelta(weeks=i) for i in range(4)])
+            self.assertFalse(Appointment.objects.exists())
+
+    def test_materialized_occurrence_replaces_its_slot(self):
+        slot = self.first + timedelta(weeks=1)
+        with tenant_context(self.clinic):
+            appointment, created = materialize(self.series, slot)
+            self.assertEqual(materialize(self.series, slot), (appointment, False))
+            appointment.StartTime = slot + timedelta(days=2)
+            appointment.save()
+            self.assertTrue(created)
+            self.assertNotIn(slot, self.window(4))
+            with self.assertRaises(ValueError):
+                materialize(self.series, slot + timedelta(hours=1))
+
+    def test_conflicts_include_expanded_occurrences(self):
+        slot = self.first + timedelta(weeks=3, minutes=15)
+        with tenant_context(self.clinic):
+            busy = conflicts(self.doctor.id, [(slot, slot + timedelta(minutes=30))])
+            self.assertEqual([(b.series_id, b.occurrence_start) for b in busy],
+                             [(self.series.id, self.first + timedelta(weeks=3))])
+            self.assertEqual(conflicts(self.doctor.id, [(slot, slot + timedelta(minutes=30))],
+                                       series_id=self.series.id), [])
+
+
+REMINDER_FILE = os.path.join(tempfile.mkdtemp(prefix='clinic-reminders-tests-'), 'reminders.ndjson')
+
+
+@override_settings(REMINDER_BACKEND='medical.reminders.FileBackend', REMINDER_FILE_PATH=REMINDER_FILE)
+class ReminderTests(TwoClinicsMixin, TransactionTestCase):
+    """Tomorrow's scheduled appointments, series occurrences included, are reminded once each."""
+
+    def setUp(self):
+        super().setUp()
+        if os.path.exists(REMINDER_FILE):
+            os.remove(REMINDER_FILE)
+        self.clinic = self.clinics[0]
+        self.doctor = User.objects.create_user(username='reminder_doctor', password='x', role='DOCTOR',
+                                               clinic_id=self.clinic.id)
+        self.day = timezone.localdate() + timedelta(days=1)
+        with tenant_context(self.clinic):
+            patient = Patient.objects.get()
+            no_phone = Patient.objects.create(first_name='Sans', last_name='telephone', phone='')
+            self.book(patient, self.day, 10)
+            self.book(no_phone, self.day, 11)
+            self.book(patient, self.day, 12, Status='Cancelled')
+            self.book(patient, self.day + timedelta(days=1), 10)
+            first = self.at(self.day, 9)
+            AppointmentSeries.objects.create(patient=patient, doctor=self.doctor, Subject='Orthodontie',
+                                             frequency='WEEKLY', StartTime=first, EndTime=first + timedelta(minutes=30))
+
+    def tearDown(self):
+        self.doctor.delete()
+        super().tearDown()
+
+    def at(self, day, hour):
+        return timezone.make_aware(datetime.combine(day, datetime.min.time().replace(hour=hour)))
+
+    def book(self, patient, day, hour, **fields):
+        start = self.at(day, hour)
+        return Appointment.objects.create(patient=patient, doctor=self.doctor, Subject='Soins', StartTime=start,
+                                          EndTime=start + timedelta(minutes=30), **fields)
+
+    def sent(self):
+        if not os.path.exists(REMINDER_FILE):
+            return []
+        with open(REMINDER_FILE, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_due_reminders_are_sent_once(self):
+        with tenant_context(self.clinic):
+            self.assertEqual(send_reminders(self.day), {'due': 3, 'sent': 2, 'skipped': 1, 'failed': 0})
+            messages = self.sent()
+            self.assertEqual([(m['schema'], m['phone']) for m in messages],
+                             [(self.clinic.schema_name, '0600000000')] * 2)
+            self.assertEqual(sorted(m['text'].split(' à ')[1][:5] for m in messages), ['09:00', '10:00'])
+            occurrence = Appointment.objects.get(series__isnull=False)
+            self.assertIsNotNone(occurrence.reminder_sent_at)
+
+            # Stamped rows are not due any more; the patient without a phone still is
+            self.assertEqual(send_reminders(self.day), {'due': 1, 'sent': 0, 'skipped': 1, 'failed': 0})
+            self.assertEqual(len(self.sent()), 2)
+
+    def test_dry_run_only_counts(self):
+        with tenant_context(self.clinic):
+            self.assertEqual(send_reminders(self.day.isoformat(), dry_run='1'),
+                             {'due': 3, 'sent': 0, 'skipped': 0, 'failed': 0})
+            self.assertEqual(self.sent(), [])
+            self.assertFalse(Appointment.objects.filter(series__isnull=False).exists())
+            self.assertFalse(Appointment.objects.filter(reminder_sent_at__isnull=False).exists())
+
+
+class OccupancyAnalyticsTests(TwoClinicsMixin, TransactionTestCase):
+    """Booked minutes land in the right hour-of-week cells; rates count past appointments only."""
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = User.objects.create_user(username='busy_doctor', password='x', role='DOCTOR',
+                                               clinic_id=self.clinics[0].id)
+        self.monday = timezone.make_aware(datetime(2024, 1, 1))
+        with tenant_context(self.clinics[0]):
+            patient = Patient.objects.get()
+            for start, minutes, status in ((10 * 60 + 30, 105, 'Completed'), (14 * 60, 45, 'NoShow'),
+                                           (15 * 60, 60, 'Cancelled')):
+                moment = self.monday + timedelta(minutes=start)
+                Appointment.objects.create(patient=patient, doctor=self.doctor, Subject='Contrôle', Status=status,
+                                           StartTime=moment, EndTime=moment + timedelta(minutes=minutes))
+
+    def test_heatmap_and_rates(self):
+        with tenant_context(self.clinics[0]):
+            result = occupancy(self.monday, self.monday + timedelta(weeks=1))
+        doctor = next(row for row in result['doctors'] if row['doctor'] == self.doctor.id)
+        self.assertEqual(doctor['heatmap'][0][10:13], [0.5, 1.0, 0.25])
+        self.assertEqual(doctor['heatmap'][0][14:16], [0.75, 0.0])
+        self.assertEqual((doctor['appointments'], doctor['booked_hours']), (2, 2.5))
+        self.assertEqual((doctor['no_show_rate'], doctor['overrun_rate']), (0.5, 0.0))
+
+    def test_other_clinic_sees_nothing(self):
+        with tenant_context(self.clinics[1]):
+            result = occupancy(self.monday, self.monday + timedelta(weeks=1))
+        self.assertEqual(result['clinic']['booked_hours'], 0)
+        self.assertEqual(result['doctors'], [])
+
+
+class PatientCohortTests(TwoClinicsMixin, TransactionTestCase):
+    """Cohort filters on the patient list, last_visit_at upkeep and keyset pages."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='cohort_admin', password='x', role='ADMIN')
+        self.factory = APIRequestFactory()
+        self.clinic = self.clinics[0]
+        today = timezone.localdate()
+        with tenant_context(self.clinic):
+            for i, (age, high_risk) in enumerate(((70, True), (66, False), (40, True), (80, True))):
+                Patient.objects.create(first_name=f'P{i}', last_name='cohort', phone='0600000000', insurance_type='AMO',
+                                       date_of_birth=today.replace(year=today.year - age, day=1), is_high_risk=high_risk)
+
+    def list_patients(self, query):
+        request = self.factory.get(f'/api/medical/patients/?{query}')
+        force_authenticate(request, user=self.user)
+        with tenant_context(self.clinic):
+            return patient_list(request)
+
+    def test_age_and_risk_filters_combine_with_keyset_pages(self):
+        first = self.list_patients('high_risk=1&age_min=65&insurance=AMO&page_size=1&after=').data
+        self.assertEqual([row['first_name'] for row in first['results']], ['P3'])
+        second = self.list_patients(first['next'].partition('?')[2]).data
+        self.assertEqual(([row['first_name'] for row in second['results']], second['next']), (['P0'], None))
+        self.assertEqual(self.list_patients('age_max=150&insurance=CASH').status_code, 400)
+
+    def test_bad_after_is_a_field_error(self):
+        response = self.list_patients('after=abc')
+        self.assertEqual((response.status_code, list(response.data)), (400, ['after']))
+        request = AsyncRequestFactory().get('/api/medical/patients/?after=abc',
+                                            headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'})
+        request.tenant = self.clinic
+        response = async_to_sync(patient_list_async)(request)
+        self.assertEqual((response.status_code, list(json.loads(response.content))), (400, ['after']))
+
+    def test_last_visit_follows_completed_appointments(self):
+        visit = timezone.now() - timedelta(days=30)
+        with tenant_context(self.clinic):
+            patient = Patient.objects.get(first_name='P0')
+            appointment = Appointment.objects.create(patient=patient, doctor=self.user, Subject='Détartrage',
+                                                     StartTime=visit, EndTime=visit + timedelta(minutes=30))
+            patient.refresh_from_db()
+            self.assertIsNone(patient.last_visit_at)
+            appointment.Status = 'Completed'
+            appointment.save()
+            patient.refresh_from_db()
+            self.assertEqual(patient.last_visit_at, visit)
+        since = (visit - timedelta(days=1)).date().isoformat()
+        self.assertEqual([row['first_name'] for row in self.list_patients(f'visited_after={since}').data['results']],
+                         ['P0'])
+
+
+class AppointmentPartitioningTests(TwoClinicsMixin, TransactionTestCase):
+    """Converting a populated clinic keeps its appointments, their links and the ORM's on_delete."""
+
+    def setUp(self):
+        super().setUp()
+        self.clinic = self.clinics[0]
+        self.doctor = User.objects.create_user(username='partition_doctor', password='x', role='DOCTOR',
+                                               clinic_id=self.clinic.id)
+
+    def tearDown(self):
+        self.doctor.delete()
+        super().tearDown()
+
+    def book(self, patient, days):
+        start = timezone.now() + timedelta(days=days)
+        return Appointment.objects.create(patient=patient, doctor=self.doctor, Subject='Soins',
+                                          StartTime=start, EndTime=start + timedelta(minutes=30))
+
+    def test_populated_clinic_is_converted(self):
+        with tenant_context(self.clinic):
+            patient = Patient.objects.get()
+            old, recent = self.book(patient, -70), self.book(patient, 1)
+            step = TreatmentStep.objects.create(appointment=old, tooth_number=11, step_type='filling',
+                                                price=Decimal('100'), status='completed')
+            finding = ToothFinding.objects.create(patient=patient, tooth_number=11, condition='CARIES', found_in=old)
+            invoice = Invoice.objects.create(patient=patient, appointment=old, source_key='appt:test',
+                                             total=Decimal('100'))
+
+            result = partition_appointments(months_ahead=1)
+            self.assertTrue(is_partitioned())
+            self.assertEqual(result['rows'], 2)
+            self.assertIn(partition_name(month_start(timezone.localtime(old.StartTime).date())), result['partitions'])
+            self.assertEqual(set(Appointment.objects.values_list('pk', flat=True)), {old.pk, recent.pk})
+            self.assertGreater(self.book(patient, 2).pk, recent.pk)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'medical_appointment_notify' "
+                               "AND tgrelid = 'medical_appointment'::regclass")
+                self.assertTrue(cursor.fetchone())
+
+            # Without the constraints, on_delete still runs from the ORM
+            Appointment.objects.get(pk=old.pk).delete()
+            self.assertFalse(TreatmentStep.objects.filter(pk=step.pk).exists())
+            finding.refresh_from_db()
+            invoice.refresh_from_db()
+            self.assertEqual((finding.found_in_id, invoice.appointment_id), (None, None))
+
+            # A second run only tops up the future months
+            self.assertEqual(partition_appointments(months_ahead=1)['rows'], 0)
+
+    def test_referencing_columns_match_the_models(self):
+        self.assertEqual({(rel.related_model._meta.db_table, rel.field.column)
+                          for rel in Appointment._meta.related_objects}, REFERENCING_COLUMNS)
+
+    def test_unknown_foreign_key_stops_the_conversion(self):
+        with tenant_context(self.clinic):
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE TABLE extra_link (id serial PRIMARY KEY, '
+                               'appointment_id bigint REFERENCES medical_appointment (id))')
+            with self.assertRaisesMessage(ValueError, 'extra_link.appointment_id'):
+                partition_appointments()
+            self.assertFalse(is_partitioned())
+
+
+class ArchiveTests(TwoClinicsMixin, TransactionTestCase):
+    """Old completed appointments move to the archive with their history; the chart and invoices stay."""
+
+    def setUp(self):
+        super().setUp()
+        self.clinic = self.clinics[0]
+        self.doctors = [User.objects.create_user(username=f'archive_doctor_{i}', password='x', role='DOCTOR',
+                                                 clinic_id=self.clinic.id) for i in range(2)]
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        for doctor in self.doctors:
+            doctor.delete()
+        super().tearDown()
+
+    def book(self, patient, days, status='Completed'):
+        start = timezone.now() + timedelta(days=days)
+        return Appointment.objects.create(patient=patient, doctor=self.doctors[0], Subject='Soins', Status=status,
+                                          StartTime=start, EndTime=start + timedelta(minutes=30))
+
+    def history(self, patient, user):
+        request = self.factory.get(f'/api/medical/patients/{patient.pk}/history/?archived=1')
+        force_authenticate(request, user=user)
+        return patient_history(request, pk=patient.pk).data
+
+    def test_old_completed_appointments_are_archived(self):
+        with tenant_context(self.clinic):
+            patient = Patient.objects.get()
+            old = self.book(patient, -60)
+            kept = [self.book(patient, -60, status='Scheduled'), self.book(patient, -5)]
+            TreatmentStep.objects.create(appointment=old, tooth_number=11, step_type='filling',
+                                         price=Decimal('100'), status='completed')
+            Prescription.objects.create(patient=patient, appointment=old, medications='Amoxicilline')
+            finding = ToothFinding.objects.create(patient=patient, tooth_number=11, condition='CARIES', found_in=old)
+            invoice = Invoice.objects.create(patient=patient, appointment=old, source_key='appt:test',
+                                             total=Decimal('100'))
+
+            self.assertEqual(archive_appointments(older_than_days=30, batch_size=1), 1)
+
+            self.assertEqual(set(Appointment.objects.values_list('pk', flat=True)), {a.pk for a in kept})
+            self.assertFalse(TreatmentStep.objects.exists() or Prescription.objects.exists())
+            finding.refresh_from_db()
+            invoice.refresh_from_db()
+            self.assertEqual((finding.found_in_id, invoice.appointment_id), (None, None))
+
+            document = ArchivedAppointment.objects.get(appointment_id=old.pk).document
+            self.assertEqual([step['tooth_number'] for step in document['treatment_steps']], [11])
+            self.assertEqual([p['medications'] for p in document['prescriptions']], ['Amoxicilline'])
+            self.assertEqual([f['id'] for f in document['findings']], [finding.pk])
+
+            # Read path: the patient timeline, restricted to a doctor's own appointments
+            timeline = self.history(patient, self.doctors[0])
+            self.assertEqual([a['id'] for a in timeline['archived']], [old.pk])
+            self.assertEqual(len(timeline['appointments']), 2)
+            self.assertEqual(self.history(patient, self.doctors[1])['archived'], [])
+
+            # Nothing left past the cutoff
+            self.assertEqual(archive_appointments(older_than_days=30), 0)
+
+
+class AccessLogPartitionTests(TwoClinicsMixin, TransactionTestCase):
+    """Audit rows parked in the DEFAULT partition move to their month; the log stays append-only."""
+
+    def test_future_partitions_move_existing_audit_rows(self):
+        month = add_months(month_start(timezone.localdate()), 2)
+        table = 'medical_patientaccesslog'
+        with tenant_context(self.clinics[0]):
+            self.assertIn(partition_name(month_start(timezone.localdate()), table), existing_partitions(table))
+            PatientAccessLog.objects.create(accessed_at=timezone.make_aware(datetime.combine(month, datetime.min.time())),
+                                            user_id=1, patient_id=1, action='view', path='/api/medical/patients/1/')
+            self.assertIn(partition_name(month, table), ensure_future_partitions())
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT count(*) FROM "{partition_name(month, table)}"')
+                self.assertEqual(cursor.fetchone()[0], 1)
+            with self.assertRaisesMessage(Exception, 'append-only'), transaction.atomic():
+                PatientAccessLog.objects.filter(patient_id=1).delete()
+
+
+class ClientIpTests(SimpleTestCase):
+    """X-Forwarded-For is only believed from TRUSTED_PROXIES, and then read from the right."""
+
+    def ip(self, remote_addr, forwarded=None):
+        headers = {'HTTP_X_FORWARDED_FOR': forwarded} if forwarded else {}
+        return audit.client_ip(RequestFactory().get('/', REMOTE_ADDR=remote_addr, **headers))
+
+    def test_forwarded_header_is_ignored_by_default(self):
+        self.assertEqual(self.ip('203.0.113.7', '198.51.100.1'), '203.0.113.7')
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_right_most_untrusted_hop_behind_a_trusted_proxy(self):
+        # The client forged the first hop; 10.0.0.2 is a second proxy of ours
+        self.assertEqual(self.ip('10.0.0.1', '1.2.3.4, 198.51.100.1, 10.0.0.2'), '198.51.100.1')
+        self.assertEqual(self.ip('10.0.0.1'), '10.0.0.1')
+        self.assertEqual(self.ip('203.0.113.7', '198.51.100.1'), '203.0.113.7')
+        self.assertIsNone(self.ip('10.0.0.1', 'unknown'))
@@ -1,9 +1,18 @@
 from django.urls import path
 from .views import (
-    patient_list, 
-    patient_detail,
-    appointment_list, 
-    appointment_detail,
+    patient_list_async,
+    patient_detail_async,
+    patient_history,
+    patient_export,
+    patient_import,
+    appointment_list_async,
+    appointment_detail_async,
+    appointment_stream,
+    appointment_conflicts,
+    series_list,
+    series_detail,
+    series_occurrence,
+    occupancy_analytics,
     tooth_finding_list, 
     tooth_finding_detail,
     treatment_step_list, 
@@ -14,12 +23,25 @@ from .views import (
 
 urlpatterns = [
     # Patients
-    path('patients/', patient_list, name='patient-list'),
-    path('patients/<int:pk>/', patient_detail, name='patient-detail'),
+    path('patients/', patient_list_async, name='patient-list'),
+    path('patients/<int:pk>/', patient_detail_async, name='patient-detail'),
+    path('patients/<int:pk>/history/', patient_history, name='patient-history'),
+    path('patients/export/', patient_export, name='patient-export'),
+    path('patients/import/', patient_import, name='patient-import'),
 
     # Appointments
-    path('appointments/', appointment_list, name='appointment-list'),
-    path('appointments/<int:pk>/', appointment_detail, name='appointment-detail'),
+    path('appointments/', appointment_list_async, name='appointment-list'),
+    path('appointments/<int:pk>/', appointment_detail_async, name='appointment-detail'),
+    path('appointments/stream/', appointment_stream, name='appointment-stream'),
+    path('appointments/conflicts/', appointment_conflicts, name='appointment-conflicts'),
+
+    # Recurring series (occurrences are expanded into appointments/)
+    path('series/', series_list, name='series-list'),
+    path('series/<int:pk>/', series_detail, name='series-detail'),
+    path('series/<int:pk>/occurrences/', series_occurrence, name='series-occurrence'),
+
+    # Analytics
+    path('analytics/occupancy/', occupancy_analytics, name='occupancy-analytics'),
 
     # Tooth Findings
     path('findings/', tooth_finding_list, name='toothfinding-list'),
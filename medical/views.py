@@ -1,18 +1,45 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time
+import copy
+import io
+import os
+import uuid
+from asgiref.sync import sync_to_async
 from django.db.models import Q
 from rest_framework.pagination import PageNumberPagination
-from .models import Patient, Appointment, ToothFinding, TreatmentStep, Prescription
+from clinics.jobs import enqueue
+from core.async_views import async_reads, aget_object_or_404, apaginate, json_response, requested_page_size
+from core.cache import PATIENTS, aget_or_compute, get_or_compute
+from .models import Patient, Appointment, AppointmentSeries, ToothFinding, TreatmentStep, Prescription
+from .archive import archived_history
+from .audit import record_access
+from .live import event_stream, listen_database
+from .analytics import cached_occupancy
+from .cohorts import AFTER_PARAM, cohort_filters, keyset_response, keyset_slice
+from .recurrence import MAX_WINDOW, active_series, conflicts, expand, materialize, series_slots
+from .imports import SYNC_MAX_BYTES, import_patients
+from .exports import export_stream, FORMATS as EXPORT_FORMATS, ENTITIES as EXPORT_ENTITIES
 from .serializers import (
     PatientDetailSerializer, 
     AppointmentSerializer, 
     ToothFindingSerializer, 
     TreatmentStepSerializer, 
     PrescriptionSerializer,
-    PatientListSerializer
+    PatientListSerializer,
+    OccurrenceSerializer,
+    ConflictSerializer,
+    AppointmentSeriesSerializer,
 )
 
 # --------------------------
@@ -30,25 +57,37 @@ def patient_list(request):
     if request.method == 'GET':
         # 1. STOP prefetching findings. It's not needed for the list.
         # 2. Add select_related or only() to optimize DB query
-        patients = Patient.objects.all().order_by('-id')
+        patients = Patient.objects.select_related('account').order_by('-id')
         
         # Search functionality
         search_query = request.query_params.get('search', None)
         if search_query:
-            patients = patients.filter(
-                Q(first_name__icontains=search_query) | 
-                Q(last_name__icontains=search_query) |
-                Q(phone__icontains=search_query) |
-                Q(cin__icontains=search_query)
-            )
-
-        # 3. Use Pagination
-        paginator = StandardResultsSetPagination()
-        result_page = paginator.paginate_queryset(patients, request)
-        
-        # 4. Use the LIGHTWEIGHT Serializer
-        serializer = PatientListSerializer(result_page, many=True, context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+            patients = patient_search(patients, search_query)
+
+        # Cohort filters (high_risk, age_min, insurance, visited_after...)
+        cohort, errors = cohort_filters(request.query_params)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        patients = patients.filter(**cohort)
+
+        def list_page():
+            # 3. Use Pagination (?after= for keyset pages)
+            paginator = StandardResultsSetPagination()
+            if AFTER_PARAM in request.query_params:
+                page_size = requested_page_size(request.query_params, paginator)
+                rows = list(keyset_slice(patients, request.query_params, page_size))
+                return keyset_response(request.build_absolute_uri(), rows, page_size,
+                                       lambda page: PatientListSerializer(page, many=True, context={'request': request}).data)
+            result_page = paginator.paginate_queryset(patients, request)
+
+            # 4. Use the LIGHTWEIGHT Serializer
+            serializer = PatientListSerializer(result_page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data).data
+
+        # 5. Cache the plain pages; searches and cohorts are too varied to be worth it
+        if search_query or cohort:
+            return Response(list_page())
+        return Response(get_or_compute(PATIENTS, f"list:{request.get_full_path()}", list_page))
     
     elif request.method == 'POST':
         # Create still uses the full serializer or a specific creation one
@@ -64,17 +103,24 @@ def patient_detail(request, pk):
     """
     Retrieve, update or delete a patient instance.
     """
-    patient = get_object_or_404(Patient.objects.prefetch_related('findings'), pk=pk)
-    
+    queryset = Patient.objects.select_related('account').prefetch_related('findings')
+
     if request.method == 'GET':
-        serializer = PatientDetailSerializer(patient, context={'request': request})
-        return Response(serializer.data)
+        def detail():
+            patient = get_object_or_404(queryset, pk=pk)
+            return PatientDetailSerializer(patient, context={'request': request}).data
+        data = get_or_compute(PATIENTS, f"detail:{pk}", detail)
+        record_access(request, pk)
+        return Response(data)
+
+    patient = get_object_or_404(queryset, pk=pk)
     
-    elif request.method in ['PUT', 'PATCH']:
+    if request.method in ['PUT', 'PATCH']:
         partial = request.method == 'PATCH'
         serializer = PatientDetailSerializer(patient, data=request.data, partial=partial, context={'request': request})
         if serializer.is_valid():
             serializer.save()
+            record_access(request, pk, 'update')
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -83,15 +129,141 @@ def patient_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def patient_history(request, pk):
+    """
+    Patient timeline: live appointments, newest first (a doctor only sees their own).
+    Query Param: ?archived=1 also returns the archived (cold storage) appointments.
+    """
+    patient = get_object_or_404(Patient, pk=pk)
+    appointments = (
+        Appointment.objects.filter(patient=patient)
+        .select_related('patient', 'doctor').prefetch_related('treatment_steps')
+        .order_by('-StartTime')
+    )
+    doctor_id = None
+    if request.user.role not in ['ADMIN', 'ASSISTANT']:
+        doctor_id = request.user.id
+        appointments = appointments.filter(doctor_id=doctor_id)
+    data = {'appointments': AppointmentSerializer(appointments, many=True, context={'request': request}).data}
+    if request.query_params.get('archived') in ('1', 'true'):
+        data['archived'] = archived_history(patient.pk, doctor_id)
+    record_access(request, patient.pk)
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def patient_export(request):
+    """
+    Stream the whole clinic's patients and history (ADMIN only).
+    Query Params: ?output=ndjson|csv&entity=patients|appointments|treatments|findings|prescriptions
+    ('output' rather than 'format', which DRF reserves for content negotiation)
+    """
+    if request.user.role != 'ADMIN':
+        return Response({'detail': "Export réservé aux administrateurs."}, status=status.HTTP_403_FORBIDDEN)
+
+    output = request.query_params.get('output', 'ndjson')
+    entity = request.query_params.get('entity', 'patients')
+    if output not in EXPORT_FORMATS or entity not in EXPORT_ENTITIES:
+        return Response({'detail': f"output must be one of {EXPORT_FORMATS}, entity one of {EXPORT_ENTITIES}."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = 'application/x-ndjson' if output == 'ndjson' else 'text/csv'
+    filename = f"{request.tenant.schema_name}_{entity if output == 'csv' else 'patients'}.{output}"
+    record_access(request, None, 'export')
+    response = StreamingHttpResponse(export_stream(output, entity), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def patient_import(request):
+    """
+    Bulk-import patients from an uploaded CSV ('file' field, ADMIN only).
+    Returns the counters and the row-level error report.
+    Query Params: ?dry_run=1, ?background=1 (queue the import and return its job id, 202)
+    Files over SYNC_MAX_BYTES are always queued. Very large migrations should use
+    the import_patients command (process pool).
+    """
+    if request.user.role != 'ADMIN':
+        return Response({'detail': "Import réservé aux administrateurs."}, status=status.HTTP_403_FORBIDDEN)
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'file': ["Aucun fichier CSV fourni."]}, status=status.HTTP_400_BAD_REQUEST)
+
+    dry_run = request.query_params.get('dry_run') in ('1', 'true')
+    if request.query_params.get('background') in ('1', 'true') or upload.size > SYNC_MAX_BYTES:
+        os.makedirs(settings.JOBS_UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(settings.JOBS_UPLOAD_DIR, f'patients-{uuid.uuid4().hex}.csv')
+        with open(path, 'wb') as f:
+            for part in upload.chunks():
+                f.write(part)
+        job = enqueue('medical.imports.import_patients_file', user=request.user, path=path, dry_run=dry_run)
+        return Response({'job_id': job.pk}, status=status.HTTP_202_ACCEPTED)
+
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    report = import_patients(stream, processes=1, dry_run=dry_run)
+
+    response_status = status.HTTP_201_CREATED if report.created else status.HTTP_200_OK
+    return Response(report.as_dict(), status=response_status)
+
+
 # --------------------------
 # Appointment Views
 # --------------------------
 
+def parse_moment(value):
+    """ISO date or datetime query param -> aware datetime (dates mean midnight), None if invalid."""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def appointment_window(params):
+    """?start= / ?end= -> (StartTime filter, errors)."""
+    window = {}
+    for param, lookup in (('start', 'StartTime__gte'), ('end', 'StartTime__lt')):
+        value = params.get(param)
+        if value:
+            moment = parse_moment(value)
+            if moment is None:
+                return None, {param: ["Date invalide (format ISO attendu)."]}
+            window[lookup] = moment
+    if len(window) == 2 and window['StartTime__lt'] - window['StartTime__gte'] > MAX_WINDOW:
+        return None, {'end': [f"Fenêtre limitée à {MAX_WINDOW.days} jours."]}
+    return window, None
+
+
+def calendar_occurrences(user, window):
+    """Occurrences of recurring series in a bounded calendar window, serialized like appointments."""
+    if len(window) != 2:
+        return []
+    series = active_series(window['StartTime__gte'], window['StartTime__lt'])
+    if user.role not in ['ADMIN', 'ASSISTANT']:
+        series = series.filter(doctor=user)
+    return OccurrenceSerializer(expand(series, window['StartTime__gte'], window['StartTime__lt']), many=True).data
+
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def appointment_list(request):
     """
     List appointments (with RBAC) or create a new appointment.
+    Query Params: ?start=<ISO date/datetime>&end=<ISO date/datetime> (calendar window,
+    only scans the matching months when the clinic's appointments are partitioned).
+    With both, occurrences of recurring series are expanded in (id null, see medical/recurrence.py).
     """
     user = request.user
     
@@ -105,9 +277,14 @@ def appointment_list(request):
         else:
             # Doctor sees only their own appointments
             appointments = qs.filter(doctor=user)
+
+        window, errors = appointment_window(request.query_params)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        appointments = appointments.filter(**window)
             
         serializer = AppointmentSerializer(appointments, many=True, context={'request': request})
-        return Response(serializer.data)
+        return Response(serializer.data + calendar_occurrences(user, window))
         
     elif request.method == 'POST':
         serializer = AppointmentSerializer(data=request.data, context={'request': request})
@@ -149,6 +326,170 @@ def appointment_detail(request, pk):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+# --------------------------
+# Recurring Series Views
+# --------------------------
+
+def conflict_response(busy):
+    return Response(
+        {'detail': "Conflit d'horaire avec d'autres rendez-vous du médecin.",
+         'conflicts': ConflictSerializer(busy, many=True).data},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def series_queryset(user):
+    series = AppointmentSeries.objects.select_related('patient', 'doctor')
+    if user.role not in ['ADMIN', 'ASSISTANT']:
+        series = series.filter(doctor=user)
+    return series
+
+
+# Fields that move occurrences: changing them re-runs the conflict check
+SERIES_SCHEDULE_FIELDS = ('doctor_id', 'StartTime', 'EndTime', 'frequency', 'interval', 'until')
+
+
+def save_series(serializer, instance=None):
+    """Save a valid series unless its upcoming occurrences collide: (series, 409 response)."""
+    candidate = copy.copy(instance) if instance else AppointmentSeries()
+    for field, value in serializer.validated_data.items():
+        setattr(candidate, field, value)
+    if instance is None or any(getattr(candidate, f) != getattr(instance, f) for f in SERIES_SCHEDULE_FIELDS):
+        busy = conflicts(candidate.doctor_id, series_slots(candidate), series_id=candidate.pk)
+        if busy:
+            return None, conflict_response(busy)
+    return serializer.save(), None
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def series_list(request):
+    """
+    List recurring appointment series (with RBAC) or create one.
+    Query Param: ?patient=<id>. Creation answers 409 with the conflicting
+    appointments when upcoming occurrences collide with the doctor's calendar.
+    """
+    if request.method == 'GET':
+        series = series_queryset(request.user).order_by('StartTime')
+        patient_id = request.query_params.get('patient')
+        if patient_id:
+            series = series.filter(patient_id=patient_id)
+        return Response(AppointmentSeriesSerializer(series, many=True, context={'request': request}).data)
+
+    serializer = AppointmentSeriesSerializer(data=request.data, context={'request': request})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    series, error = save_series(serializer)
+    if error:
+        return error
+    return Response(AppointmentSeriesSerializer(series, context={'request': request}).data,
+                    status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def series_detail(request, pk):
+    """
+    Retrieve, update or delete a series. Changes apply to every occurrence not
+    materialized yet; materialized ones are plain appointments and stay as they are
+    (they lose their series link on delete).
+    """
+    series = get_object_or_404(series_queryset(request.user), pk=pk)
+
+    if request.method == 'GET':
+        return Response(AppointmentSeriesSerializer(series, context={'request': request}).data)
+
+    elif request.method in ['PUT', 'PATCH']:
+        serializer = AppointmentSeriesSerializer(series, data=request.data, partial=request.method == 'PATCH',
+                                                 context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        series, error = save_series(serializer, series)
+        if error:
+            return error
+        return Response(AppointmentSeriesSerializer(series, context={'request': request}).data)
+
+    elif request.method == 'DELETE':
+        series.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def series_occurrence(request, pk):
+    """
+    Materialize one occurrence to modify or complete it.
+    Body: {"occurrence_start": <ISO datetime of the original slot>, ...appointment fields to change}.
+    Returns the appointment (201 when created); later changes go through appointments/<id>/.
+    """
+    series = get_object_or_404(series_queryset(request.user), pk=pk)
+    slot = parse_datetime(str(request.data.get('occurrence_start', '')))
+    if slot is None:
+        return Response({'occurrence_start': ["Date invalide (format ISO attendu)."]}, status=status.HTTP_400_BAD_REQUEST)
+    if timezone.is_naive(slot):
+        slot = timezone.make_aware(slot)
+    changes = {key: value for key, value in request.data.items() if key != 'occurrence_start'}
+
+    with transaction.atomic():
+        try:
+            appointment, created = materialize(series, slot)
+        except ValueError:
+            return Response({'occurrence_start': ["Aucune séance de la série à cette date."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializer = AppointmentSerializer(appointment, data=changes, partial=True, context={'request': request})
+        if not serializer.is_valid():
+            transaction.set_rollback(True)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+    return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def appointment_conflicts(request):
+    """
+    Appointments and series occurrences of a doctor overlapping a slot.
+    Query Params: ?doctor=<id>&start=<ISO>&end=<ISO>[&exclude=<appointment id>]
+    """
+    start, end = (parse_moment(request.query_params.get(param, '')) for param in ('start', 'end'))
+    if start is None or end is None or end <= start:
+        return Response({'detail': "Paramètres start / end invalides."}, status=status.HTTP_400_BAD_REQUEST)
+    doctor_id = request.user.id if request.user.role not in ['ADMIN', 'ASSISTANT'] else request.query_params.get('doctor')
+    exclude = request.query_params.get('exclude')
+    try:
+        doctor_id = int(doctor_id)
+        exclude = int(exclude) if exclude else None
+    except (TypeError, ValueError):
+        return Response({'detail': "Paramètres doctor / exclude invalides."}, status=status.HTTP_400_BAD_REQUEST)
+    busy = conflicts(doctor_id, [(start, end)], appointment_id=exclude)
+    return Response(ConflictSerializer(busy, many=True).data)
+
+
+# --------------------------
+# Analytics Views
+# --------------------------
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def occupancy_analytics(request):
+    """
+    Booked vs free time per doctor and hour of the week, no-show and overrun rates.
+    Query Params: ?start=<date>&end=<date>[&doctor=<id>] (at most MAX_WINDOW)
+    """
+    if request.user.role != 'ADMIN':
+        return Response({'detail': "Statistiques réservées aux administrateurs."}, status=status.HTTP_403_FORBIDDEN)
+    start, end = (parse_moment(request.query_params.get(param, '')) for param in ('start', 'end'))
+    if start is None or end is None or end <= start or end - start > MAX_WINDOW:
+        return Response({'detail': f"Période invalide (start / end, {MAX_WINDOW.days} jours au plus)."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    doctor_id = request.query_params.get('doctor')
+    try:
+        doctor_id = int(doctor_id) if doctor_id else None
+    except ValueError:
+        return Response({'detail': "Paramètre doctor invalide."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(cached_occupancy(start, end, doctor_id))
+
+
 # --------------------------
 # Tooth Finding Views
 # --------------------------
@@ -295,3 +636,110 @@ def prescription_detail(request, pk):
     elif request.method == 'DELETE':
         prescription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# --------------------------
+# Async (ASGI) Read Views
+# --------------------------
+# GET of the hot endpoints without holding a thread (see core/async_views.py).
+# Other methods fall through to the DRF views above; the URLs point here.
+
+APPOINTMENT_QUERYSET = Appointment.objects.select_related('patient', 'doctor').prefetch_related('treatment_steps')
+
+
+def patient_search(patients, search_query):
+    return patients.filter(
+        Q(first_name__icontains=search_query) |
+        Q(last_name__icontains=search_query) |
+        Q(phone__icontains=search_query) |
+        Q(cin__icontains=search_query)
+    )
+
+
+@async_reads(patient_list)
+async def patient_list_async(request):
+    patients = Patient.objects.select_related('account').order_by('-id')
+    search_query = request.GET.get('search')
+    if search_query:
+        patients = patient_search(patients, search_query)
+    cohort, errors = cohort_filters(request.GET)
+    if errors:
+        return json_response(errors, status.HTTP_400_BAD_REQUEST)
+    patients = patients.filter(**cohort)
+
+    def serialize(page):
+        return PatientListSerializer(page, many=True).data
+
+    async def list_page():
+        if AFTER_PARAM in request.GET:
+            page_size = requested_page_size(request.GET, StandardResultsSetPagination())
+            rows = [patient async for patient in keyset_slice(patients, request.GET, page_size)]
+            return keyset_response(request.build_absolute_uri(), rows, page_size, serialize)
+        return await apaginate(request, patients, serialize, StandardResultsSetPagination)
+
+    # Same cache entries as patient_list
+    if search_query or cohort:
+        return json_response(await list_page())
+    return json_response(await aget_or_compute(PATIENTS, f"list:{request.get_full_path()}", list_page))
+
+
+@async_reads(patient_detail)
+async def patient_detail_async(request, pk):
+    queryset = Patient.objects.select_related('account').prefetch_related('findings')
+
+    async def detail():
+        return PatientDetailSerializer(await aget_object_or_404(queryset, pk=pk)).data
+
+    data = await aget_or_compute(PATIENTS, f"detail:{pk}", detail)
+    await sync_to_async(record_access)(request, pk)
+    return json_response(data)
+
+
+@async_reads(appointment_list)
+async def appointment_list_async(request):
+    appointments = APPOINTMENT_QUERYSET.all()
+    if request.user.role not in ['ADMIN', 'ASSISTANT']:
+        appointments = appointments.filter(doctor=request.user)
+
+    window, errors = appointment_window(request.GET)
+    if errors:
+        return json_response(errors, status.HTTP_400_BAD_REQUEST)
+    appointments = [appointment async for appointment in appointments.filter(**window)]
+    occurrences = await sync_to_async(calendar_occurrences)(request.user, window)
+    return json_response(AppointmentSerializer(appointments, many=True).data + occurrences)
+
+
+@async_reads(appointment_detail)
+async def appointment_detail_async(request, pk):
+    lookup = {'pk': pk}
+    if request.user.role not in ['ADMIN', 'ASSISTANT']:
+        lookup['doctor'] = request.user
+    appointment = await aget_object_or_404(APPOINTMENT_QUERYSET, **lookup)
+    return json_response(AppointmentSerializer(appointment).data)
+
+
+@async_reads(None)
+async def appointment_stream(request):
+    """
+    Live calendar (server-sent events, see medical/live.py): replaces polling
+    appointments/. ADMIN / ASSISTANT: whole clinic, or ?doctor=<id>; doctors:
+    their own appointments. Needs an ASGI server.
+    """
+    if not isinstance(request, ASGIRequest):
+        return json_response({'detail': "Le flux en direct nécessite un serveur ASGI."}, status.HTTP_501_NOT_IMPLEMENTED)
+
+    doctor_id = None
+    if request.user.role not in ['ADMIN', 'ASSISTANT']:
+        doctor_id = request.user.id
+    elif request.GET.get('doctor'):
+        try:
+            doctor_id = int(request.GET['doctor'])
+        except ValueError:
+            return json_response({'doctor': ["Identifiant invalide."]}, status.HTTP_400_BAD_REQUEST)
+
+    listen_database()  # fails loudly before streaming, rather than a stream that never updates
+    response = StreamingHttpResponse(event_stream(request.tenant.schema_name, doctor_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
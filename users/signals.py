@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from core.cache import ROSTER, invalidate
+from .models import User
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_roster(sender, instance, **kwargs):
+    # Users live in the public schema: invalidate the roster of the clinic they belong to
+    if not instance.clinic_id:
+        return
+    from clinics.models import Clinic
+    schema_name = Clinic.objects.filter(id=instance.clinic_id).values_list('schema_name', flat=True).first()
+    if schema_name:
+        invalidate(ROSTER, schema_name=schema_name)
@@ -1,7 +1,7 @@
 from django.urls import path
-from .views import user_list, user_detail
+from .views import user_list_async, user_detail_async
 
 urlpatterns = [
-    path('users/', user_list, name='user-list'),
-    path('users/<int:pk>/', user_detail, name='user-detail'),
+    path('users/', user_list_async, name='user-list'),
+    path('users/<int:pk>/', user_detail_async, name='user-detail'),
 ]
\ No newline at end of file
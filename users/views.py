@@ -5,6 +5,8 @@ from rest_framework import status
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.shortcuts import get_object_or_404
 from django.db import connection
+from core.async_views import async_reads, aget_object_or_404, json_response
+from core.cache import ROSTER, aget_or_compute, get_or_compute
 from .models import User
 from .serializers import CustomTokenObtainPairSerializer, UserSerializer
 
@@ -29,9 +31,11 @@ def user_list(request):
     role = request.query_params.get('role')
     if role:
         queryset = queryset.filter(role=role)
-    
-    serializer = UserSerializer(queryset, many=True)
-    return Response(serializer.data)
+
+    if current_tenant.schema_name == 'public':
+        return Response(UserSerializer(queryset, many=True).data)
+    # The clinic roster barely changes; served from the tenant cache
+    return Response(get_or_compute(ROSTER, f"list:{role}", lambda: UserSerializer(queryset, many=True).data))
 
 
 @api_view(['GET'])
@@ -47,4 +51,36 @@ def user_detail(request, pk):
         user = get_object_or_404(User, pk=pk)
     
     serializer = UserSerializer(user)
-    return Response(serializer.data)
\ No newline at end of file
+    return Response(serializer.data)
+
+
+# --------------------------
+# Async (ASGI) Read Views
+# --------------------------
+# See core/async_views.py; writes fall through to the DRF views above.
+
+@async_reads(user_list)
+async def user_list_async(request):
+    current_tenant = request.tenant
+    queryset = User.objects.all()
+    if current_tenant.schema_name != 'public':
+        queryset = queryset.filter(clinic_id=current_tenant.id)
+
+    role = request.GET.get('role')
+    if role:
+        queryset = queryset.filter(role=role)
+
+    async def roster():
+        return UserSerializer([user async for user in queryset], many=True).data
+
+    if current_tenant.schema_name == 'public':
+        return json_response(await roster())
+    return json_response(await aget_or_compute(ROSTER, f"list:{role}", roster))
+
+
+@async_reads(user_detail)
+async def user_detail_async(request, pk):
+    lookup = {'pk': pk}
+    if request.tenant.schema_name != 'public':
+        lookup['clinic_id'] = request.tenant.id
+    return json_response(UserSerializer(await aget_object_or_404(User.objects.all(), **lookup)).data)